@@ -0,0 +1,97 @@
+"""Micro-benchmark of record preprocessing, legacy clean_data vs schema converters.
+
+Usage: python benchmarks/bench_preprocess.py [records]
+"""
+
+import ast
+import copy
+import datetime
+import json
+import sys
+import timeit
+
+from target_dynamics_finance.preprocess import build_converters, preprocess
+
+SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {
+        "dataAreaId": {"type": ["string", "null"]},
+        "IsApproved": {"type": ["string", "null"]},
+        "InvoiceDate": {"type": ["string", "null"], "format": "date"},
+        "DueDate": {"type": ["string", "null"], "format": "date"},
+        "InvoiceNumber": {"type": ["string", "null"]},
+        "VendorAccount": {"type": ["string", "null"]},
+        "InvoiceAccount": {"type": ["string", "null"]},
+        "Currency": {"type": ["string", "null"]},
+        "Amount": {"type": ["number", "null"]},
+        "VendorInvoiceLines": {"type": ["array", "null"], "items": {"type": "object"}},
+        "attachments": {"type": ["array", "null"], "items": {"type": "object"}},
+    },
+}
+
+RECORD = {
+    "dataAreaId": "nor",
+    "IsApproved": "Yes",
+    "InvoiceDate": "2024-01-17",
+    "DueDate": "2024-01-17",
+    "InvoiceNumber": "1234567",
+    "VendorAccount": "110096",
+    "InvoiceAccount": "110096",
+    "Currency": "NOK",
+    "Amount": 25.0,
+    "VendorInvoiceLines": json.dumps(
+        [{"dataAreaId": "nor", "ItemName": f"Item {i}", "UnitPrice": 25.0, "PriceUnit": 1} for i in range(5)]
+    ),
+    "attachments": [],
+}
+
+
+# preprocessing as it was done before the converter table
+def legacy_parse_objs(obj):
+    try:
+        try:
+            return ast.literal_eval(obj)
+        except:
+            return json.loads(obj)
+    except:
+        return obj
+
+
+def legacy_convert_date(date):
+    if date:
+        date = datetime.datetime.strptime(date)
+        date = date.strftime("%Y-%m-%d")
+        return date
+
+
+def legacy_clean_data(value):
+    try:
+        value = legacy_convert_date(value)
+    except:
+        if isinstance(value, str) and (value.startswith("[") or value.startswith("{")):
+            value = legacy_parse_objs(value)
+    return value
+
+
+def legacy_preprocess(record):
+    for key, value in record.items():
+        record[key] = legacy_clean_data(value)
+    return record
+
+
+def main(records: int = 10000) -> None:
+    converters = build_converters(SCHEMA)
+    inputs = [copy.copy(RECORD) for _ in range(records * 2)]
+    legacy_inputs, new_inputs = iter(inputs[:records]), iter(inputs[records:])
+
+    legacy = timeit.timeit(lambda: legacy_preprocess(next(legacy_inputs)), number=records)
+    new = timeit.timeit(lambda: preprocess(next(new_inputs), converters), number=records)
+
+    print(f"records: {records}")
+    print(f"legacy clean_data:  {legacy / records * 1e6:8.2f} us/record")
+    print(f"schema converters:  {new / records * 1e6:8.2f} us/record")
+    print(f"speedup:            {legacy / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,86 @@
+"""Replay a captured run offline and compare its requests and wall time to the capture.
+
+Capture a run with `http_capture_path` in the target config, then:
+
+Usage:
+    python benchmarks/bench_replay.py --cassette run.jsonl --config config.json --input data.singer
+    python benchmarks/bench_replay.py --cassette run.jsonl --config config.json --input data.singer \\
+        --latency-scale 0 --config-extra '{"max_workers": 8}' --json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from target_dynamics_finance.cassette import Cassette  # noqa: E402
+
+
+def run(args) -> dict:
+    with open(args.config) as f:
+        config = json.load(f)
+    config.pop("http_capture_path", None)
+    config.update(json.loads(args.config_extra))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        replay_path = os.path.join(tmp, "replay.jsonl")
+        config.update(
+            http_replay_path=os.path.abspath(args.cassette),
+            http_capture_path=replay_path,
+            replay_latency_scale=args.latency_scale,
+        )
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+
+        start = time.monotonic()
+        with open(args.input) as stdin:
+            result = subprocess.run(
+                [sys.executable, "-m", "target_dynamics_finance.target", "--config", config_path],
+                stdin=stdin,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE if not args.verbose else None,
+            )
+        wall = time.monotonic() - start
+        if result.returncode:
+            sys.stderr.write(result.stderr.decode() if result.stderr else "")
+            raise SystemExit(f"target exited with {result.returncode}")
+        replay = Cassette.load(replay_path).stats() if os.path.exists(replay_path) else Cassette([]).stats()
+
+    return {
+        "captured": Cassette.load(args.cassette).stats(),
+        "replayed": dict(replay, wall_seconds=round(wall, 3)),
+        "latency_scale": args.latency_scale,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cassette", required=True, help="cassette captured with http_capture_path")
+    parser.add_argument("--config", required=True, help="config of the captured run")
+    parser.add_argument("--input", required=True, help="Singer input of the captured run")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="0 replays without latency")
+    parser.add_argument("--config-extra", default="{}", help="JSON merged into the target config")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="show the target logs")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for run_name in ("captured", "replayed"):
+            stats = report[run_name]
+            print(
+                f"{run_name:>9}: {stats['requests']} requests, {stats['request_seconds']} s in requests, "
+                f"{stats['wall_seconds']} s wall"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cold-start benchmark of the target: import time and `--about` wall time.
+
+Usage:
+    python benchmarks/bench_startup.py --json > startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.2 --budget-ms 800
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from target_dynamics_finance.startup import import_times, startup_report  # noqa: E402
+
+
+def cold_start_ms(args) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "from target_dynamics_finance.startup import main; main()", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def run(runs: int) -> dict:
+    imports = [sum(self_us for _, self_us, _ in import_times()) / 1000 for _ in range(runs)]
+    about = [cold_start_ms(["--about"]) for _ in range(runs)]
+    return {
+        "runs": runs,
+        "import_ms": round(statistics.median(imports), 1),
+        "about_ms": round(statistics.median(about), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="report from a previous --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--budget-ms", type=float, help="fail if the median --about run is slower")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(startup_report(import_times()))
+        print(f"median import: {report['import_ms']} ms, median --about: {report['about_ms']} ms")
+
+    failures = []
+    if args.budget_ms and report["about_ms"] > args.budget_ms:
+        failures.append(f"--about took {report['about_ms']} ms, over the {args.budget_ms} ms budget")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("import_ms", "about_ms"):
+            if report[key] > baseline[key] * (1 + args.tolerance):
+                failures.append(f"{key} {report[key]} > baseline {baseline[key]}")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""End-to-end throughput benchmark of TargetDynamicsFinance against the mock server.
+
+Usage:
+    python benchmarks/bench_target.py --invoices 2000 --lines 5 --latency-ms 10
+    python benchmarks/bench_target.py --config-extra '{"max_workers": 8}' --json > run.json
+    python benchmarks/bench_target.py --baseline run.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from generate_stream import ATTACHMENT_NAME, generate  # noqa: E402
+from mock_server import start_server  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def run(args) -> dict:
+    server = start_server(
+        latency_ms=args.latency_ms,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        gzip_responses=args.gzip_responses,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            "subdomain": "bench",
+            "base_url": server.base_url,
+            "auth_url": f"{server.base_url}/common/oauth2/token",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "input_path": tmp,
+        }
+        config.update(json.loads(args.config_extra))
+        config_path = os.path.join(tmp, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+
+        if args.attachments:
+            with open(os.path.join(tmp, ATTACHMENT_NAME), "wb") as f:
+                f.write(os.urandom(args.attachment_kb * 1024))
+
+        data_path = os.path.join(tmp, "data.singer")
+        with open(data_path, "w") as f:
+            generate(
+                f,
+                invoices=args.invoices,
+                lines=args.lines,
+                vendors=args.vendors,
+                vendor_records=args.vendor_records,
+                companies=args.companies,
+                attachments=args.attachments,
+                seed=args.seed,
+            )
+
+        start = time.monotonic()
+        with open(data_path) as stdin:
+            result = subprocess.run(
+                [sys.executable, "-m", "target_dynamics_finance.target", "--config", config_path],
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE if not args.verbose else None,
+                cwd=tmp,
+            )
+        wall = time.monotonic() - start
+        server.shutdown()
+
+    if result.returncode:
+        sys.stderr.write(result.stderr.decode() if result.stderr else "")
+        raise SystemExit(f"target exited with {result.returncode}")
+
+    state = {}
+    for line in result.stdout.decode().splitlines():
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        # the target emits state values, wrapped or not in a STATE message
+        state = message.get("value", state) if message.get("type") == "STATE" else message
+
+    stats = server.stats.to_dict()
+    records = args.invoices + args.vendor_records
+    requests = sum(stats["requests"].values())
+    latencies = sorted(stats["latencies"])
+    return {
+        "records": records,
+        "wall_seconds": round(wall, 3),
+        "records_per_second": round(records / wall, 2),
+        "requests": requests,
+        "requests_per_record": round(requests / records, 3) if records else 0,
+        "requests_by_endpoint": stats["requests"],
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "bytes_sent": stats["bytes_received"],
+        "throttled": stats["throttled"],
+        "injected_errors": stats["errors"],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "summary": state.get("summary", {}),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Return the regressions of a report against a baseline report."""
+    regressions = []
+    if report["records_per_second"] < baseline["records_per_second"] * (1 - tolerance):
+        regressions.append(
+            f"records/sec {report['records_per_second']} < baseline {baseline['records_per_second']}"
+        )
+    if report["requests_per_record"] > baseline["requests_per_record"] * (1 + tolerance):
+        regressions.append(
+            f"requests/record {report['requests_per_record']} > baseline {baseline['requests_per_record']}"
+        )
+    if report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {report['peak_rss_mb']} MB > baseline {baseline['peak_rss_mb']} MB")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=1000)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--vendor-records", type=int, default=0)
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--attachments", type=int, default=0)
+    parser.add_argument("--attachment-kb", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gzip-responses", action="store_true", help="compress the mock server responses")
+    parser.add_argument("--config-extra", default="{}", help="JSON merged into the target config")
+    parser.add_argument("--baseline", help="report from a previous --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="show the target logs")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>22}: {value}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Generate synthetic Singer streams shaped like payload_example/data.singer.
+
+Usage: python benchmarks/generate_stream.py --invoices 1000 --lines 5 --vendors 200 > data.singer
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+from typing import IO
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "payload_example", "data.singer")
+ATTACHMENT_NAME = "bench-attachment.pdf"
+
+
+def example_messages() -> dict:
+    """Return the SCHEMA and first RECORD of every stream of the example payload."""
+    streams = {}
+    with open(EXAMPLE) as f:
+        for line in f:
+            message = json.loads(line)
+            if message["type"] == "SCHEMA":
+                streams[message["stream"]] = {"schema": message}
+            elif message["type"] == "RECORD":
+                streams[message["stream"]].setdefault("record", message["record"])
+    return streams
+
+
+def with_properties(schema_message: dict, **properties) -> dict:
+    """Copy of a SCHEMA message declaring extra properties the generator sets."""
+    schema_message = copy.deepcopy(schema_message)
+    schema_message["schema"]["properties"].update(properties)
+    return schema_message
+
+
+def generate(
+    out: IO,
+    invoices: int = 1000,
+    lines: int = 5,
+    vendors: int = 200,
+    vendor_records: int = 0,
+    companies: int = 1,
+    attachments: int = 0,
+    seed: int = 0,
+) -> None:
+    rng = random.Random(seed)
+    streams = example_messages()
+    data_area_ids = [f"c{index:02d}" for index in range(companies)]
+
+    if vendor_records:
+        schema = with_properties(streams["VendorsV3"]["schema"], VendorAccountNumber={"type": ["string", "null"]})
+        out.write(json.dumps(schema) + "\n")
+        template = streams["VendorsV3"]["record"]
+        for index in range(vendor_records):
+            record = dict(template)
+            record["dataAreaId"] = rng.choice(data_area_ids)
+            record["VendorOrganizationName"] = f"Vendor {index}"
+            # half of the vendors already exist and are patched
+            if index % 2:
+                record["VendorAccountNumber"] = f"V{index % vendors:06d}"
+            out.write(json.dumps({"type": "RECORD", "stream": "VendorsV3", "record": record}) + "\n")
+
+    schema = with_properties(
+        streams["VendorInvoiceHeaders"]["schema"],
+        attachments={
+            "type": ["array", "null"],
+            "items": {"type": ["object", "null"], "properties": {"Name": {"type": ["string", "null"]}}},
+        },
+    )
+    out.write(json.dumps(schema) + "\n")
+    template = streams["VendorInvoiceHeaders"]["record"]
+    line_template = template["VendorInvoiceLines"][0]
+    for index in range(invoices):
+        record = dict(template)
+        account = f"V{rng.randrange(vendors):06d}"
+        record["dataAreaId"] = rng.choice(data_area_ids)
+        record["InvoiceNumber"] = f"INV{index:08d}"
+        record["VendorAccount"] = account
+        record["InvoiceAccount"] = account
+        record["VendorInvoiceLines"] = [
+            dict(line_template, ItemName=f"Item {line}", UnitPrice=round(rng.uniform(1, 500), 2))
+            for line in range(lines)
+        ]
+        # attachment files are created by the benchmark runner in input_path
+        record["attachments"] = [{"Name": ATTACHMENT_NAME} for _ in range(attachments)]
+        out.write(json.dumps({"type": "RECORD", "stream": "VendorInvoiceHeaders", "record": record}) + "\n")
+
+    out.write(json.dumps({"type": "STATE", "value": {}}) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=1000)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--vendor-records", type=int, default=0)
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--attachments", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(
+        sys.stdout,
+        invoices=args.invoices,
+        lines=args.lines,
+        vendors=args.vendors,
+        vendor_records=args.vendor_records,
+        companies=args.companies,
+        attachments=args.attachments,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
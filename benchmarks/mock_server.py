@@ -0,0 +1,352 @@
+"""Local stand-in for the Dynamics token endpoint and OData entities.
+
+Usage: python benchmarks/mock_server.py --port 8765 --latency-ms 20 --throttle-rate 0.01
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# entity sets missing from $metadata are sent without validation
+METADATA = b"""<?xml version="1.0" encoding="utf-8"?>
+<edmx:Edmx Version="4.0" xmlns:edmx="http://docs.oasis-open.org/odata/ns/edmx">
+  <edmx:DataServices>
+    <Schema Namespace="Microsoft.Dynamics.DataEntities" xmlns="http://docs.oasis-open.org/odata/ns/edm">
+      <EntityContainer Name="Resources" />
+    </Schema>
+  </edmx:DataServices>
+</edmx:Edmx>
+"""
+
+ENTITIES = [
+    "VendorsV3",
+    "VendorInvoiceHeaders",
+    "VendorInvoiceLines",
+    "VendorInvoiceDocumentAttachments",
+]
+
+
+class MockStats:
+    """Requests and latencies seen by the mock server."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latencies = []
+        self.bytes_received = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def record(self, key: str, latency: float, size: int) -> None:
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latencies.append(latency)
+            self.bytes_received += size
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "latencies": list(self.latencies),
+                "bytes_received": self.bytes_received,
+                "throttled": self.throttled,
+                "errors": self.errors,
+            }
+
+
+class MockDynamicsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency_ms=0.0,
+        throttle_rate=0.0,
+        error_rate=0.0,
+        seed=None,
+        gzip_responses=False,
+        retry_after="1",
+    ):
+        super().__init__(address, MockDynamicsHandler)
+        self.latency = latency_ms / 1000
+        self.gzip_responses = gzip_responses
+        self.throttle_rate = throttle_rate
+        # Retry-After header of throttled responses
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = MockStats()
+        self.sequence = 0
+        self.sequence_lock = threading.Lock()
+        # DMF packages uploaded to the blob storage and their executions
+        self.blobs = {}
+        self.executions = {}
+        # vendors created by POST, found by lookups once they exist
+        self.created_vendors = []
+        # dataAreaId of every created invoice header, by HeaderReference
+        self.invoice_companies = {}
+        # "METHOD path?query" of every request, in the order they were answered
+        self.request_log = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self) -> str:
+        with self.sequence_lock:
+            self.sequence += 1
+            return f"{self.sequence:09d}"
+
+
+class MockDynamicsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # buffer the status line, headers and body into one send, written headers and
+    # body apart wait on delayed ACKs and would cap the run at ~25 requests/sec
+    wbufsize = -1
+    server: MockDynamicsServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status: int, body=None, content_type="application/json", headers=None):
+        data = b""
+        if body is not None:
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if data:
+            self.send_header("Content-Type", content_type)
+            if self.server.gzip_responses and "gzip" in self.headers.get("Accept-Encoding", ""):
+                data = gzip.compress(data)
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str) -> None:
+        start = time.monotonic()
+        body = self._read_body()
+        url = urlparse(self.path)
+        path = url.path
+
+        if path == "/__stats":
+            return self._send(200, self.server.stats.to_dict())
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        key = f"{method} {path.split('(')[0]}"
+        try:
+            if path.endswith("/oauth2/token"):
+                return self._send(200, {"access_token": "mock-token", "expires_in": 3600, "token_type": "Bearer"})
+
+            draw = self.server.random.random()
+            if draw < self.server.throttle_rate:
+                with self.server.stats.lock:
+                    self.server.stats.throttled += 1
+                return self._send(429, {"error": {"message": "throttled"}}, headers={"Retry-After": self.server.retry_after})
+            if draw < self.server.throttle_rate + self.server.error_rate:
+                with self.server.stats.lock:
+                    self.server.stats.errors += 1
+                return self._send(500, {"error": {"message": "injected error"}})
+
+            if path.startswith("/blob/"):
+                return self._blob(method, path, body)
+            if "/DataManagementDefinitionGroups/" in path:
+                return self._dmf(path.rsplit(".", 1)[-1], json.loads(body or b"{}"))
+            if path.startswith("/errors/"):
+                return self._send(200, self.server.executions[path.split("/")[-1]]["errors"], content_type="text/csv")
+            if path.endswith("/$metadata"):
+                return self._send(200, METADATA, content_type="application/xml")
+            if path.endswith("/$batch"):
+                return self._batch(body)
+            return self._entity(method, path, parse_qs(url.query), body)
+        finally:
+            self.server.stats.record(key, time.monotonic() - start, len(body))
+            self.server.request_log.append(f"{method} {self.path}")
+
+    def _entity(self, method: str, path: str, query: dict, body: bytes) -> None:
+        entity = path.rstrip("/").split("/")[-1].split("(")[0]
+        if entity not in ENTITIES:
+            return self._send(404, {"error": {"message": f"Resource not found for the segment '{entity}'."}})
+        if method == "GET":
+            return self._send(200, {"value": self._query(entity, query)})
+        if method in ("PATCH", "DELETE"):
+            return self._send(204)
+        record = json.loads(body or b"{}")
+        # like DMF rows, creates with a value starting with FAIL fail
+        if any(str(value).startswith("FAIL") for value in record.values()):
+            return self._send(400, {"error": {"message": f"Write failed for table row of type '{entity}'."}})
+        if entity == "VendorInvoiceHeaders":
+            record["HeaderReference"] = self.server.next_id()
+            self.server.invoice_companies[record["HeaderReference"]] = record.get("dataAreaId")
+        elif entity == "VendorsV3":
+            record.setdefault("VendorAccountNumber", f"V{self.server.next_id()}")
+            self.server.created_vendors.append(record)
+        record.pop("FileContents", None)
+        return self._send(201, record)
+
+    def _blob(self, method: str, path: str, body: bytes) -> None:
+        name = path.split("/")[-1]
+        if method == "PUT":
+            self.server.blobs[name] = body
+            return self._send(201)
+        return self._send(200, self.server.blobs[name], content_type="application/zip")
+
+    def _dmf(self, action: str, body: dict) -> None:
+        """Data management package import, rows with a value starting with FAIL fail."""
+        executions = self.server.executions
+        if action == "GetAzureWriteUrl":
+            name = body["uniqueFileName"]
+            blob = {"BlobId": name, "BlobUrl": f"{self.server.base_url}/blob/{name}"}
+            return self._send(200, {"value": json.dumps(blob)})
+        if action == "ImportFromPackage":
+            package = zipfile.ZipFile(io.BytesIO(self.server.blobs[body["packageUrl"].split("/")[-1]]))
+            data = next(name for name in package.namelist() if name.endswith(".csv"))
+            rows = list(csv.DictReader(io.StringIO(package.read(data).decode("utf-8"))))
+            failed = [row for row in rows if any(str(value).startswith("FAIL") for value in row.values())]
+            errors = io.StringIO()
+            if failed:
+                writer = csv.DictWriter(errors, fieldnames=list(failed[0]))
+                writer.writeheader()
+                writer.writerows(failed)
+            execution_id = self.server.next_id()
+            executions[execution_id] = {"polls": 0, "failed": bool(failed), "errors": errors.getvalue().encode()}
+            return self._send(200, {"value": execution_id})
+        execution = executions[body["executionId"]]
+        if action == "GetExecutionSummaryStatus":
+            execution["polls"] += 1
+            if execution["polls"] < 2:
+                return self._send(200, {"value": "Executing"})
+            return self._send(200, {"value": "PartiallySucceeded" if execution["failed"] else "Succeeded"})
+        if action == "GenerateImportTargetErrorKeysFile":
+            return self._send(200, {"value": execution["failed"]})
+        if action == "GetImportTargetErrorKeysFileUrl":
+            return self._send(200, {"value": f"{self.server.base_url}/errors/{body['executionId']}"})
+        return self._send(404, {"error": {"message": f"Unknown action {action}"}})
+
+    def _query(self, entity: str, query: dict) -> list:
+        if entity != "VendorsV3":
+            return []
+        expression = query.get("$filter", [""])[0]
+        data_area_id = re.search(r"dataAreaId eq '([^']*)'", expression)
+        data_area_id = data_area_id.group(1) if data_area_id else "usmf"
+        vendors = []
+        for field, value in re.findall(r"(\w+) eq '((?:[^']|'')*)'", expression):
+            if field == "dataAreaId":
+                continue
+            # every vendor exists, except the ones flagged as new until they are created
+            if value.startswith("NEW"):
+                vendors.extend(
+                    vendor
+                    for vendor in self.server.created_vendors
+                    if vendor.get(field) == value and vendor.get("dataAreaId") == data_area_id
+                )
+                continue
+            vendors.append(
+                {
+                    "@odata.etag": 'W/"1"',
+                    "dataAreaId": data_area_id,
+                    "VendorAccountNumber": value if field == "VendorAccountNumber" else f"V-{value}",
+                    "VendorOrganizationName": value if field == "VendorOrganizationName" else f"Vendor {value}",
+                }
+            )
+        return vendors
+
+    def _batch(self, body: bytes) -> None:
+        text = body.decode()
+        request_boundary = self.headers.get("Content-Type", "").split("boundary=")[-1]
+        boundary = "batchresponse_mock"
+        changesets = text.split(f"--{request_boundary}")
+        parts = []
+        for index, changeset in enumerate(c for c in changesets if "Content-ID" in c):
+            operations = len(re.findall(r"^Content-ID:", changeset, flags=re.M))
+            changeset_boundary = f"changesetresponse_{index}"
+            responses = []
+            for content_id in range(operations):
+                responses.append(
+                    f"--{changeset_boundary}\r\nContent-Type: application/http\r\n"
+                    f"Content-Transfer-Encoding: binary\r\nContent-ID: {content_id + 1}\r\n\r\n"
+                    f"HTTP/1.1 201 Created\r\nContent-Type: application/json\r\n\r\n"
+                    f'{{"RecordId": "{self.server.next_id()}"}}\r\n'
+                )
+            parts.append(
+                f"--{boundary}\r\nContent-Type: multipart/mixed; boundary={changeset_boundary}\r\n\r\n"
+                + "".join(responses)
+                + f"--{changeset_boundary}--\r\n"
+            )
+        data = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        return self._send(200, data, content_type=f"multipart/mixed; boundary={boundary}")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+def start_server(port=0, **kwargs) -> MockDynamicsServer:
+    """Start a mock server on a background thread."""
+    server = MockDynamicsServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--gzip-responses", action="store_true")
+    args = parser.parse_args()
+    server = MockDynamicsServer(
+        ("127.0.0.1", args.port),
+        latency_ms=args.latency_ms,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        gzip_responses=args.gzip_responses,
+    )
+    print(f"Mock Dynamics server listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
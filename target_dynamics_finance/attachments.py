@@ -0,0 +1,67 @@
+"""Streamed attachment request bodies."""
+
+import base64
+import os
+from typing import Iterator
+
+from target_dynamics_finance.serialize import DEFAULT_SERIALIZER, Serializer
+
+# multiple of 3 so every chunk encodes to base64 without padding
+CHUNK_SIZE = 3 * 256 * 1024
+
+
+def attachment_path(input_path: str, payload: dict) -> str:
+    """Return the local path of an attachment."""
+    input_path = f"{input_path}/" if not input_path.endswith("/") else input_path
+    attachment_id = payload.get("Id", "")
+    attachment_name = payload.get("Name")
+    if attachment_id:
+        attachment_name = f"{attachment_id}_{attachment_name}"
+    return f"{input_path}{attachment_name}"
+
+
+def iter_base64(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Base64 encode a file incrementally."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+
+
+class AttachmentBody:
+    """JSON body with the base64 contents of a file streamed into `FileContents`.
+
+    The body is re-iterable, so it can be sent again on retries, and has a
+    length, so requests sends it with a Content-Length instead of holding the
+    encoded file in memory.
+    """
+
+    def __init__(
+        self,
+        payload: dict,
+        path: str,
+        chunk_size: int = CHUNK_SIZE,
+        serializer: Serializer = DEFAULT_SERIALIZER,
+    ) -> None:
+        self.payload = payload
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        fields = serializer.dumps(payload).decode()[1:-1]
+        separator = "," if fields else ""
+        self._prefix = ("{" + fields + separator + '"FileContents":"').encode()
+        self._suffix = b'"}'
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._prefix
+        yield from iter_base64(self.path, self.chunk_size)
+        yield self._suffix
+
+    def __len__(self) -> int:
+        encoded_size = 4 * ((self.size + 2) // 3)
+        return len(self._prefix) + encoded_size + len(self._suffix)
+
+    def __repr__(self) -> str:
+        return f"<AttachmentBody {self.payload.get('Name')} {self.size} bytes>"
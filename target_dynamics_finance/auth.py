@@ -1,10 +1,22 @@
 import json
+import os
+import tempfile
+import threading
+import time
 from datetime import datetime
+from pathlib import PurePath
 from typing import Optional
 from typing import Any, Dict, Optional
 
 import logging
-import requests
+
+from target_dynamics_finance.logs import LazyBody
+from target_dynamics_finance.session import get_timeout
+
+# tokens closer than this to expiry are refreshed before the request
+EXPIRY_MARGIN = 120
+# tokens are refreshed in the background this long before they expire
+BACKGROUND_REFRESH_MARGIN = 300
 
 
 class DynamicsAuthenticator:
@@ -30,13 +42,27 @@ class DynamicsAuthenticator:
         self._config_file = target.config_file
         self._target = target
         self.state = state
+        self._lock = threading.Lock()
+        self._refresh_timer = None
+        self._access_token = self._config.get("access_token")
+        # expiry is kept on the monotonic clock, config stores it as a timestamp
+        self._expires_at = None
+        expires_in = self._config.get("expires_in")
+        if expires_in:
+            now = round(datetime.utcnow().timestamp())
+            self._expires_at = time.monotonic() + int(expires_in) - now
+        if self.is_token_valid():
+            self.schedule_refresh()
 
     @property
     def auth_headers(self) -> dict:
         if not self.is_token_valid():
-            self.update_access_token()
+            # single flight: workers waiting on the lock reuse the new token
+            with self._lock:
+                if not self.is_token_valid():
+                    self.update_access_token()
         result = {}
-        result["Authorization"] = f"Bearer {self._config.get('access_token')}"
+        result["Authorization"] = f"Bearer {self._access_token}"
         return result
 
     @property
@@ -67,31 +93,69 @@ class DynamicsAuthenticator:
         
 
     def is_token_valid(self) -> bool:
-        access_token = self._config.get("access_token")
-        now = round(datetime.utcnow().timestamp())
-        expires_in = self._config.get("expires_in")
-        if expires_in is not None:
-            expires_in = int(expires_in)
-        if not access_token:
+        if not self._access_token:
             return False
-        if not expires_in:
+        if not self._expires_at:
             return False
-        return not ((expires_in - now) < 120)
+        return not ((self._expires_at - time.monotonic()) < EXPIRY_MARGIN)
+
+    def schedule_refresh(self) -> None:
+        """Refresh the token in the background before requests see it expire."""
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+        delay = self._expires_at - time.monotonic() - BACKGROUND_REFRESH_MARGIN
+        if delay <= 0:
+            return
+        self._refresh_timer = threading.Timer(delay, self.refresh_in_background)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def refresh_in_background(self) -> None:
+        try:
+            with self._lock:
+                self.update_access_token()
+        except Exception as e:
+            # the next request refreshes the token itself
+            self.logger.warning(f"Background token refresh failed: {e}")
+
+    def persist_config(self) -> None:
+        """Write the config with the new token through a temp file and rename."""
+        if not isinstance(self._config_file, (str, PurePath)):
+            return
+        directory = os.path.dirname(os.path.abspath(self._config_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                json.dump(self._config, outfile, indent=4)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temp_path, self._config_file)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
 
     def update_access_token(self) -> None:
+        with self._target.metrics.timed("token_refresh"):
+            self._update_access_token()
+
+    def _update_access_token(self) -> None:
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         self.logger.info(
-            f"Oauth request - endpoint: {self._auth_endpoint}, body: {self.oauth_request_body}"
+            "Oauth request - endpoint: %s, body: %s", self._auth_endpoint, LazyBody(self.oauth_request_body)
         )
-        token_response = requests.post(
-            self._auth_endpoint, data=self.oauth_request_body, headers=headers
+        token_response = self._target.session.post(
+            self._auth_endpoint,
+            data=self.oauth_request_body,
+            headers=headers,
+            timeout=get_timeout(self._config),
         )
 
         if token_response.status_code not in [200]:
             raise Exception(f"Authentication error status code {token_response.status_code} - {token_response.text}")
 
         token_json = token_response.json()
-        self.access_token = token_json["access_token"]
+        changed = token_json["access_token"] != self._config.get("access_token")
 
         self._config["access_token"] = token_json["access_token"]
 
@@ -102,5 +166,9 @@ class DynamicsAuthenticator:
         now = round(datetime.utcnow().timestamp())
         self._config["expires_in"] = int(token_json["expires_in"]) + now
 
-        with open(self._target.config_file, "w") as outfile:
-            json.dump(self._config, outfile, indent=4)
+        self._access_token = self._config["access_token"]
+        self._expires_at = time.monotonic() + int(token_json["expires_in"])
+
+        if changed:
+            self.persist_config()
+        self.schedule_refresh()
@@ -0,0 +1,170 @@
+"""OData $batch request building and response parsing."""
+
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from target_dynamics_finance.serialize import DEFAULT_SERIALIZER, Serializer
+
+CRLF = "\r\n"
+
+
+class BatchOperation:
+    """A single request sent inside a $batch body."""
+
+    def __init__(
+        self,
+        method: str,
+        url: str,
+        body: Optional[dict] = None,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+    ) -> None:
+        self.method = method
+        self.url = url
+        self.body = body
+        self.params = params or {}
+        self.headers = headers or {}
+
+    def render(self, content_id: int, serializer: Serializer = DEFAULT_SERIALIZER) -> str:
+        url = self.url
+        if self.params:
+            url = f"{url}?{urlencode(self.params)}"
+        lines = [
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            f"Content-ID: {content_id}",
+            "",
+            f"{self.method} {url} HTTP/1.1",
+        ]
+        headers = dict(self.headers)
+        body = ""
+        if self.body is not None:
+            headers.setdefault("Content-Type", "application/json; type=entry")
+            body = serializer.dumps(self.body).decode()
+        for key, value in headers.items():
+            lines.append(f"{key}: {value}")
+        lines.append("")
+        lines.append(body)
+        return CRLF.join(lines)
+
+
+class BatchResult:
+    """Result of a single operation parsed from a $batch response."""
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: Dict[str, str],
+        text: str,
+        serializer: Serializer = DEFAULT_SERIALIZER,
+    ) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+        self.serializer = serializer
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    def json(self) -> Any:
+        return self.serializer.loads(self.text) if self.text.strip() else {}
+
+
+def build_batch_body(
+    changesets: List[List[BatchOperation]], serializer: Serializer = DEFAULT_SERIALIZER
+) -> Tuple[bytes, str]:
+    """Render changesets into a multipart/mixed $batch body.
+
+    Every changeset is atomic on the Dynamics side: either all of its
+    operations are committed or none are.
+    """
+    batch_boundary = f"batch_{uuid.uuid4()}"
+    parts = []
+    content_id = 1
+    for operations in changesets:
+        changeset_boundary = f"changeset_{uuid.uuid4()}"
+        changeset = []
+        for operation in operations:
+            changeset.append(f"--{changeset_boundary}{CRLF}{operation.render(content_id, serializer)}")
+            content_id += 1
+        changeset.append(f"--{changeset_boundary}--")
+        parts.append(
+            f"--{batch_boundary}{CRLF}"
+            f"Content-Type: multipart/mixed; boundary={changeset_boundary}{CRLF}{CRLF}"
+            + CRLF.join(changeset)
+        )
+    parts.append(f"--{batch_boundary}--{CRLF}")
+    body = CRLF.join(parts)
+    return body.encode("utf-8"), f"multipart/mixed; boundary={batch_boundary}"
+
+
+def _get_boundary(content_type: str) -> Optional[str]:
+    for item in content_type.split(";"):
+        item = item.strip()
+        if item.lower().startswith("boundary="):
+            return item.split("=", 1)[1].strip('"')
+    return None
+
+
+def _split_headers(block: str) -> Tuple[Dict[str, str], str]:
+    if block.startswith(CRLF):
+        return {}, block[len(CRLF):]
+    head, _, rest = block.partition(CRLF + CRLF)
+    headers = {}
+    for line in head.split(CRLF):
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    return headers, rest
+
+
+def _parse_part(content: str, serializer: Serializer) -> BatchResult:
+    status_line, _, http_rest = content.partition(CRLF)
+    headers, body = _split_headers(http_rest)
+    status_code = int(status_line.split(" ")[1])
+    return BatchResult(status_code, headers, body.rstrip(CRLF), serializer)
+
+
+def _split_multipart(text: str, boundary: str) -> List[Tuple[Dict[str, str], str]]:
+    parts = []
+    for part in text.split(f"--{boundary}")[1:]:
+        if part.startswith("--"):
+            break
+        parts.append(_split_headers(part.lstrip(CRLF)))
+    return parts
+
+
+def parse_batch_response(
+    content_type: str, text: str, serializer: Serializer = DEFAULT_SERIALIZER
+) -> List[List[BatchResult]]:
+    """Parse a $batch response into one list of results per changeset.
+
+    When a changeset fails Dynamics returns a single error part for the
+    whole changeset instead of one part per operation, so a group can be
+    shorter than the changeset that produced it.
+    """
+    text = text.replace("\r\n", "\n").replace("\n", CRLF)
+    boundary = _get_boundary(content_type)
+    if not boundary:
+        raise ValueError(f"Missing boundary in $batch response content type: {content_type}")
+    groups = []
+    for mime_headers, content in _split_multipart(text, boundary):
+        nested = _get_boundary(mime_headers.get("content-type", ""))
+        if nested:
+            groups.append([_parse_part(c, serializer) for _, c in _split_multipart(content, nested)])
+        else:
+            groups.append([_parse_part(content, serializer)])
+    return groups
+
+
+def expand_results(operations: List[BatchOperation], group: List[BatchResult]) -> List[BatchResult]:
+    """Return one result per operation of a changeset.
+
+    A failed changeset rolls back every operation in it, so its single
+    error result is reported for all of them.
+    """
+    if len(group) == len(operations):
+        return group
+    return [group[0]] * len(operations)
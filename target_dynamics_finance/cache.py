@@ -0,0 +1,88 @@
+"""In-memory cache for entity lookups."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Tuple
+
+DEFAULT_TTL = 900
+DEFAULT_MAX_SIZE = 10000
+
+# stored for lookups that returned no entity
+NOT_FOUND = object()
+
+
+def _fold(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+
+def lookup_key(
+    entity: str, data_area_id: Any, field: str, value: Any, select: Optional[Iterable[str]] = None
+) -> Tuple:
+    """Build the cache key of a lookup.
+
+    Dynamics compares strings case-insensitively, so string values are
+    folded to match the server behaviour. Lookups restricted with $select
+    are cached apart from full entities.
+    """
+    return (
+        entity.strip("/"),
+        _fold(data_area_id),
+        field,
+        _fold(value),
+        tuple(select) if select else None,
+    )
+
+
+class LookupCache:
+    """Thread-safe LRU cache with a time to live, including negative entries."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached entity, NOT_FOUND, or None on a cache miss."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Optional[Any]) -> None:
+        """Cache an entity, or a "not found" result when value is None."""
+        if value is None:
+            value = NOT_FOUND
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(
+        self, entity: str, data_area_id: Any = None, field: Optional[str] = None, value: Any = None
+    ) -> None:
+        """Drop the entries of an entity matching the given company, field and value."""
+        match = (entity.strip("/"), _fold(data_area_id), field, _fold(value))
+        with self._lock:
+            for key in list(self._items):
+                if all(m is None or m == k for m, k in zip(match, key)):
+                    del self._items[key]
+
+    def invalidate_missing(self, entity: str, data_area_id: Any = None) -> None:
+        """Drop the "not found" entries of an entity, whatever field they were looked up by."""
+        entity = entity.strip("/")
+        data_area_id = _fold(data_area_id)
+        with self._lock:
+            for key, (_, value) in list(self._items.items()):
+                if value is NOT_FOUND and key[0] == entity and (data_area_id is None or key[1] == data_area_id):
+                    del self._items[key]
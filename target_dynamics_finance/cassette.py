@@ -0,0 +1,156 @@
+"""JSONL cassettes of HTTP traffic, captured from a run and replayed offline."""
+
+import base64
+import json
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from target_dynamics_finance.logs import REDACTED, redact
+
+# query and form parameters holding credentials, including blob storage SAS signatures
+SECRET_PARAM_RE = re.compile(
+    r"((?:^|[?&\"\s])(?:sig|client_secret|client_assertion|refresh_token|access_token|password|code)=)[^&\"\\\s]+",
+    re.IGNORECASE,
+)
+SECRET_HEADERS = {"authorization", "cookie", "set-cookie", "x-ms-copy-source-authorization"}
+
+
+def redact_text(text: str) -> str:
+    """Redact the secrets of a URL, a form body or a JSON body."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        pass
+    else:
+        if isinstance(data, (dict, list)):
+            text = json.dumps(redact(data))
+    return SECRET_PARAM_RE.sub(rf"\1{REDACTED}", text)
+
+
+def redact_headers(headers) -> Dict[str, str]:
+    return {
+        key: REDACTED if key.lower() in SECRET_HEADERS else value
+        for key, value in (headers or {}).items()
+    }
+
+
+def encode_body(body: Any) -> Tuple[str, Optional[str]]:
+    """Return ("body" or "body_base64", value) for a request or response body."""
+    if body is None:
+        return "body", None
+    if isinstance(body, str):
+        return "body", redact_text(body)
+    if isinstance(body, (bytes, bytearray)):
+        try:
+            return "body", redact_text(bytes(body).decode("utf-8"))
+        except UnicodeDecodeError:
+            return "body_base64", base64.b64encode(body).decode("ascii")
+    # files and generators streamed by uploads are not kept
+    return "body", f"<{type(body).__name__}>"
+
+
+def capture_entry(request, response, started: float, elapsed: float) -> dict:
+    """Cassette entry of a requests PreparedRequest and its Response."""
+    request_key, request_body = encode_body(request.body)
+    response_key, response_body = encode_body(response.content)
+    return {
+        "method": request.method,
+        "url": redact_text(request.url),
+        "request_headers": redact_headers(request.headers),
+        f"request_{request_key}": request_body,
+        "status": response.status_code,
+        "reason": response.reason,
+        "headers": redact_headers(response.headers),
+        response_key: response_body,
+        "started": round(started, 6),
+        "elapsed": round(elapsed, 6),
+    }
+
+
+def response_content(entry: dict) -> bytes:
+    if entry.get("body_base64") is not None:
+        return base64.b64decode(entry["body_base64"])
+    return (entry.get("body") or "").encode("utf-8")
+
+
+class CassetteWriter:
+    """Append the captured requests of a run to a JSONL file, from any thread."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def offset(self) -> float:
+        """Seconds since the capture started, the `started` of an entry."""
+        return time.monotonic() - self._start
+
+    def record(self, entry: dict) -> None:
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._file.write(f"{line}\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Cassette:
+    """Recorded responses, served per method and URL in the order they were captured.
+
+    Requests that weren't captured with the same URL get the responses of the
+    same path with another query (e.g. a lookup of another vendor). The last
+    response of a URL is served again once its responses run out, as retries do.
+    """
+
+    def __init__(self, entries: Iterable[dict]) -> None:
+        self.entries: List[dict] = list(entries)
+        self._by_url: Dict[Tuple[str, str], deque] = {}
+        self._by_path: Dict[Tuple[str, str], deque] = {}
+        self._last: Dict[Tuple[str, str], dict] = {}
+        self._served = set()
+        for entry in self.entries:
+            method = entry["method"].upper()
+            self._by_url.setdefault((method, entry["url"]), deque()).append(entry)
+            self._by_path.setdefault((method, urlsplit(entry["url"]).path), deque()).append(entry)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.loads(line) for line in f if line.strip())
+
+    def match(self, method: str, url: str) -> dict:
+        method = method.upper()
+        url = redact_text(url)
+        keys = [(self._by_url, (method, url)), (self._by_path, (method, urlsplit(url).path))]
+        with self._lock:
+            for index, key in keys:
+                queue = index.get(key) or ()
+                # an entry is queued under its URL and its path, it's served once
+                while queue and id(queue[0]) in self._served:
+                    queue.popleft()
+                if queue:
+                    entry = self._last[key] = queue.popleft()
+                    self._served.add(id(entry))
+                    return entry
+                if key in self._last:
+                    return self._last[key]
+        raise KeyError(f"No recorded response for {method} {url}")
+
+    def stats(self) -> dict:
+        """Request count, summed latency and wall time of the captured run."""
+        if not self.entries:
+            return {"requests": 0, "request_seconds": 0.0, "wall_seconds": 0.0}
+        start = min(entry["started"] for entry in self.entries)
+        end = max(entry["started"] + entry["elapsed"] for entry in self.entries)
+        return {
+            "requests": len(self.entries),
+            "request_seconds": round(sum(entry["elapsed"] for entry in self.entries), 3),
+            "wall_seconds": round(end - start, 3),
+        }
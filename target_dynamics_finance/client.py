@@ -1,14 +1,59 @@
 from target_hotglue.client import HotglueSink
 from singer_sdk.plugin_base import PluginBase
 from typing import Dict, List, Optional
+from target_dynamics_finance.attachments import AttachmentBody
 from target_dynamics_finance.auth import DynamicsAuthenticator
-import ast
-import json
-import datetime
+from target_dynamics_finance.batch import build_batch_body, expand_results, parse_batch_response
+from target_dynamics_finance.cache import NOT_FOUND, lookup_key
+from target_dynamics_finance.compression import received_bytes
+from target_dynamics_finance.metrics import operation_name
+from target_dynamics_finance.pipeline import record_size
+from target_dynamics_finance.preprocess import build_converters, preprocess
+from target_dynamics_finance.session import get_timeout
+from target_dynamics_finance.shard import SHARD_ENV
+from target_dynamics_finance.state import RecordResults
+from target_dynamics_finance.throttle import parse_retry_after
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import backoff
 import requests
 from singer_sdk.exceptions import RetriableAPIError, FatalAPIError
 
+DEFAULT_BATCH_SIZE = 100
+# Dynamics service protection limits answer with these codes and a Retry-After
+THROTTLE_STATUS_CODES = [429, 503]
+# values resolved by a single prefetch query
+PREFETCH_CHUNK_SIZE = 25
+# sent on creates whose response isn't read, Dynamics answers 204 without a body
+PREFER_MINIMAL = {"Prefer": "return=minimal"}
+
+
+def count_retry(details) -> None:
+    """backoff handler counting retries on the sink that sent the request."""
+    sink, args, kwargs = details["args"][0], details["args"][1:], details["kwargs"]
+    sink.count_request_stat("retries")
+    if details.get("wait"):
+        sink.count_request_stat("retry_wait_seconds", round(details["wait"], 3))
+    method = args[0] if args else kwargs.get("http_method")
+    endpoint = args[1] if len(args) > 1 else kwargs.get("endpoint")
+    sink._target.metrics.count_retry(operation_name(method, endpoint))
+
+
+class ThrottledAPIError(RetriableAPIError):
+    """A throttled response, its retry is held by the rate limiter until Retry-After."""
+
+
+def is_throttled(e) -> bool:
+    return isinstance(e, ThrottledAPIError)
+
+
+def odata_literal(value) -> str:
+    """Quote a value as an OData string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
 
 class DynamicsSink(HotglueSink):
     def __init__(
@@ -20,11 +65,75 @@ class DynamicsSink(HotglueSink):
     ) -> None:
         """Initialize target sink."""
         self._target = target
+        self._pending_records = []
+        # approximate memory held by the pending records
+        self.pending_bytes = 0
+        self._converters = None
+        self._dedup_loaded = False
+        self.request_stats = Counter()
+        self._request_stats_lock = threading.Lock()
+        # company (dataAreaId) of the lane the current thread is writing
+        self._lane = threading.local()
+        self._state_lock = threading.RLock()
         super().__init__(target, stream_name, schema, key_properties)
 
-    auth_state = {}
     available_names = []
-    skip_record_patching = False
+
+    @property
+    def max_workers(self) -> int:
+        return int(self.config.get("max_workers") or 1)
+
+    @property
+    def buffer_records(self) -> bool:
+        """Whether records are held back and written together in process_batch."""
+        return self.max_workers > 1 or self.prefetch_enabled or self.partition_by_company
+
+    @property
+    def partition_by_company(self) -> bool:
+        return bool(self.config.get("partition_by_company"))
+
+    @property
+    def rate_limiter(self):
+        """Rate limiter of the company lane writing on this thread."""
+        return self._target.rate_limiter_for(getattr(self._lane, "company", None))
+
+    def in_lane(self, func):
+        """Wrap func to run on another thread in the company lane of the calling thread."""
+        company = getattr(self._lane, "company", None)
+
+        def run(*args, **kwargs):
+            previous = getattr(self._lane, "company", None)
+            self._lane.company = company
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._lane.company = previous
+
+        return run
+
+    def company_params(self, data_area_id) -> dict:
+        """Query params reaching the records of a company.
+
+        Requests for the default company of the integration user don't need
+        a cross-company scan, every other company does.
+        """
+        default_company = self.config.get("default_company")
+        if default_company and data_area_id and str(data_area_id).lower() == default_company.lower():
+            return {}
+        return {"cross-company": True}
+
+    @property
+    def prefetch_enabled(self) -> bool:
+        """Whether lookups of a window of buffered records are resolved up front."""
+        return bool(self.config.get("prefetch_lookups"))
+
+    @property
+    def max_size(self) -> int:
+        return int(self.config.get("batch_size") or DEFAULT_BATCH_SIZE)
+
+    @property
+    def current_size(self) -> int:
+        return len(self._pending_records)
 
     @property
     def base_url(self) -> str:
@@ -37,8 +146,7 @@ class DynamicsSink(HotglueSink):
 
     @property
     def authenticator(self):
-        url = f"https://login.microsoftonline.com/{self.config.get('tenant', 'common')}/oauth2/token"
-        return DynamicsAuthenticator(self._target, self.auth_state, url)
+        return self._target.authenticator
 
     @property
     def http_headers(self) -> dict:
@@ -47,71 +155,243 @@ class DynamicsSink(HotglueSink):
         headers.update(self.authenticator.auth_headers or {})
         return headers
 
-    def parse_objs(self, obj):
-        try:
-            try:
-                return ast.literal_eval(obj)
-            except:
-                return json.loads(obj)
-        except:
-            return obj
+    @property
+    def converters(self):
+        """Field converters compiled once from the stream schema."""
+        if self._converters is None:
+            self._converters = build_converters(self.schema)
+        return self._converters
 
-    def convert_date(self, date):
-        if date:
-            date = datetime.datetime.strptime(date)
-            date = date.strftime("%Y-%m-%d")
-            return date
+    def preprocess_record(self, record: dict, context: dict) -> dict:
+        """Process the record."""
+        return preprocess(record, self.converters)
 
-    def clean_data(self, value):
-        try:
-            value = self.convert_date(value)
-        except:
-            if isinstance(value, str) and (
-                value.startswith("[") or value.startswith("{")
-            ):
-                value = self.parse_objs(value)
-        return value
-
-    def lookup(self, endpoint, params):
-        self.logger.info(f"Look up to {endpoint} filtering by {params}")
-        params.update({"cross-company": True})
-        res_id = self.request_api("GET", endpoint, params)
-        res_id = res_id.json().get("value", [])
+    @property
+    def entity_model(self):
+        """OData model of the environment, None unless validate_metadata is set."""
+        if not self.config.get("validate_metadata"):
+            return None
+        return self._target.entity_model(
+            self.base_url,
+            lambda: self.request_api("GET", endpoint="/$metadata", headers={"Accept": "application/xml"}).content,
+        )
+
+    def validate_record(self, entity_set, record, ignore=()):
+        """Prune and check a record against the entity model, without any request.
+
+        Raises before anything is sent if a field can't be written.
+        """
+        model = self.entity_model
+        if model is None:
+            return record
+        record, pruned, errors = model.validate(entity_set, record, ignore)
+        if pruned:
+            self.logger.info("Dropping fields unknown to %s: %s", entity_set, ", ".join(pruned))
+        if errors:
+            raise Exception(f"{entity_set.strip('/')} record is invalid: {'; '.join(errors)}")
+        return record
+
+    def lookup(self, endpoint, params, data_area_id=None):
+        self.logger.debug("Look up to %s filtering by %s", endpoint, params)
+        params.update(self.company_params(data_area_id))
+        with self._target.metrics.timed("lookup"):
+            res_id = self.request_api("GET", endpoint, params)
+        res_id = self.parse_response(res_id).get("value", [])
         if res_id:
             return res_id[0]
-        
+
+    def lookup_by(self, endpoint, field, value, data_area_id, select=None):
+        """Look up an entity by a single field, going through the lookup cache."""
+        cache = self._target.lookup_cache
+        key = lookup_key(endpoint, data_area_id, field, value, select)
+        cached = cache.get(key)
+        if cached is not None:
+            return None if cached is NOT_FOUND else cached
+
+        params = {"$filter": f"{field} eq {odata_literal(value)} and dataAreaId eq {odata_literal(data_area_id)}"}
+        if select:
+            params["$select"] = ",".join(select)
+        result = self.lookup(endpoint, params, data_area_id)
+        cache.set(key, result)
+        return result
+
+    def prefetch(self, endpoint, field, keys, select=None):
+        """Resolve many lookups of one field with a few `or` filters per company.
+
+        `keys` are (dataAreaId, value) pairs; found and missing entities are
+        both stored in the lookup cache so lookup_by doesn't hit the API.
+        """
+        cache = self._target.lookup_cache
+        by_company = {}
+        for data_area_id, value in keys:
+            if value in (None, ""):
+                continue
+            if cache.get(lookup_key(endpoint, data_area_id, field, value, select)) is not None:
+                continue
+            by_company.setdefault(data_area_id, set()).add(value)
+
+        for data_area_id, values in by_company.items():
+            values = sorted(values, key=str)
+            for i in range(0, len(values), PREFETCH_CHUNK_SIZE):
+                chunk = values[i : i + PREFETCH_CHUNK_SIZE]
+                clauses = " or ".join(f"{field} eq {odata_literal(v)}" for v in chunk)
+                params = {
+                    "$filter": f"dataAreaId eq {odata_literal(data_area_id)} and ({clauses})",
+                    **self.company_params(data_area_id),
+                }
+                if select:
+                    params["$select"] = ",".join(select)
+                try:
+                    response = self.request_api("GET", endpoint=endpoint, params=params)
+                except Exception as e:
+                    # records fall back to single lookups
+                    self.logger.warning(f"Prefetch of {endpoint} by {field} failed: {e}")
+                    continue
+                found = {}
+                for entity in self.parse_response(response).get("value", []):
+                    found[lookup_key(endpoint, data_area_id, field, entity.get(field), select)] = entity
+                for value in chunk:
+                    key = lookup_key(endpoint, data_area_id, field, value, select)
+                    cache.set(key, found.get(key))
+
+    def prefetch_records(self, records: list) -> None:
+        """Warm the lookup cache for a window of buffered records.
+
+        Does nothing here, sinks with lookups override it to call prefetch
+        with the values of the window.
+        """
+
+    # throttled requests are retried right away, the rate limiter already waits
+    # for their Retry-After, so exponential backoff doesn't add to it
+    @backoff.on_exception(
+        backoff.constant,
+        ThrottledAPIError,
+        interval=0,
+        jitter=None,
+        max_tries=5,
+        on_backoff=count_retry,
+    )
     @backoff.on_exception(
         backoff.expo,
         (RetriableAPIError, requests.exceptions.RequestException),
         max_tries=5,
         factor=2,
+        jitter=backoff.full_jitter,
+        giveup=is_throttled,
+        on_backoff=count_retry,
     )
     def _request(
         self, http_method, endpoint, params=None, request_data=None, headers=None
     ) -> requests.PreparedRequest:
         """Prepare a request object."""
         url = self.url(endpoint)
-        headers = self.http_headers
-        
-        # log request 
-        if request_data and "FileContents" in request_data:
-            self.logger.info(f"Sending request {http_method} to url {url} with params {params}")
+        waited = self.rate_limiter.acquire()
+        if waited:
+            self.count_request_stat("throttle_wait_seconds", round(waited, 3))
+        request_headers = self.http_headers
+        request_headers.update(headers or {})
+
+        # raw bodies ($batch payloads, streamed attachments) are sent as is
+        body = request_data
+        if request_data is not None and not isinstance(request_data, (bytes, AttachmentBody)):
+            body = self._target.serializer.dumps(request_data)
+            request_headers.setdefault("Content-Type", "application/json")
+        self._target.request_logger.request(http_method, url, endpoint, params, request_data)
+
+        compression = self._target.compression
+        compression_key = operation_name(http_method, endpoint)
+        sent_body, sent_headers = body, request_headers
+        if compression.should_compress(compression_key, body):
+            sent_body = compression.compress(body)
+            sent_headers = dict(request_headers, **{"Content-Encoding": "gzip"})
+
+        metrics = self._target.metrics
+        start = time.perf_counter()
+        try:
+            response = self._target.session.request(
+                method=http_method,
+                url=url,
+                params=params,
+                headers=sent_headers,
+                timeout=get_timeout(self.config),
+                data=sent_body,
+            )
+            if sent_body is not body and compression.is_rejection(response.status_code, response.text):
+                compression.reject(compression_key)
+                self.logger.warning(
+                    "%s can't read gzip request bodies (%s), sending them uncompressed from now on",
+                    compression_key,
+                    response.status_code,
+                )
+                self.rate_limiter.acquire()
+                sent_body = body
+                response = self._target.session.request(
+                    method=http_method,
+                    url=url,
+                    params=params,
+                    headers=request_headers,
+                    timeout=get_timeout(self.config),
+                    data=body,
+                )
+        except Exception:
+            metrics.observe(operation_name(http_method, endpoint), time.perf_counter() - start, error=True)
+            raise
+
+        bytes_saved = len(body) - len(sent_body) if sent_body is not body else 0
+        if response.headers.get("Content-Encoding"):
+            bytes_received = received_bytes(response)
+            bytes_saved += len(response.content) - bytes_received
         else:
-            self.logger.info(f"Sending request {http_method} to url {url} with params {params} and body {request_data}")
-
-        response = requests.request(
-            method=http_method,
-            url=url,
-            params=params,
-            headers=headers,
-            json=request_data,
-        )
+            bytes_received = len(response.content)
+        if bytes_saved > 0:
+            self.count_request_stat("bytes_saved", bytes_saved)
+        if metrics.enabled:
+            metrics.observe(
+                operation_name(http_method, endpoint),
+                time.perf_counter() - start,
+                error=response.status_code >= 400,
+                bytes_sent=len(response.request.body or b""),
+                bytes_received=bytes_received,
+                bytes_saved=max(bytes_saved, 0),
+            )
         val_resp = self.validate_response(response)
         # if note in validate_response return it to update the state
         if val_resp and "note" in val_resp:
             return val_resp
         return response
     
+    def count_request_stat(self, name: str, value=1) -> None:
+        """Add to the request counters reported in the stream summary."""
+        with self._request_stats_lock:
+            self.request_stats[name] += value
+
+    def parse_response(self, response):
+        """Decode a JSON response body with the configured serializer."""
+        return self._target.serializer.loads(response.content)
+
+    def is_skipped(self, response) -> bool:
+        """Whether _request returned a skip note instead of a response."""
+        return isinstance(response, dict) and "note" in response
+
+    def post_batch(self, changesets):
+        """Send changesets to the OData $batch endpoint.
+
+        Returns one list of results per changeset, with one result per operation.
+        """
+        body, content_type = build_batch_body(changesets, self._target.serializer)
+        response = self.request_api(
+            "POST",
+            endpoint="/$batch",
+            request_data=body,
+            headers={"Content-Type": content_type, "Accept": "multipart/mixed"},
+        )
+        groups = parse_batch_response(
+            response.headers.get("Content-Type", ""), response.text, self._target.serializer
+        )
+        if len(groups) != len(changesets):
+            raise Exception(f"$batch response has {len(groups)} changesets, expected {len(changesets)}")
+        return [expand_results(ops, group) for ops, group in zip(changesets, groups)]
+
     def get_unique_identifier(self, object, primary_keys):
         identifier = []
         for pk in primary_keys:
@@ -126,9 +406,17 @@ class DynamicsSink(HotglueSink):
         if response.status_code in [400]:
             if "No resources were found when selecting for update." in response.text:
                 self.logger.info(f"Skipping record patching because {self.name} record was not found")
-                self.skip_record_patching = True
                 return {"note": f"Skipping record patching because {self.name} record was not found"}
         # apply standard logic to validate response
+        if response.status_code in THROTTLE_STATUS_CODES:
+            # slow down every sink and worker, not only the throttled request
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            self.rate_limiter.on_throttled(retry_after)
+            self.count_request_stat("throttled")
+        elif response.status_code < 400:
+            self.rate_limiter.on_success()
+        if response.status_code in THROTTLE_STATUS_CODES:
+            raise ThrottledAPIError(self.response_error_message(response), response)
         if response.status_code in [429] or 500 <= response.status_code < 600:
             msg = self.response_error_message(response)
             raise RetriableAPIError(msg, response)
@@ -140,11 +428,156 @@ class DynamicsSink(HotglueSink):
             raise FatalAPIError(msg)
 
     
+    @property
+    def compact_state(self) -> bool:
+        return bool(self.config.get("compact_state"))
+
+    def init_state(self):
+        super().init_state()
+        if self.compact_state:
+            # bookmarks are stored encoded, and in a JSONL file per stream with results_dir
+            results_dir = self.config.get("results_dir")
+            # workers of a sharded run each write their own file
+            shard = os.environ.get(SHARD_ENV)
+            file_name = f"{self.name}.{shard}.jsonl" if shard else f"{self.name}.jsonl"
+            path = os.path.join(results_dir, file_name) if results_dir else None
+            bookmarks = self.latest_state["bookmarks"]
+            bookmarks[self.name] = RecordResults.from_bookmark(
+                bookmarks.get(self.name), path, self._target.serializer
+            )
+
     def process_record(self, record: dict, context: dict) -> None:
         """Process the record."""
         if not self.latest_state:
             self.init_state()
 
+        if self.buffer_records:
+            self._pending_records.append((record, context))
+            self.pending_bytes += record_size(record)
+            return
+
+        with self._target.metrics.timed("process_record"):
+            self.write_record(record, context)
+
+    def process_batch(self, context: dict) -> None:
+        """Write the records buffered by process_record."""
+        records, self._pending_records = self._pending_records, []
+        self.pending_bytes = 0
+        if records:
+            with self._target.metrics.timed("process_batch"):
+                if self.partition_by_company:
+                    self.write_lanes(records)
+                else:
+                    self.write_window(records)
+
+    def write_window(self, records: list) -> None:
+        if self.prefetch_enabled:
+            self.prefetch_records(records)
+        self.write_records(records)
+
+    def write_lanes(self, records: list) -> None:
+        """Write the records of every company (dataAreaId) on its own lane.
+
+        Lanes run in parallel with their own rate limiter and batches, so a
+        throttled or slow company doesn't hold back the others. Bookmarks keep
+        the input order within a company.
+        """
+        lanes = {}
+        for record, context in records:
+            lanes.setdefault(record.get("dataAreaId"), []).append((record, context))
+
+        def write_lane(lane):
+            company, lane_records = lane
+            self._lane.company = company
+            try:
+                self.write_window(lane_records)
+            finally:
+                self._lane.company = None
+
+        if len(lanes) == 1:
+            return write_lane(next(iter(lanes.items())))
+        with ThreadPoolExecutor(max_workers=len(lanes), thread_name_prefix="company-lane") as executor:
+            # surface the first error of a lane, like a sequential write would
+            list(executor.map(write_lane, lanes.items()))
+
+    def write_records(self, records: list) -> None:
+        if self.max_workers <= 1:
+            for record, context in records:
+                self.write_record(record, context)
+            return
+
+        pending, deferred = self.split_duplicates(records)
+        results = self.run_concurrently(
+            lambda item: self.safe_upsert(item[2], item[3]), pending
+        )
+        # state is only touched here, in input order, so bookmarks stay deterministic
+        for (hash, external_id, _, _), result in zip(pending, results):
+            self.finish_record(hash, *result, external_id)
+
+        for record, context in deferred:
+            self.write_record(record, context)
+
+    def split_duplicates(self, records: list):
+        """Resolve duplicates of a window of records against the state.
+
+        Returns the records to send as (hash, external_id, record, context) and
+        the repeated records of the window, which have to be written after the
+        first copy so they are matched against its state.
+        """
+        pending = []
+        deferred = []
+        hashes = set()
+        for record, context in records:
+            hash = self.build_record_hash(record)
+            existing_state = self.get_existing_state(hash)
+            if existing_state:
+                self.update_state(existing_state, is_duplicate=True)
+                continue
+            if hash in hashes:
+                deferred.append((record, context))
+                continue
+            hashes.add(hash)
+            pending.append((hash, record.pop("externalId", None), record, context))
+        return pending, deferred
+
+    def run_concurrently(self, func, items: list) -> list:
+        """Apply func to items on a bounded thread pool, keeping the input order."""
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # workers write in the lane of the caller, with its rate limiter
+            return list(executor.map(self.in_lane(func), items))
+
+    def safe_upsert(self, record: dict, context: dict):
+        """Run upsert_record returning (id, success, state_updates) even on errors."""
+        try:
+            with self._target.metrics.timed("upsert_record"):
+                result = self.upsert_record(record, context)
+        except Exception as e:
+            self.logger.exception(f"Upsert record error {str(e)}")
+            return None, False, {"error": str(e)}
+        # upsert_record returns nothing for records it can't send (e.g. empty ones)
+        if result is None:
+            return None, False, {}
+        return result
+
+    def get_existing_state(self, hash):
+        """Find a successful state for a record hash through the dedup index."""
+        index = self._target.dedup_index
+        if not self._dedup_loaded:
+            with self._state_lock:
+                if not self._dedup_loaded:
+                    index.load(self.name, self.latest_state["bookmarks"][self.name])
+                    self._dedup_loaded = True
+        existing_state = index.get(self.name, hash)
+        if existing_state:
+            self.logger.info("Record of type %s already exists with hash: %s", self.name, hash)
+            # counted like the bookmark scan of the base class did
+            with self._state_lock:
+                self.latest_state["summary"][self.name]["existing"] += 1
+        return existing_state
+
+    def write_record(self, record: dict, context: dict) -> None:
         hash = self.build_record_hash(record)
 
         existing_state =  self.get_existing_state(hash)
@@ -152,22 +585,17 @@ class DynamicsSink(HotglueSink):
         if existing_state:
             return self.update_state(existing_state, is_duplicate=True)
 
-        state = {"hash": hash}
+        external_id = record.pop("externalId", None)
 
-        id = None
-        success = False
-        state_updates = dict()
+        id, success, state_updates = self.safe_upsert(record, context)
 
-        external_id = record.pop("externalId", None)
+        self.finish_record(hash, id, success, state_updates, external_id)
 
-        try:
-            id, success, state_updates = self.upsert_record(record, context)
-        except Exception as e:
-            self.logger.exception(f"Upsert record error {str(e)}")
-            state_updates['error'] = str(e)
+    def finish_record(self, hash, id, success, state_updates, external_id=None) -> None:
+        state = {"hash": hash}
 
         if success:
-            self.logger.info(f"{self.name} processed id: {id}")
+            self.logger.info("%s processed id: %s", self.name, id)
 
         state["success"] = success
 
@@ -190,9 +618,14 @@ class DynamicsSink(HotglueSink):
 
 
     def update_state(self, state: dict, is_duplicate=False):
+        # company lanes update the state concurrently
+        with self._target.metrics.timed("update_state"), self._state_lock:
+            self._update_state(state, is_duplicate)
+
+    def _update_state(self, state: dict, is_duplicate=False):
         # overriding so existing is not marked as success or fail
         if is_duplicate:
-            self.logger.info(f"Record of type {self.name} already exists with id: {state.get('id')}")
+            self.logger.info("Record of type %s already exists with id: %s", self.name, state.get("id"))
             self.latest_state["summary"][self.name]["existing"] += 1
 
         elif not state.get("success", False):
@@ -204,8 +637,16 @@ class DynamicsSink(HotglueSink):
             self.latest_state["summary"][self.name]["success"] += 1
 
         self.latest_state["bookmarks"][self.name].append(state)
+        self._target.dedup_index.add(self.name, state)
+
+        if self.request_stats:
+            with self._request_stats_lock:
+                self.latest_state["summary"][self.name].update(self.request_stats)
 
         # If "authenticator" exists and if it's an instance of "Authenticator" class,
         # update "self.latest_state" with the the "authenticator" state
+        # (compact states get it once, when they are emitted)
+        if self.compact_state:
+            return
         if self.authenticator and isinstance(self.authenticator, DynamicsAuthenticator):
             self.latest_state.update(self.authenticator.state)
\ No newline at end of file
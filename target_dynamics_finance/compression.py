@@ -0,0 +1,72 @@
+"""Gzip request bodies and account for the bytes compressed transfers save."""
+
+import gzip
+import threading
+from typing import Any
+
+# bodies smaller than this barely shrink and aren't worth the CPU
+DEFAULT_COMPRESSION_MIN_BYTES = 8 * 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+# an endpoint that can't read gzip bodies answers 415, or 400 failing to parse the raw bytes
+REJECTED_STATUS_CODE = 415
+DECODE_ERROR_MARKERS = ("content-encoding", "gzip", "unexpected character", "invalid json", "json reader")
+
+
+class RequestCompression:
+    """Gzip request bodies above min_bytes, except to endpoints that can't read them.
+
+    A compressed request rejected with a 415, or with a 400 about decoding
+    its body, is sent again uncompressed and its endpoint gets uncompressed
+    bodies for the rest of the run. Other errors are left to the caller, so
+    invalid records don't cost a second request.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        min_bytes: int = DEFAULT_COMPRESSION_MIN_BYTES,
+        level: int = DEFAULT_COMPRESSION_LEVEL,
+    ) -> None:
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.level = level
+        # endpoints that rejected a compressed body
+        self.rejected = set()
+        self._lock = threading.Lock()
+
+    def should_compress(self, endpoint: str, body: Any) -> bool:
+        # streamed bodies (attachments) keep their Content-Length and aren't compressed
+        return (
+            self.enabled
+            and isinstance(body, (bytes, bytearray))
+            and len(body) >= self.min_bytes
+            and endpoint not in self.rejected
+        )
+
+    def compress(self, body: bytes) -> bytes:
+        return gzip.compress(body, compresslevel=self.level, mtime=0)
+
+    def is_rejection(self, status_code: int, text: str) -> bool:
+        """Whether the answer to a compressed request says its body couldn't be read."""
+        if status_code == REJECTED_STATUS_CODE:
+            return True
+        if status_code != 400:
+            return False
+        text = text.lower()
+        return any(marker in text for marker in DECODE_ERROR_MARKERS)
+
+    def reject(self, endpoint: str) -> None:
+        """Send uncompressed bodies to an endpoint from now on."""
+        with self._lock:
+            self.rejected.add(endpoint)
+
+
+def received_bytes(response) -> int:
+    """Bytes of a response body on the wire, before its Content-Encoding is decoded."""
+    tell = getattr(response.raw, "tell", None)
+    if tell is not None:
+        try:
+            return int(tell())
+        except (TypeError, ValueError, OSError):
+            pass
+    return len(response.content)
@@ -0,0 +1,68 @@
+"""Hash index of successfully written records, used to skip duplicates."""
+
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from target_dynamics_finance.serialize import DEFAULT_SERIALIZER, Serializer
+
+
+class DedupIndex:
+    """O(1) lookup of the state of a record hash per stream.
+
+    States are kept encoded in memory, so compact bookmarks aren't held a
+    second time as dicts, and, when a path is given, in a SQLite file so a
+    restarted job skips the records written by the previous run.
+    """
+
+    def __init__(self, path: Optional[str] = None, serializer: Serializer = DEFAULT_SERIALIZER) -> None:
+        self.serializer = serializer
+        self._states: Dict[Tuple[str, str], bytes] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS record_hashes "
+                "(stream TEXT NOT NULL, hash TEXT NOT NULL, state TEXT NOT NULL, PRIMARY KEY (stream, hash))"
+            )
+            self._db.commit()
+
+    def get(self, stream: str, hash: str) -> Optional[dict]:
+        with self._lock:
+            encoded = self._states.get((stream, hash))
+            if encoded is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT state FROM record_hashes WHERE stream = ? AND hash = ?", (stream, hash)
+                ).fetchone()
+                if row:
+                    encoded = self._states[(stream, hash)] = row[0].encode()
+        return self.serializer.loads(encoded) if encoded is not None else None
+
+    def add(self, stream: str, state: dict, persist: bool = True) -> None:
+        """Index a record state if it was written successfully."""
+        hash = state.get("hash")
+        if not hash or not state.get("success"):
+            return
+        with self._lock:
+            if (stream, hash) in self._states:
+                return
+            encoded = self._states[(stream, hash)] = self.serializer.dumps(state)
+            if persist and self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO record_hashes (stream, hash, state) VALUES (?, ?, ?)",
+                    (stream, hash, encoded.decode()),
+                )
+                self._db.commit()
+
+    def load(self, stream: str, states: Iterable[dict]) -> None:
+        """Index the bookmarks of a previous state."""
+        for state in states:
+            self.add(stream, state, persist=False)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
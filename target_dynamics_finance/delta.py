@@ -0,0 +1,62 @@
+"""Diff of an incoming record against the entity already stored in Dynamics."""
+
+from datetime import datetime
+from typing import Any, Iterable
+
+ETAG_KEY = "@odata.etag"
+# dates Dynamics stores without a time come back at midnight UTC
+MIDNIGHT_SUFFIXES = ("T00:00:00Z", "T00:00:00+00:00", "T00:00:00")
+
+
+def normalize(value: Any) -> Any:
+    """Bring a field value to a form where equal Dynamics values compare equal."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        for suffix in MIDNIGHT_SUFFIXES:
+            if text.endswith(suffix):
+                return text[: -len(suffix)]
+        if len(text) > 10 and text[10] == "T":
+            try:
+                return datetime.fromisoformat(text.replace("Z", "+00:00")).isoformat()
+            except ValueError:
+                pass
+        return text
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def same_value(value: Any, existing: Any) -> bool:
+    value, existing = normalize(value), normalize(existing)
+    if value == existing:
+        return True
+    # numbers sent as strings are stored as numbers, e.g. "10.50" and 10.5
+    if isinstance(existing, float) and isinstance(value, str):
+        try:
+            return float(value) == existing
+        except ValueError:
+            return False
+    return False
+
+
+def changed_fields(record: dict, existing: dict, ignore: Iterable[str] = ()) -> dict:
+    """Return the fields of record whose value differs from the existing entity.
+
+    Fields the entity doesn't return are always treated as changed.
+    """
+    ignore = set(ignore)
+    changes = {}
+    for key, value in record.items():
+        if key in ignore:
+            continue
+        if key not in existing or not same_value(value, existing[key]):
+            changes[key] = value
+    return changes
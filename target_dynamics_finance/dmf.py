@@ -0,0 +1,205 @@
+"""Bulk imports through Data Management Framework (DMF) data packages."""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from xml.sax.saxutils import escape
+
+DMF_ACTIONS = "/DataManagementDefinitionGroups/Microsoft.Dynamics.DataEntities"
+# rows of a stream imported by one package
+DEFAULT_PACKAGE_SIZE = 50000
+DEFAULT_POLL_INTERVAL = 5.0
+MAX_POLL_INTERVAL = 60.0
+DEFAULT_IMPORT_TIMEOUT = 2 * 60 * 60
+# execution states after which DMF won't change the outcome anymore
+FINAL_STATUSES = {"Succeeded", "PartiallySucceeded", "Failed", "Canceled"}
+
+MANIFEST = """<?xml version="1.0" encoding="utf-8"?>
+<DataManagementPackageManifest xmlns:i="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://schemas.microsoft.com/dynamics/2015/01/DataManagement">
+  <DefinitionGroupId>{group}</DefinitionGroupId>
+  <Description>{group}</Description>
+  <PackageEntityList>
+    <DataManagementPackageEntityData>
+      <DefaultRefreshType>IncrementalPush</DefaultRefreshType>
+      <Entity>{entity}</Entity>
+      <ExcelWorkSheetName>{entity}</ExcelWorkSheetName>
+      <InputFilePath>{file_name}</InputFilePath>
+      <IsEnabled>true</IsEnabled>
+      <SampleFilePath>{file_name}</SampleFilePath>
+      <SourceFormatName>CSV</SourceFormatName>
+      <ValidationStatus>Yes</ValidationStatus>
+    </DataManagementPackageEntityData>
+  </PackageEntityList>
+</DataManagementPackageManifest>
+"""
+
+PACKAGE_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<DataManagementPackageHeader xmlns:i="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://schemas.microsoft.com/dynamics/2015/01/DataManagement">
+  <Description>{group}</Description>
+  <ManifestType>Microsoft.Dynamics.AX.Framework.Tools.DataManagement.Serialization.DataManagementPackageManifest</ManifestType>
+  <PackageType>DefinitionGroup</PackageType>
+  <PackageVersion>2</PackageVersion>
+</DataManagementPackageHeader>
+"""
+
+
+def csv_value(value: Any) -> str:
+    """Format a record value the way DMF reads it from a CSV file."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class PackageWriter:
+    """Stream the rows of one entity to a CSV file, then zip it into a data package.
+
+    Rows are written to disk as they arrive, only the package zip is built at
+    the end, so memory doesn't grow with the size of the load.
+    """
+
+    def __init__(self, entity: str, columns: List[str], directory: Optional[str] = None) -> None:
+        self.entity = entity
+        self.columns = columns
+        self.file_name = f"{entity}.csv"
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix="dmf-", suffix=".csv")
+        self._file = os.fdopen(fd, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+        self.rows = 0
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._writer.writerow([csv_value(record.get(column)) for column in self.columns])
+        self.rows += 1
+
+    def build(self, definition_group: str, template: Optional[str] = None) -> str:
+        """Zip the rows with a manifest into a package, returning its path.
+
+        The manifest and package header of a template package exported from
+        DMF are reused when given, generated otherwise.
+        """
+        self._file.close()
+        package_path = f"{self.path[:-len('.csv')]}.zip"
+        with zipfile.ZipFile(package_path, "w", zipfile.ZIP_DEFLATED) as package:
+            if template:
+                with zipfile.ZipFile(template) as source:
+                    package.writestr("Manifest.xml", source.read("Manifest.xml"))
+                    package.writestr("PackageHeader.xml", source.read("PackageHeader.xml"))
+            else:
+                values = {
+                    "group": escape(definition_group),
+                    "entity": escape(self.entity),
+                    "file_name": escape(self.file_name),
+                }
+                package.writestr("Manifest.xml", MANIFEST.format(**values))
+                package.writestr("PackageHeader.xml", PACKAGE_HEADER.format(**values))
+            package.write(self.path, self.file_name)
+        os.remove(self.path)
+        return package_path
+
+
+def parse_error_keys(text: str) -> List[Dict[str, str]]:
+    """Parse the target error keys file of an execution into key dicts."""
+    return [dict(row) for row in csv.DictReader(io.StringIO(text.lstrip("\ufeff")))]
+
+
+class DmfImporter:
+    """Upload a data package, import it and collect the keys of the failed rows.
+
+    `request(action, body)` calls a DMF action of the environment and returns
+    its decoded `value`, `session` uploads the package and downloads the
+    error keys file, which live in Azure blob storage.
+    """
+
+    def __init__(
+        self,
+        request: Callable[[str, dict], Any],
+        session,
+        timeout=None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        import_timeout: float = DEFAULT_IMPORT_TIMEOUT,
+        logger=None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.request = request
+        self.session = session
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.import_timeout = import_timeout
+        self.logger = logger
+        self.sleep = sleep
+
+    def upload(self, package_path: str) -> str:
+        """Upload a package to the blob storage of the environment, returning its URL."""
+        write_url = self.request("GetAzureWriteUrl", {"uniqueFileName": os.path.basename(package_path)})
+        blob_url = json.loads(write_url)["BlobUrl"] if isinstance(write_url, str) else write_url["BlobUrl"]
+        with open(package_path, "rb") as f:
+            response = self.session.put(
+                blob_url, data=f, headers={"x-ms-blob-type": "BlockBlob"}, timeout=self.timeout
+            )
+        response.raise_for_status()
+        return blob_url
+
+    def wait(self, execution_id: str) -> str:
+        """Poll an execution with a growing interval until it is final."""
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.import_timeout
+        while True:
+            status = self.request("GetExecutionSummaryStatus", {"executionId": execution_id})
+            if status in FINAL_STATUSES:
+                return status
+            if time.monotonic() >= deadline:
+                raise Exception(f"DMF execution {execution_id} is still {status} after {self.import_timeout} seconds")
+            if self.logger:
+                self.logger.info("DMF execution %s is %s, checking again in %.0fs", execution_id, status, interval)
+            self.sleep(interval)
+            interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+
+    def error_keys(self, execution_id: str, entity: str) -> List[Dict[str, str]]:
+        """Keys of the rows of an entity that failed to import."""
+        body = {"executionId": execution_id, "entityName": entity}
+        if not self.request("GenerateImportTargetErrorKeysFile", body):
+            return []
+        interval = self.poll_interval
+        deadline = time.monotonic() + self.import_timeout
+        url = self.request("GetImportTargetErrorKeysFileUrl", body)
+        while not url:
+            if time.monotonic() >= deadline:
+                raise Exception(f"Error keys file of DMF execution {execution_id} was not generated")
+            self.sleep(interval)
+            interval = min(interval * 1.5, MAX_POLL_INTERVAL)
+            url = self.request("GetImportTargetErrorKeysFileUrl", body)
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_error_keys(response.content.decode("utf-8"))
+
+    def run(self, package_path: str, definition_group: str, entity: str, legal_entity: str = ""):
+        """Import a package, returning the execution status and the failed row keys."""
+        blob_url = self.upload(package_path)
+        execution_id = self.request(
+            "ImportFromPackage",
+            {
+                "packageUrl": blob_url,
+                "definitionGroupId": definition_group,
+                "executionId": "",
+                "execute": True,
+                "overwrite": True,
+                "legalEntityId": legal_entity,
+            },
+        )
+        status = self.wait(execution_id)
+        failed = self.error_keys(execution_id, entity) if status == "PartiallySucceeded" else []
+        return execution_id, status, failed
+
+
+def row_key(row: Dict[str, Any], fields: Iterable[str]) -> tuple:
+    """Case-insensitive key of a row, to match the error keys file with records."""
+    return tuple(str(row.get(field) or "").lower() for field in fields)
@@ -0,0 +1,73 @@
+"""Write-ahead journal of the operations of multi-request records, such as invoices."""
+
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+
+class Journal:
+    """Append-only log of the requests already applied for a record.
+
+    Every operation (the header, a line, an attachment) is committed with the
+    Dynamics response it got before the next one is sent, so a run killed
+    halfway through an invoice resumes after its last completed operation.
+    The SQLite file uses WAL with synchronous=NORMAL: commits survive the
+    process being killed and fsyncs are batched at checkpoints. Entries are
+    loaded in memory, so checking a record costs O(1).
+    """
+
+    def __init__(self, path: str) -> None:
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS journal (stream TEXT NOT NULL, hash TEXT NOT NULL, "
+            "step TEXT NOT NULL, result TEXT, PRIMARY KEY (stream, hash, step))"
+        )
+        self._db.commit()
+        for stream, hash, step, result in self._db.execute("SELECT stream, hash, step, result FROM journal"):
+            self._entries.setdefault((stream, hash), {})[step] = json.loads(result)
+
+    def steps(self, stream: str, hash: str) -> Dict[str, Any]:
+        """Operations already applied for a record, by step name."""
+        with self._lock:
+            return dict(self._entries.get((stream, hash), {}))
+
+    def record(self, stream: str, hash: str, step: str, result: Optional[Any] = None) -> None:
+        with self._lock:
+            self._entries.setdefault((stream, hash), {})[step] = result
+            self._db.execute(
+                "INSERT OR REPLACE INTO journal (stream, hash, step, result) VALUES (?, ?, ?, ?)",
+                (stream, hash, step, json.dumps(result, default=str)),
+            )
+            self._db.commit()
+
+    def complete(self, stream: str, hash: str, result: Optional[Any] = None) -> None:
+        """Replace the operations of a finished record by a single "done" entry."""
+        with self._lock:
+            self._entries[(stream, hash)] = {"done": result}
+            self._db.execute("DELETE FROM journal WHERE stream = ? AND hash = ?", (stream, hash))
+            self._db.execute(
+                "INSERT INTO journal (stream, hash, step, result) VALUES (?, ?, ?, ?)",
+                (stream, hash, "done", json.dumps(result, default=str)),
+            )
+            self._db.commit()
+
+    def clear(self, stream: str, hash: str) -> None:
+        """Forget a record whose operations were rolled back."""
+        with self._lock:
+            if self._entries.pop((stream, hash), None) is None:
+                return
+            self._db.execute("DELETE FROM journal WHERE stream = ? AND hash = ?", (stream, hash))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,83 @@
+"""Request logging with lazy rendering, redaction, truncation and sampling."""
+
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+DEFAULT_BODY_MAX_CHARS = 1000
+REDACTED = "***"
+SECRET_KEYS = {"client_secret", "refresh_token", "access_token", "password", "authorization"}
+# large values that are never useful in a log line
+OMITTED_KEYS = {"FileContents"}
+
+
+def redact(data: Any) -> Any:
+    """Return a copy of data with secrets and file contents replaced."""
+    if isinstance(data, dict):
+        redacted = {}
+        for key, value in data.items():
+            if str(key).lower() in SECRET_KEYS:
+                redacted[key] = REDACTED
+            elif key in OMITTED_KEYS:
+                redacted[key] = f"<{len(value) if value is not None else 0} chars>"
+            else:
+                redacted[key] = redact(value)
+        return redacted
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+
+class LazyBody:
+    """Request body rendered (redacted and truncated) only if the log line is emitted."""
+
+    __slots__ = ("body", "max_chars")
+
+    def __init__(self, body: Any, max_chars: Optional[int] = DEFAULT_BODY_MAX_CHARS) -> None:
+        self.body = body
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        if isinstance(self.body, (bytes, bytearray)):
+            return f"<{len(self.body)} bytes>"
+        if self.body is not None and not isinstance(self.body, (dict, list, str)):
+            return repr(self.body)
+        text = json.dumps(redact(self.body), default=str)
+        if self.max_chars and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... ({len(text)} chars)"
+        return text
+
+
+class RequestLogger:
+    """Logs requests at INFO for a sample of each endpoint, full bodies at DEBUG."""
+
+    def __init__(self, logger: logging.Logger, config: Dict[str, Any]) -> None:
+        self.logger = logger
+        sample_rate = float(config.get("log_sample_rate", 1) or 0)
+        self.sample_every = round(1 / sample_rate) if sample_rate > 0 else 0
+        self.max_chars = int(config.get("log_body_max_chars") or DEFAULT_BODY_MAX_CHARS)
+        self.full_payloads = bool(config.get("log_full_payloads"))
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def sampled(self, endpoint: str) -> bool:
+        if not self.sample_every:
+            return False
+        key = endpoint.split("(")[0]
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.sample_every == 0
+
+    def request(self, method: str, url: str, endpoint: str, params: Any, body: Any) -> None:
+        if self.full_payloads and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Sending request %s to url %s with params %s and body %s",
+                method, url, params, LazyBody(body, None),
+            )
+        elif self.logger.isEnabledFor(logging.INFO) and self.sampled(endpoint):
+            self.logger.info(
+                "Sending request %s to url %s with params %s and body %s",
+                method, url, params, LazyBody(body, self.max_chars),
+            )
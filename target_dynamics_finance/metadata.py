@@ -0,0 +1,166 @@
+"""OData $metadata model of the entity sets, cached on disk per environment."""
+
+import datetime
+import decimal
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# $metadata of an environment only changes on deployments
+DEFAULT_METADATA_TTL = 24 * 60 * 60
+INTEGER_TYPES = {"Edm.Int16", "Edm.Int32", "Edm.Int64", "Edm.Byte", "Edm.SByte"}
+NUMBER_TYPES = {"Edm.Decimal", "Edm.Double", "Edm.Single"}
+DATE_TYPES = {"Edm.Date", "Edm.DateTimeOffset"}
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_metadata(source) -> dict:
+    """Index a CSDL document into entity sets, entity types and enum members.
+
+    The document of a Finance and Operations environment is tens of MB, it is
+    parsed incrementally and only keys, property types and enums are kept.
+    """
+    entity_sets: Dict[str, str] = {}
+    entity_types: Dict[str, dict] = {}
+    enums: Dict[str, List[str]] = {}
+    namespace = ""
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        tag = _local(element.tag)
+        if event == "start":
+            if tag == "Schema":
+                namespace = element.get("Namespace", "")
+            continue
+        if tag == "EntityType":
+            keys = [ref.get("Name") for ref in element.iter() if _local(ref.tag) == "PropertyRef"]
+            properties = {}
+            for prop in element:
+                if _local(prop.tag) == "Property":
+                    max_length = prop.get("MaxLength")
+                    properties[prop.get("Name")] = [
+                        prop.get("Type"),
+                        prop.get("Nullable", "true") != "false",
+                        int(max_length) if max_length and max_length.isdigit() else None,
+                    ]
+            entity_types[f"{namespace}.{element.get('Name')}"] = {"keys": keys, "properties": properties}
+            element.clear()
+        elif tag == "EnumType":
+            enums[f"{namespace}.{element.get('Name')}"] = [
+                member.get("Name") for member in element if _local(member.tag) == "Member"
+            ]
+            element.clear()
+        elif tag == "EntitySet":
+            entity_sets[element.get("Name")] = element.get("EntityType")
+            element.clear()
+    return {"entity_sets": entity_sets, "entity_types": entity_types, "enums": enums}
+
+
+def _check_value(type_name: str, value: Any, max_length: Optional[int], enums: dict) -> Optional[str]:
+    """Describe why a value can't be sent as a property type, None if it can."""
+    if type_name == "Edm.String":
+        if isinstance(value, str) and max_length and len(value) > max_length:
+            return f"is {len(value)} characters, longer than {max_length}"
+    elif type_name in INTEGER_TYPES:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            return f"expected an integer, got {type(value).__name__}"
+        if isinstance(value, str) and not value.strip().lstrip("-").isdigit():
+            return f"expected an integer, got '{value}'"
+    elif type_name in NUMBER_TYPES:
+        if isinstance(value, bool):
+            return "expected a number, got bool"
+        try:
+            decimal.Decimal(str(value))
+        except decimal.InvalidOperation:
+            return f"expected a number, got '{value}'"
+    elif type_name == "Edm.Boolean":
+        if not isinstance(value, bool):
+            return f"expected a boolean, got {type(value).__name__}"
+    elif type_name in DATE_TYPES:
+        try:
+            datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return f"expected a date, got '{value}'"
+    elif type_name in enums:
+        if value not in enums[type_name]:
+            return f"'{value}' is not one of {', '.join(enums[type_name])}"
+    return None
+
+
+class EntityModel:
+    """Keys and property types of the entity sets of an environment."""
+
+    def __init__(self, index: dict) -> None:
+        self.index = index
+
+    def entity_type(self, entity_set: str) -> Optional[dict]:
+        type_name = self.index["entity_sets"].get(entity_set.strip("/"))
+        return self.index["entity_types"].get(type_name) if type_name else None
+
+    def keys(self, entity_set: str) -> Optional[List[str]]:
+        entity_type = self.entity_type(entity_set)
+        return list(entity_type["keys"]) if entity_type else None
+
+    def validate(self, entity_set: str, record: dict, ignore: Iterable[str] = ()) -> Tuple[dict, List[str], List[str]]:
+        """Check a record against an entity set before it is sent.
+
+        Returns the record without the fields the entity doesn't have, the
+        names of the pruned fields and the errors of the remaining fields.
+        Entity sets missing from the model are returned as they are.
+        """
+        entity_type = self.entity_type(entity_set)
+        if entity_type is None:
+            return record, [], []
+        properties = entity_type["properties"]
+        ignore = set(ignore)
+        pruned, errors, result = [], [], {}
+        for field, value in record.items():
+            prop = properties.get(field)
+            if prop is None and field not in ignore:
+                pruned.append(field)
+                continue
+            result[field] = value
+            if prop is None:
+                continue
+            type_name, nullable, max_length = prop
+            if value is None:
+                if not nullable:
+                    errors.append(f"{field} can't be null")
+                continue
+            error = _check_value(type_name, value, max_length, self.index["enums"])
+            if error:
+                errors.append(f"{field} {error}")
+        return result, pruned, errors
+
+
+class MetadataCache:
+    """Load the model of an environment from disk, downloading it when stale."""
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl: float = DEFAULT_METADATA_TTL) -> None:
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        self.ttl = ttl
+
+    def path(self, base_url: str) -> str:
+        digest = hashlib.sha1(base_url.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"dynamics-metadata-{digest}.json")
+
+    def load(self, base_url: str, fetch) -> EntityModel:
+        """Return the model of base_url, calling fetch() for the XML if needed."""
+        path = self.path(base_url)
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.ttl:
+            with open(path) as f:
+                return EntityModel(json.load(f))
+
+        index = parse_metadata(io.BytesIO(fetch()))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, path)
+        return EntityModel(index)
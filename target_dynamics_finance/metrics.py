@@ -0,0 +1,202 @@
+"""Hot path instrumentation: per-endpoint counters, latency histograms and profiling."""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# latency histogram bucket upper bounds, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")]
+
+
+class Timing:
+    """Counters and latency histogram of one endpoint or code section."""
+
+    __slots__ = (
+        "count",
+        "errors",
+        "retries",
+        "total",
+        "max",
+        "bytes_sent",
+        "bytes_received",
+        "bytes_saved",
+        "buckets",
+    )
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # bytes not transferred thanks to compressed request and response bodies
+        self.bytes_saved = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return self.max if bound == float("inf") else bound
+        return 0.0
+
+    def to_dict(self) -> dict:
+        result = {
+            "count": self.count,
+            "total_seconds": round(self.total, 3),
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 2),
+            "p99_ms": round(self.quantile(0.99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+        for key in ("errors", "retries", "bytes_sent", "bytes_received", "bytes_saved"):
+            if getattr(self, key):
+                result[key] = getattr(self, key)
+        return result
+
+
+def operation_name(method: str, endpoint: Optional[str]) -> str:
+    """Name a request after its method and entity set, e.g. "POST VendorInvoiceLines"."""
+    entity = (endpoint or "").strip("/").split("(")[0].split("?")[0]
+    return f"{method} {entity}"
+
+
+class Metrics:
+    """Thread-safe registry of timings, keyed by endpoint ("GET VendorsV3") or section."""
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._timings: Dict[str, Timing] = {}
+        self._lock = threading.Lock()
+
+    def _timing(self, name: str) -> Timing:
+        timing = self._timings.get(name)
+        if timing is None:
+            timing = self._timings.setdefault(name, Timing())
+        return timing
+
+    def observe(
+        self,
+        name: str,
+        seconds: float,
+        error: bool = False,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        bytes_saved: int = 0,
+    ) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            timing = self._timing(name)
+            timing.observe(seconds)
+            timing.errors += int(error)
+            timing.bytes_sent += bytes_sent
+            timing.bytes_received += bytes_received
+            timing.bytes_saved += bytes_saved
+
+    def count_retry(self, name: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._timing(name).retries += 1
+
+    @contextmanager
+    def timed(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, error=error)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: timing.to_dict() for name, timing in sorted(self._timings.items())}
+
+    def to_prometheus(self, prefix: str = "target_dynamics_finance", openmetrics: bool = False) -> str:
+        """Render the timings in the Prometheus text (or OpenMetrics) exposition format."""
+        lines: List[str] = [
+            f"# TYPE {prefix}_duration_seconds histogram",
+        ]
+        with self._lock:
+            timings = sorted(self._timings.items())
+            for name, timing in timings:
+                label = f'operation="{name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, timing.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{prefix}_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f"{prefix}_duration_seconds_sum{{{label}}} {timing.total}")
+                lines.append(f"{prefix}_duration_seconds_count{{{label}}} {timing.count}")
+            for counter in ("errors", "retries", "bytes_sent", "bytes_received", "bytes_saved"):
+                # OpenMetrics names the counter family without the _total suffix
+                family = f"{prefix}_{counter}" if openmetrics else f"{prefix}_{counter}_total"
+                lines.append(f"# TYPE {family} counter")
+                for name, timing in timings:
+                    lines.append(f'{prefix}_{counter}_total{{operation="{name}"}} {getattr(timing, counter)}')
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, openmetrics: bool = False) -> None:
+        """Write a Prometheus textfile (or OpenMetrics dump), replacing it atomically."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.to_prometheus(openmetrics=openmetrics))
+        os.replace(temp_path, path)
+
+
+class Profiler:
+    """Profile a whole run with cProfile or, if installed, pyinstrument."""
+
+    def __init__(self, kind: str, path: Optional[str] = None) -> None:
+        self.kind = kind
+        self.path = path
+        self._profiler = None
+
+    def start(self) -> None:
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler as PyInstrumentProfiler
+
+            self._profiler = PyInstrumentProfiler()
+            self._profiler.start()
+        else:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        if self._profiler is None:
+            return
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            with open(self.path or "target-dynamics-finance-profile.html", "w") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path or "target-dynamics-finance.prof")
+        self._profiler = None
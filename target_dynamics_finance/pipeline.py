@@ -0,0 +1,54 @@
+"""Bounded input reading and memory accounting of buffered records."""
+
+import queue
+import threading
+from typing import IO, Any, Iterator
+
+# buffered records allowed in memory across all sinks before they are drained
+DEFAULT_MAX_BUFFER_BYTES = 64 * 1024 * 1024
+_END = object()
+
+
+def record_size(value: Any) -> int:
+    """Approximate the memory held by a parsed record, nested lines included."""
+    if isinstance(value, dict):
+        return 64 + sum(len(key) + record_size(item) for key, item in value.items())
+    if isinstance(value, list):
+        return 56 + sum(record_size(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return 49 + len(value)
+    return 24
+
+
+class BufferedInput:
+    """Iterate the lines of a stream read ahead on a thread, through a bounded queue.
+
+    Reading stdin overlaps with sending requests, and stops once `max_lines`
+    lines are waiting, so a slow Dynamics holds back the tap instead of the
+    target's memory growing.
+    """
+
+    def __init__(self, stream: IO[str], max_lines: int) -> None:
+        self.stream = stream
+        self._queue: queue.Queue = queue.Queue(maxsize=max_lines)
+        self._error = None
+        self._thread = threading.Thread(target=self._read, name="singer-input", daemon=True)
+        self._thread.start()
+
+    def _read(self) -> None:
+        try:
+            for line in self.stream:
+                self._queue.put(line)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._queue.put(_END)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            line = self._queue.get()
+            if line is _END:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield line
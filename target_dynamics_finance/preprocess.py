@@ -0,0 +1,100 @@
+"""Per-stream record preprocessing compiled from the Singer schema."""
+
+import ast
+import datetime
+from typing import Any, Callable, Dict, List
+
+from target_dynamics_finance.serialize import loads
+
+
+Converter = Callable[[Any], Any]
+
+
+def _types(schema: dict) -> List[str]:
+    types = schema.get("type", [])
+    if isinstance(types, str):
+        types = [types]
+    types = list(types)
+    for sub_schema in schema.get("anyOf", []):
+        types.extend(_types(sub_schema))
+    return types
+
+
+def _formats(schema: dict) -> List[str]:
+    formats = [schema.get("format")]
+    formats.extend(s.get("format") for s in schema.get("anyOf", []))
+    return [f for f in formats if f]
+
+
+def parse_json(value: Any) -> Any:
+    """Parse JSON (or python literal) strings, keeping other values as they are."""
+    if not isinstance(value, str):
+        return value
+    try:
+        return loads(value)
+    except ValueError:
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+
+def to_date(value: Any) -> Any:
+    """Format dates, date-times and their ISO strings as Y-m-d.
+
+    The SDK has already parsed date fields into datetime objects when records
+    reach the sink, strings only come from callers that skip its validation.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    if not isinstance(value, str):
+        return value
+    try:
+        return datetime.date.fromisoformat(value[:10]).strftime("%Y-%m-%d")
+    except ValueError:
+        return value
+
+
+def clean_value(value: Any) -> Any:
+    """Generic conversion for fields that are not described by the schema."""
+    if not value:
+        return None
+    if isinstance(value, str) and (value.startswith("[") or value.startswith("{")):
+        return parse_json(value)
+    return value
+
+
+def _nullify(convert: Converter) -> Converter:
+    # empty values have always been sent as null
+    def converter(value: Any) -> Any:
+        if not value:
+            return None
+        return convert(value)
+
+    return converter
+
+
+def _keep(value: Any) -> Any:
+    return value
+
+
+def build_converters(schema: dict) -> Dict[str, Converter]:
+    """Build a converter for every top level property of a stream schema."""
+    converters = {}
+    for name, property_schema in schema.get("properties", {}).items():
+        types = _types(property_schema)
+        if "date" in _formats(property_schema):
+            convert = to_date
+        elif "object" in types or "array" in types:
+            convert = parse_json
+        else:
+            convert = _keep
+        converters[name] = _nullify(convert)
+    return converters
+
+
+def preprocess(record: dict, converters: Dict[str, Converter]) -> dict:
+    """Convert every field of a record in place with the stream converters."""
+    for key, value in record.items():
+        record[key] = converters.get(key, clean_value)(value)
+    return record
@@ -0,0 +1,56 @@
+"""JSON encoding of request bodies and decoding of responses.
+
+orjson is used when it is installed, the standard library otherwise. Both
+produce compact bodies, encoded once to bytes.
+"""
+
+import datetime
+import decimal
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """Encode the values the JSON encoders don't know."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_default).encode()
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class Serializer:
+    """A pair of dumps (to bytes) and loads functions, picked by name."""
+
+    def __init__(self, name: Optional[str] = None) -> None:
+        if name is None:
+            name = "orjson" if orjson is not None else "json"
+        if name == "orjson":
+            if orjson is None:
+                raise Exception("json_serializer is 'orjson' but orjson is not installed")
+            self.dumps: Callable[[Any], bytes] = _orjson_dumps
+            self.loads: Callable[[Union[bytes, str]], Any] = orjson.loads
+        elif name == "json":
+            self.dumps = _json_dumps
+            self.loads = json.loads
+        else:
+            raise Exception(f"Unknown json_serializer '{name}', expected 'orjson' or 'json'")
+        self.name = name
+
+
+DEFAULT_SERIALIZER = Serializer()
+dumps = DEFAULT_SERIALIZER.dumps
+loads = DEFAULT_SERIALIZER.loads
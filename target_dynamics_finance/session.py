@@ -0,0 +1,127 @@
+"""Shared HTTP transport for Dynamics Finance requests."""
+
+import time
+from typing import Any, Dict, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util import make_headers
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+
+
+class CaptureAdapter(HTTPAdapter):
+    """Send requests, writing each one with its response and timing to a cassette."""
+
+    def __init__(self, writer, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.writer = writer
+
+    def send(self, request, **kwargs):
+        from target_dynamics_finance.cassette import capture_entry
+
+        started = self.writer.offset()
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        # reading the content here keeps the timing of the full response
+        response.content
+        self.writer.record(capture_entry(request, response, started, time.monotonic() - start))
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serve the responses of a cassette instead of sending requests.
+
+    Responses take their captured time multiplied by latency_scale, 0 serves
+    them immediately. With a writer, the replayed requests are captured too,
+    to compare the request pattern of a change with the captured run.
+    """
+
+    def __init__(self, cassette, latency_scale: float = 1.0, writer=None) -> None:
+        super().__init__()
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.writer = writer
+
+    def send(self, request, **kwargs):
+        from target_dynamics_finance.cassette import capture_entry, response_content
+
+        started = self.writer.offset() if self.writer else 0.0
+        try:
+            entry = self.cassette.match(request.method, request.url)
+        except KeyError as e:
+            raise requests.ConnectionError(str(e), request=request)
+        if self.latency_scale > 0:
+            time.sleep(entry["elapsed"] * self.latency_scale)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response._content = response_content(entry)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        if self.writer:
+            self.writer.record(capture_entry(request, response, started, entry["elapsed"] * self.latency_scale))
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def build_adapter(config: Dict[str, Any], **kwargs) -> BaseAdapter:
+    """Pooled adapter, capturing to http_capture_path or replaying http_replay_path."""
+    writer = None
+    if config.get("http_capture_path"):
+        from target_dynamics_finance.cassette import CassetteWriter
+
+        writer = CassetteWriter(config["http_capture_path"])
+    if config.get("http_replay_path"):
+        from target_dynamics_finance.cassette import Cassette
+
+        latency_scale = config.get("replay_latency_scale")
+        return ReplayAdapter(
+            Cassette.load(config["http_replay_path"]),
+            float(latency_scale) if latency_scale is not None else 1.0,
+            writer,
+        )
+    if writer:
+        return CaptureAdapter(writer, **kwargs)
+    return HTTPAdapter(**kwargs)
+
+
+def build_session(config: Dict[str, Any]) -> requests.Session:
+    """Build a pooled, keep-alive session from the target config."""
+    session = requests.Session()
+    # every worker needs its own connection to avoid waiting on the pool
+    pool_maxsize = max(
+        int(config.get("pool_maxsize") or DEFAULT_POOL_MAXSIZE),
+        int(config.get("max_workers") or 1),
+    )
+    adapter = build_adapter(
+        config,
+        pool_connections=int(config.get("pool_connections") or DEFAULT_POOL_CONNECTIONS),
+        pool_maxsize=pool_maxsize,
+        pool_block=bool(config.get("pool_block", False)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if config.get("keep_alive") is False:
+        session.headers["Connection"] = "close"
+    # every encoding urllib3 can decode (gzip, deflate, and br/zstd when installed),
+    # responses are decoded as they are read
+    session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)["accept-encoding"]
+    return session
+
+
+def get_timeout(config: Dict[str, Any]) -> Tuple[float, float]:
+    """Return the (connect, read) timeout tuple used for every request."""
+    return (
+        float(config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT),
+        float(config.get("read_timeout") or DEFAULT_READ_TIMEOUT),
+    )
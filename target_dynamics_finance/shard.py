@@ -0,0 +1,186 @@
+"""Sharded runs: records spread over worker processes, their states merged."""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import zlib
+from typing import IO, Any, Dict, List, Optional
+
+# set in the environment of worker processes, with their shard number
+SHARD_ENV = "TARGET_DYNAMICS_FINANCE_SHARD"
+WORKER_COMMAND = [sys.executable, "-m", "target_dynamics_finance.startup"]
+
+
+def config_values(argv: List[str]) -> dict:
+    """Merge the config files passed with --config, the way the CLI does."""
+    config = {}
+    for index, arg in enumerate(argv):
+        if arg == "--config" and index + 1 < len(argv) and argv[index + 1] != "ENV":
+            with open(argv[index + 1]) as f:
+                config.update(json.load(f))
+    return config
+
+
+def shard_key(stream: str, record: dict, key_properties: List[str], by: str = "record") -> str:
+    """Stable key of a record: its company, its keys or, without keys, its contents.
+
+    Records with the same key always go to the same worker, so repeated
+    records are deduplicated by the worker that wrote the first copy.
+    """
+    if by == "dataAreaId":
+        return str(record.get("dataAreaId") or "").lower()
+    values = [record.get(key) for key in key_properties]
+    if key_properties and all(value not in (None, "") for value in values):
+        return json.dumps([stream, values], default=str)
+    return json.dumps([stream, record], sort_keys=True, default=str)
+
+
+def merge_summaries(summaries: List[dict]) -> dict:
+    """Add up the counters of the summaries of several workers."""
+    merged: Dict = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                merged[key] = merge_summaries([merged.get(key) or {}, value])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+            else:
+                merged[key] = value
+    return merged
+
+
+def merge_bookmark(merged: Any, bookmark: Any) -> Any:
+    """Merge the bookmark of a stream from one more worker, keeping its shape.
+
+    Record results are concatenated. Dict bookmarks are merged by key with the
+    latest value winning, except the record count of a results_dir cursor,
+    which is summed; the files of the other workers sit next to its path.
+    """
+    if isinstance(merged, list) and isinstance(bookmark, list):
+        return merged + bookmark
+    if isinstance(merged, dict) and isinstance(bookmark, dict):
+        result = {**merged, **bookmark}
+        if merged.get("results_path") and bookmark.get("results_path"):
+            result["count"] = merged.get("count", 0) + bookmark.get("count", 0)
+        return result
+    return bookmark
+
+
+def merge_states(states: List[dict]) -> dict:
+    """Merge the latest states of the workers into one state.
+
+    Bookmarks are merged per stream, summary counters are summed and request
+    metrics, which can't be summed, are kept per shard.
+    """
+    merged: Dict = {}
+    bookmarks: Dict[str, Any] = {}
+    summaries = []
+    metrics = {}
+    for shard, state in enumerate(states):
+        for key, value in state.items():
+            if key == "bookmarks":
+                for stream, bookmark in value.items():
+                    bookmarks[stream] = merge_bookmark(bookmarks[stream], bookmark) if stream in bookmarks else bookmark
+            elif key == "summary":
+                summary = dict(value)
+                if "metrics" in summary:
+                    metrics[f"shard-{shard}"] = summary.pop("metrics")
+                summaries.append(summary)
+            else:
+                merged[key] = value
+    if bookmarks:
+        merged["bookmarks"] = bookmarks
+    if summaries:
+        merged["summary"] = merge_summaries(summaries)
+        if metrics:
+            merged["summary"]["metrics"] = metrics
+    return merged
+
+
+class ShardedRun:
+    """Run `workers` target processes and route the Singer input between them."""
+
+    def __init__(
+        self,
+        argv: List[str],
+        workers: int,
+        by: str = "record",
+        output: Optional[IO[str]] = None,
+        command: List[str] = WORKER_COMMAND,
+    ) -> None:
+        self.argv = argv
+        self.command = command
+        self.workers = workers
+        self.by = by
+        self.output = output or sys.stdout
+        self.key_properties: Dict[str, List[str]] = {}
+        self.states: List[dict] = [{} for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._processes: List[subprocess.Popen] = []
+        self._readers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for shard in range(self.workers):
+            env = dict(os.environ, **{SHARD_ENV: str(shard)})
+            process = subprocess.Popen(
+                [*self.command, *self.argv],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=env,
+                text=True,
+            )
+            reader = threading.Thread(target=self._read_states, args=(shard, process.stdout), daemon=True)
+            reader.start()
+            self._processes.append(process)
+            self._readers.append(reader)
+
+    def _read_states(self, shard: int, stdout: IO[str]) -> None:
+        """Emit a merged state every time a worker emits its own (a checkpoint)."""
+        for line in stdout:
+            try:
+                state = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(state, dict):
+                with self._lock:
+                    self.states[shard] = state
+                    self.emit()
+
+    def emit(self) -> None:
+        self.output.write(json.dumps(merge_states(self.states), default=str) + "\n")
+        self.output.flush()
+
+    def route(self, line: str) -> None:
+        """Send a record to its shard, every other message to all of them."""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        if message.get("type") == "RECORD":
+            stream = message.get("stream")
+            key = shard_key(stream, message.get("record") or {}, self.key_properties.get(stream, []), self.by)
+            targets = [self._processes[zlib.crc32(key.encode()) % self.workers]]
+        else:
+            if message.get("type") == "SCHEMA":
+                self.key_properties[message.get("stream")] = message.get("key_properties") or []
+            targets = self._processes
+        for process in targets:
+            process.stdin.write(line if line.endswith("\n") else f"{line}\n")
+
+    def run(self, lines) -> int:
+        self.start()
+        try:
+            for line in lines:
+                if line.strip():
+                    self.route(line)
+        finally:
+            for process in self._processes:
+                process.stdin.close()
+            codes = [process.wait() for process in self._processes]
+            for reader in self._readers:
+                reader.join()
+        with self._lock:
+            self.emit()
+        return max(codes, default=0)
@@ -1,9 +1,28 @@
 """DynamicsFinance target sink class, which handles writing streams."""
 
 
-from target_dynamics_finance.client import DynamicsSink
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+
+from target_dynamics_finance.attachments import AttachmentBody, attachment_path
+from target_dynamics_finance.batch import BatchOperation
+from target_dynamics_finance.client import PREFER_MINIMAL, DynamicsSink
+from target_dynamics_finance.delta import ETAG_KEY, changed_fields
+from target_dynamics_finance.dmf import (
+    DEFAULT_IMPORT_TIMEOUT,
+    DEFAULT_PACKAGE_SIZE,
+    DEFAULT_POLL_INTERVAL,
+    DMF_ACTIONS,
+    DmfImporter,
+    PackageWriter,
+    row_key,
+)
+from target_dynamics_finance.session import get_timeout
 import base64
 
+# vendor fields needed to resolve an invoice account
+VENDOR_SELECT = ["dataAreaId", "VendorAccountNumber", "VendorOrganizationName"]
+
 
 class InvoicesSink(DynamicsSink):
     """Dynamics-bc-onprem target sink class."""
@@ -30,25 +49,32 @@ class InvoicesSink(DynamicsSink):
     def invoice_values(self):
         return self.allowed_endpoints.get(self.name)
 
+    @property
+    def primary_keys(self):
+        """Keys of the entity set, from the entity model when it is enabled."""
+        model = self.entity_model
+        keys = model.keys(self.endpoint) if model is not None else None
+        return keys or self.invoice_values.get("primary_keys")
+
     @property
     def primary_key(self):
-        return self.invoice_values.get("primary_keys")[-1]
+        return self.primary_keys[-1]
+
+    _attachment_executor = None
+
+    @property
+    def attachment_executor(self):
+        if self._attachment_executor is None:
+            self._attachment_executor = ThreadPoolExecutor(
+                max_workers=int(self.config.get("attachment_workers") or 2)
+            )
+        return self._attachment_executor
 
-    def preprocess_record(self, record: dict, context: dict) -> None:
-        """Process the record."""
-        for key, value in record.items():
-            record[key] = self.clean_data(value)
-        return record
-    
     def get_attachment_payload(self, payload, reference_id):
-        input_path = self.config.get("input_path",'./')
-        input_path = f"{input_path}/" if not input_path.endswith("/") else input_path
-        attachment_id = payload.pop("Id", "")
-        attachment_name = payload.get('Name')
-        if attachment_id:
-            attachment_name = f"{attachment_id}_{attachment_name}"
-        
-        with open(f"{input_path}{attachment_name}", "rb") as f:
+        path = attachment_path(self.config.get("input_path", "./"), payload)
+        payload.pop("Id", None)
+
+        with self._target.metrics.timed("attachment_encoding"), open(path, "rb") as f:
             attachment = f.read()
             attachment = base64.b64encode(attachment)
         
@@ -56,6 +82,112 @@ class InvoicesSink(DynamicsSink):
         payload["HeaderReference"] = reference_id
         return payload
 
+    def get_attachment_body(self, payload, reference_id):
+        """Build a streamed request body for an attachment."""
+        path = attachment_path(self.config.get("input_path", "./"), payload)
+        payload.pop("Id", None)
+        payload["HeaderReference"] = reference_id
+        return AttachmentBody(payload, path, serializer=self._target.serializer)
+
+    def check_attachments(self, attachments):
+        """Fail the invoice before posting anything if an attachment is too large."""
+        max_size = self.config.get("max_attachment_size")
+        if not max_size:
+            return
+        input_path = self.config.get("input_path", "./")
+        for attachment in attachments:
+            path = attachment_path(input_path, attachment)
+            size = os.path.getsize(path)
+            if size > int(max_size):
+                raise Exception(
+                    f"Attachment '{attachment.get('Name')}' is {size} bytes, larger than max_attachment_size {max_size}"
+                )
+
+    def journal_step(self, hash, step, result=None):
+        """Record an applied operation of an invoice in the journal, if enabled."""
+        if hash and self._target.journal is not None:
+            self._target.journal.record(self.name, hash, step, result)
+
+    def post_attachments(self, attachments, res_id, hash=None, done=()):
+        attachments_endpoint = f"/{self.invoice_values.get('attachments_endpoint')}"
+        for index, attachment in enumerate(attachments):
+            step = f"attachment:{index}"
+            if step in done:
+                continue
+            with self._target.metrics.timed("attachment_upload"):
+                body = self.get_attachment_body(attachment, res_id)
+                self.request_api(
+                    "POST",
+                    endpoint=attachments_endpoint,
+                    request_data=body,
+                    headers={"Content-Type": "application/json", **PREFER_MINIMAL},
+                )
+            self.journal_step(hash, step)
+
+    def post_lines(self, res_id, lines, hash=None, done=()):
+        lines_endpoint = f"/{self.invoice_values.get('lines_endpoint')}"
+        for index, line in enumerate(lines):
+            step = f"line:{index}"
+            if step in done:
+                continue
+            line[self.primary_key] = res_id
+            try:
+                self.request_api("POST", endpoint=lines_endpoint, request_data=line, headers=PREFER_MINIMAL)
+            except Exception:
+                self.logger.info(f"Posting line {line} has failed")
+                raise
+            self.journal_step(hash, step)
+
+    def prefetch_records(self, records: list) -> None:
+        """Resolve the vendors of a window of invoices, by account then by name."""
+        accounts = [(r.get("dataAreaId"), r.get("InvoiceAccount")) for r, _ in records]
+        self.prefetch("/VendorsV3", "VendorAccountNumber", accounts, VENDOR_SELECT)
+
+        names = []
+        for record, _ in records:
+            if record.get("InvoiceAccount"):
+                vendor = self.lookup_by(
+                    "/VendorsV3", "VendorAccountNumber", record["InvoiceAccount"], record.get("dataAreaId"), VENDOR_SELECT
+                )
+                if vendor:
+                    continue
+            names.append((record.get("dataAreaId"), record.get("VendorName")))
+        self.prefetch("/VendorsV3", "VendorOrganizationName", names, VENDOR_SELECT)
+
+    def delete_header(self, header):
+        self.logger.info("Deleting purchase /invoice header")
+        identifier = self.get_unique_identifier(header, self.primary_keys)
+        delete_endpoint = f"{self.endpoint}({identifier})"
+        self.request_api("DELETE", endpoint=delete_endpoint, params=self.company_params(header.get("dataAreaId")))
+
+    def post_lines_batch(self, res_id, lines, attachments, hash=None, done=()):
+        """Post all invoice lines (and optionally attachments) in one atomic changeset.
+
+        The header key is assigned by Dynamics on create, so the header itself
+        can't share the changeset. If the changeset fails no line was committed
+        and only the header needs to be removed.
+        """
+        lines_url = self.url(f"/{self.invoice_values.get('lines_endpoint')}")
+        operations = []
+        for line in lines:
+            line[self.primary_key] = res_id
+            operations.append(BatchOperation("POST", lines_url, line, headers=PREFER_MINIMAL))
+
+        attachments_url = self.url(f"/{self.invoice_values.get('attachments_endpoint')}")
+        for attachment in attachments:
+            # $batch bodies are built in memory, attachments are not streamed here
+            payload = self.get_attachment_payload(attachment, res_id)
+            payload["FileContents"] = payload["FileContents"].decode()
+            operations.append(BatchOperation("POST", attachments_url, payload, headers=PREFER_MINIMAL))
+
+        if operations and "lines" not in done:
+            results = self.post_batch([operations])[0]
+            failed = next((r for r in results if not r.ok), None)
+            if failed:
+                self.logger.info(f"Posting lines changeset for {res_id} has failed")
+                raise Exception(failed.text)
+            self.journal_step(hash, "lines")
+
     def upsert_record(self, record: dict, context: dict):
         state_updates = dict()
         method = "POST"
@@ -64,98 +196,111 @@ class InvoicesSink(DynamicsSink):
         params = {}
 
         if record:
+            # operations of this invoice applied by a previous run
+            journal = self._target.journal
+            hash = self.build_record_hash(record) if journal is not None else None
+            done = journal.steps(self.name, hash) if journal is not None else {}
+            if "done" in done:
+                self.logger.info(f"Invoice {done['done']} was completed by a previous run, skipping")
+                return str(done["done"]), True, state_updates
+
             lines = record.pop(self.invoice_values.get("lines_endpoint"), None)
             attachments = record.pop("attachments") or []
-            # lookup supplier
-            vendor_account = None
-            if record.get("InvoiceAccount"):
-                # If InvoiceAccount is provided validate if it's valid
-                vendor_account = self.lookup(
-                    "/VendorsV3",
-                    {
-                        "$filter": f"VendorAccountNumber eq '{record['InvoiceAccount']}' and dataAreaId eq '{record.get('dataAreaId')}'"
-                    },
-                )
+            if "header" in done:
+                res = done["header"]
+                self.logger.info(f"Resuming invoice {res.get(self.primary_key)} from the journal")
+            else:
+                # reject invalid invoices before any lookup or request
+                lines_endpoint = f"/{self.invoice_values.get('lines_endpoint')}"
+                record = self.validate_record(self.endpoint, record, ignore=["id", "VendorName"])
+                if lines:
+                    lines = [self.validate_record(lines_endpoint, line) for line in lines]
 
-            if not vendor_account and record.get('VendorName'):
-                vendor_account = self.lookup(
-                    "/VendorsV3",
-                    {
-                        "$filter": f"VendorOrganizationName eq '{record['VendorName']}' and dataAreaId eq '{record.get('dataAreaId')}'"
-                    },
-                )
-            if not vendor_account:
-                raise Exception(
-                    f"VendorInvoice could not be posted since Vendor '{record.get('VendorName')}' ('{record.get('InvoiceAccount')}') was not found in Dynamics"
-                )
+                # lookup supplier
+                vendor_account = None
+                if record.get("InvoiceAccount"):
+                    # If InvoiceAccount is provided validate if it's valid
+                    vendor_account = self.lookup_by(
+                        "/VendorsV3", "VendorAccountNumber", record["InvoiceAccount"], record.get("dataAreaId"), VENDOR_SELECT
+                    )
+
+                if not vendor_account and record.get('VendorName'):
+                    vendor_account = self.lookup_by(
+                        "/VendorsV3", "VendorOrganizationName", record["VendorName"], record.get("dataAreaId"), VENDOR_SELECT
+                    )
+                self.check_attachments(attachments)
+
+                if not vendor_account:
+                    raise Exception(
+                        f"VendorInvoice could not be posted since Vendor '{record.get('VendorName')}' ('{record.get('InvoiceAccount')}') was not found in Dynamics"
+                    )
             
-            try:
-                record["InvoiceAccount"] = vendor_account["VendorAccountNumber"]
-            except KeyError:
-                self.logger.info(f"Vendor has no VendorAccountNumber: {vendor_account}")
-                raise Exception(f"VendorInvoice could not be posted since Vendor '{record.get('VendorName')}' ('{record.get('InvoiceAccount')}') does not have a valid VendorAccountNumber")
-
-            # send invoice
-            id = record.pop("id", None)
-            identifier = None
-            if id:
-                record[self.primary_key] = id
-                method = "PATCH"
-                identifier = self.get_unique_identifier(record, self.allowed_endpoints[self.name]["primary_keys"])
-                endpoint = f"{self.endpoint}({identifier})"
-                params={"cross-company": True}
-
-            res = self.request_api(
-                method, endpoint=endpoint, request_data=record, headers=headers, params=params
-            )
+                try:
+                    record["InvoiceAccount"] = vendor_account["VendorAccountNumber"]
+                except KeyError:
+                    self.logger.info(f"Vendor has no VendorAccountNumber: {vendor_account}")
+                    raise Exception(f"VendorInvoice could not be posted since Vendor '{record.get('VendorName')}' ('{record.get('InvoiceAccount')}') does not have a valid VendorAccountNumber")
+
+                # send invoice
+                id = record.pop("id", None)
+                identifier = None
+                if id:
+                    record[self.primary_key] = id
+                    method = "PATCH"
+                    identifier = self.get_unique_identifier(record, self.primary_keys)
+                    endpoint = f"{self.endpoint}({identifier})"
+                    params = self.company_params(record.get("dataAreaId"))
+
+                res = self.request_api(
+                    method, endpoint=endpoint, request_data=record, headers=headers, params=params
+                )
 
-            # skip patching record if record was not found in Dynamics
-            if self.skip_record_patching:
-                self.skip_record_patching = False
-                res.update({"existing": True})
-                return id, False, res
+                # skip patching record if record was not found in Dynamics
+                if self.is_skipped(res):
+                    res.update({"existing": True})
+                    return id, False, res
             
-            # patch response is empty 204, return the current id 
-            if method == "PATCH" and res.status_code == 204:
-                # IF we PATCHED the invoice header we are ignoring lines and attachments
-                return id, True, state_updates
+                # patch response is empty 204, return the current id 
+                if method == "PATCH" and res.status_code == 204:
+                    # IF we PATCHED the invoice header we are ignoring lines and attachments
+                    return id, True, state_updates
 
-            res = res.json()
+                res = self.parse_response(res)
+                self.journal_step(hash, "header", res)
             res_id = res.get(self.primary_key)
 
             if res_id:
-                method = "POST"
+                batch_attachments = bool(self.config.get("batch_mode") and self.config.get("batch_attachments"))
+                upload = None
+                if attachments and not batch_attachments and self.config.get("parallel_attachments"):
+                    # attachments only need the header key, upload them while lines are posted
+                    upload = self.attachment_executor.submit(
+                        self.in_lane(self.post_attachments), attachments, res_id, hash, done
+                    )
 
                 try:
-                    for line in lines:
-                        lines_endpoint = f"/{self.invoice_values.get('lines_endpoint')}"
-                        line[self.primary_key] = res_id
-                        res_line = self.request_api(
-                            method,
-                            endpoint=lines_endpoint,
-                            request_data=line,
-                            headers=headers,
-                        )
+                    if self.config.get("batch_mode"):
+                        self.post_lines_batch(res_id, lines or [], attachments if batch_attachments else [], hash, done)
+                    else:
+                        self.post_lines(res_id, lines, hash, done)
                 except Exception as e:
-                    self.logger.info(f"Posting line {line} has failed")
-                    self.logger.info("Deleting purchase /invoice header")
-                    identifier = self.get_unique_identifier(res, self.allowed_endpoints[self.name]["primary_keys"])
-                    delete_endpoint = f"{self.endpoint}({identifier})"
-                    purchase_order_lines = self.request_api(
-                        "DELETE", endpoint=delete_endpoint, params={"cross-company": True}
-                    )
+                    if upload:
+                        wait([upload])
+                    self.delete_header(res)
+                    if journal is not None:
+                        journal.clear(self.name, hash)
                     error = {
                         "error": e,
                         "notes": "due to error during posting lines the purchase invoice header was deleted",
                     }
                     raise Exception(error)
-                
-                for attachment in attachments:
-                    payload = self.get_attachment_payload(attachment, res_id)
-                    attachments_endpoint = f"/{self.invoice_values.get('attachments_endpoint')}"
-                    res = self.request_api(
-                        method, endpoint=attachments_endpoint, request_data=payload, headers=headers
-                    )
+
+                if upload:
+                    upload.result()
+                elif not batch_attachments:
+                    self.post_attachments(attachments, res_id, hash, done)
+                if journal is not None:
+                    journal.complete(self.name, hash, res_id)
 
             return str(res_id), True, state_updates
 
@@ -179,66 +324,395 @@ class FallbackSink(DynamicsSink):
         "VendorsV3": ["VendorGroupId", "TaxExemptNumber"]
     }
 
-    def preprocess_record(self, record: dict, context: dict) -> None:
-        """Process the record."""
-        for key, value in record.items():
-            record[key] = self.clean_data(value)
-        return record
+    @property
+    def primary_keys(self):
+        """Keys of the stream, or of the entity set when the stream declares none."""
+        if self.key_properties:
+            return list(self.key_properties)
+        model = self.entity_model
+        return (model.keys(self.endpoint) if model is not None else None) or []
+
+    # rows written to the current DMF package, in bulk_mode
+    _package = None
+    _package_rows = None
+    _package_deferred = None
+    _package_hashes = None
 
-    def upsert_record(self, record: dict, context: dict):
+    @property
+    def bulk_mode(self) -> bool:
+        return bool(self.config.get("bulk_mode"))
+
+    @property
+    def current_size(self) -> int:
+        if self.bulk_mode:
+            return len(self._package_rows or [])
+        return super().current_size
+
+    @property
+    def max_size(self) -> int:
+        if self.bulk_mode:
+            return int(self.config.get("dmf_package_size") or DEFAULT_PACKAGE_SIZE)
+        return super().max_size
+
+    def process_record(self, record: dict, context: dict) -> None:
+        if not self.bulk_mode:
+            return super().process_record(record, context)
+        if not self.latest_state:
+            self.init_state()
+        with self._target.metrics.timed("process_record"):
+            self.add_to_package(record, context)
+
+    def process_batch(self, context: dict) -> None:
+        if self._package is not None:
+            self.import_package()
+        super().process_batch(context)
+
+    def add_to_package(self, record: dict, context: dict) -> None:
+        """Write a record as a row of the DMF package of the stream."""
+        hash = self.build_record_hash(record)
+        existing_state = self.get_existing_state(hash)
+        if existing_state:
+            return self.update_state(existing_state, is_duplicate=True)
+
+        if self._package is None:
+            columns = [
+                name for name in self.schema.get("properties", {}) if name not in ("id", "externalId")
+            ]
+            entity = (self.config.get("dmf_entities") or {}).get(self.name, self.name)
+            self._package = PackageWriter(entity, columns)
+            self._package_rows = []
+            self._package_deferred = []
+            self._package_hashes = set()
+        if hash in self._package_hashes:
+            # written once the first copy has a state to match
+            self._package_deferred.append((record, context))
+            return
+        self._package_hashes.add(hash)
+
+        external_id = record.pop("externalId", None)
+        # DMF upserts by the entity keys, there is no id to patch
+        record.pop("id", None)
+        try:
+            record = self.validate_record(self.endpoint, record)
+        except Exception as e:
+            return self.finish_record(hash, None, False, {"error": str(e)}, external_id)
+        self._package.write(record)
+        primary_keys = self.primary_keys
+        record_id = record.get(primary_keys[-1]) if primary_keys else None
+        self._package_rows.append((hash, external_id, row_key(record, primary_keys), record_id))
+
+    def dmf_action(self, action: str, body: dict):
+        """Call a data management action, returning its value."""
+        response = self.request_api("POST", endpoint=f"{DMF_ACTIONS}.{action}", request_data=body, headers={})
+        return self.parse_response(response).get("value")
+
+    def import_package(self) -> None:
+        """Import the package of the stream and update the state of its rows.
+
+        Rows are matched with the error keys file of the execution by the
+        entity keys; when the whole execution fails every row fails.
+        """
+        package, rows, deferred = self._package, self._package_rows, self._package_deferred
+        self._package, self._package_rows, self._package_deferred = None, None, None
+        definition_group = self.config.get("dmf_definition_group") or f"target-dynamics-finance-{self.name}"
+        importer = DmfImporter(
+            self.dmf_action,
+            self._target.session,
+            timeout=get_timeout(self.config),
+            poll_interval=float(self.config.get("dmf_poll_interval") or DEFAULT_POLL_INTERVAL),
+            import_timeout=float(self.config.get("dmf_timeout") or DEFAULT_IMPORT_TIMEOUT),
+            logger=self.logger,
+        )
+        path = package.build(definition_group, self.config.get("dmf_package_template"))
+        try:
+            self.logger.info(f"Importing {len(rows)} {self.name} records through DMF package {path}")
+            with self._target.metrics.timed("dmf_import"):
+                execution_id, status, failed = importer.run(
+                    path, definition_group, package.entity, self.config.get("dmf_legal_entity", "")
+                )
+        except Exception as e:
+            self.logger.exception(f"DMF import error {str(e)}")
+            execution_id, status, failed = None, None, []
+            error = str(e)
+        else:
+            error = f"DMF execution {execution_id} {status}"
+        finally:
+            os.remove(path)
+
+        key_fields = [field.lower() for field in self.primary_keys]
+        failed_keys = {row_key({k.lower(): v for k, v in row.items()}, key_fields) for row in failed}
+        for hash, external_id, key, record_id in rows:
+            success = status == "Succeeded" or (status == "PartiallySucceeded" and key not in failed_keys)
+            state_updates = {"dmf_execution_id": execution_id} if execution_id else {}
+            if not success:
+                state_updates["error"] = error
+            self.finish_record(hash, record_id, success, state_updates, external_id)
+
+        for record, context in deferred:
+            self.write_record(record, context)
+
+    @property
+    def plan_upserts(self) -> bool:
+        """Whether windows of records are planned together before being sent."""
+        return bool(self.config.get("batch_mode") or self.config.get("plan_upserts"))
+
+    @property
+    def buffer_records(self) -> bool:
+        return self.plan_upserts or super().buffer_records
+
+    @property
+    def prefetch_enabled(self) -> bool:
+        return self.plan_upserts or super().prefetch_enabled
+
+    @property
+    def existence_select(self):
+        """Fields needed to address an existing record, fetched by lookups.
+
+        Delta updates compare against the whole entity, so nothing is dropped.
+        """
+        if self.config.get("delta_patch"):
+            return None
+        lookup_key = self.lookup_keys.get(self.name)
+        fields = list(self.primary_keys)
+        if lookup_key and lookup_key not in fields:
+            fields.append(lookup_key)
+        return fields
+
+    def prefetch_records(self, records: list) -> None:
+        """Resolve the existence of a window of records with a few grouped queries."""
+        lookup_key = self.lookup_keys.get(self.name)
+        if lookup_key and self.primary_keys:
+            keys = [(r.get("dataAreaId"), r.get(lookup_key)) for r, _ in records if not r.get("id")]
+            self.prefetch(self.endpoint, lookup_key, keys, self.existence_select)
+
+    def forget_lookup(self, plan: dict) -> None:
+        """Drop the cached lookups a record may have changed once it has been written.
+
+        Besides its own lookup, a new record may be found by any other field
+        (e.g. invoices look vendors up by name), so misses of the company are dropped.
+        """
+        lookup_key = self.lookup_keys.get(self.name)
+        data_area_id, value = plan["lookup"]
+        cache = self._target.lookup_cache
+        if lookup_key and value:
+            cache.invalidate(self.endpoint, data_area_id, lookup_key, value)
+        cache.invalidate_missing(self.endpoint, data_area_id)
+
+    def plan_upsert(self, record: dict) -> dict:
+        """Decide between POST and PATCH for a record and build the request."""
         state_updates = dict()
         endpoint = self.endpoint
+        # set initial variables
+        method = "POST"
+        params = {}
+        headers = {}
+        res_id = None
+        record = self.validate_record(self.endpoint, record, ignore=["id"])
+        primary_keys = self.primary_keys
+        primary_key = primary_keys[-1] if primary_keys else None
+
+        # if lookup key available, do a lookup to patch
+        lookup_key = self.lookup_keys.get(self.name)
+
+        # check if there is an id for patching
+        record_id = record.pop("id", None)
+        # delta updates may drop the lookup key from the record
+        lookup = (record.get("dataAreaId"), record.get(lookup_key) if lookup_key else None)
+        existing_record = {}
+        # the entity fetched from Dynamics, unlike a record addressed by its id
+        fetched = False
+        # if no id lookup using lookup key
+        if lookup_key and record.get(lookup_key) and primary_keys:
+            existing_record = self.lookup_by(
+                self.endpoint, lookup_key, record[lookup_key], record["dataAreaId"], self.existence_select
+            )
+            fetched = True
+        elif record_id:
+            existing_record = record.copy()
+            existing_record[primary_key] = record_id
+
+        # if there is an existing record do a PATCH
+        if existing_record:
+            method = "PATCH"
+            identifier = self.get_unique_identifier(existing_record, primary_keys)
+            endpoint = f"{self.endpoint}({identifier})"
+            state_updates["is_updated"] = True
+            params.update(self.company_params(existing_record.get("dataAreaId", record.get("dataAreaId"))))
+            res_id = existing_record[primary_key]
+
+            # not send fields in not_send_fields_patch
+            not_send_fields = self.not_send_fields_patch.get(self.name)
+            if not_send_fields:
+                for field in not_send_fields:
+                    record.pop(field, None)
+
+            if fetched and self.config.get("delta_patch"):
+                # only send the fields that changed, skip the request if none did
+                record = changed_fields(record, existing_record)
+                if not record:
+                    method = None
+                    state_updates = {"existing": True}
+            if self.config.get("use_etags") and existing_record.get(ETAG_KEY):
+                # fail instead of overwriting a record changed since it was fetched
+                headers["If-Match"] = existing_record[ETAG_KEY]
+
+        else:
+            # primary key is set by dynamics, if this is a new record don't send the primary key value
+            record.pop(primary_key, None)
+
+        return {
+            "method": method,
+            "endpoint": endpoint,
+            "params": params,
+            "headers": headers,
+            "record": record,
+            "lookup": lookup,
+            "primary_key": primary_key,
+            "res_id": res_id,
+            "state_updates": state_updates,
+        }
+
+    def upsert_record(self, record: dict, context: dict):
         if record:
-            # set initial variables
-            method = "POST"
-            headers = {}
-            params = {}
-            primary_key = self.key_properties[-1] if self.key_properties else None
-
-            # if lookup key available, do a lookup to patch
-            lookup_key = self.lookup_keys.get(self.name)
-            primary_keys = self.key_properties or []
-
-            # check if there is an id for patching
-            record_id = record.pop("id", None)
-            existing_record = {}
-            # if no id lookup using lookup key
-            if lookup_key and record.get(lookup_key) and primary_keys:
-                existing_record = None
-                lookup_params = {"$filter": f"{lookup_key} eq '{record[lookup_key]}' and dataAreaId eq '{record['dataAreaId']}'"}
-                existing_record = self.lookup(self.endpoint, lookup_params)
-            elif record_id:
-                existing_record = record.copy()
-                existing_record[primary_key] = record_id
-
-            # if there is an existing record do a PATCH
-            if existing_record:
-                method = "PATCH"
-                identifier = self.get_unique_identifier(existing_record, primary_keys)
-                endpoint = f"{self.endpoint}({identifier})"
-                state_updates["is_updated"] = True
-                params["cross-company"] = True
-                res_id = existing_record[primary_key]
-
-                # not send fields in not_send_fields_patch
-                not_send_fields = self.not_send_fields_patch.get(self.name)
-                if not_send_fields:
-                    for field in not_send_fields:
-                        record.pop(field, None)
-            
+            return self.send_plan(self.plan_upsert(record))
+
+    def send_plan(self, plan: dict):
+        """Send a planned POST/PATCH, returning (id, success, state_updates)."""
+        res_id = plan["res_id"]
+        if plan["method"] is None:
+            self.logger.info(f"{self.name} record {res_id} is unchanged, skipping update")
+            return str(res_id), True, plan["state_updates"]
+        res = self.request_api(
+            plan["method"], endpoint=plan["endpoint"], request_data=plan["record"], headers=plan["headers"], params=plan["params"]
+        )
+        # skip patching record if record was not found in Dynamics
+        if self.is_skipped(res):
+            return res_id, True, res
+        self.forget_lookup(plan)
+        # get response id if response is not empty
+        if res.status_code != 204:
+            res = self.parse_response(res)
+            res_id = res.get(plan["primary_key"])
+        return str(res_id), True, plan["state_updates"]
+
+    def safe_send_plan(self, plan: dict):
+        try:
+            with self._target.metrics.timed("upsert_record"):
+                return self.send_plan(plan)
+        except Exception as e:
+            self.logger.exception(f"Upsert record error {str(e)}")
+            # the cached entity may be stale, e.g. after an If-Match mismatch
+            self.forget_lookup(plan)
+            return plan["res_id"], False, {"error": str(e)}
+
+    def write_records(self, records: list) -> None:
+        if not self.plan_upserts:
+            return super().write_records(records)
+        self.write_planned(records)
+
+    def write_planned(self, records: list) -> None:
+        """Plan a window of records, then send its creates and updates together.
+
+        Existence of the whole window was resolved by prefetch_records, so
+        planning doesn't hit the API. With batch_mode the requests go through
+        one OData $batch request where every record gets its own changeset, so
+        a failing record doesn't roll back the others.
+        """
+        pending, deferred = self.split_duplicates(records)
+        pending, repeated = self.split_lookups(pending)
+        deferred = repeated + deferred
+
+        def plan_item(item):
+            try:
+                return self.plan_upsert(item[2]) if item[2] else None
+            except Exception as e:
+                self.logger.exception(f"Upsert record error {str(e)}")
+                return e
+
+        planned = []
+        # lookups missed by the prefetch are independent, run them on the worker pool
+        for (hash, external_id, _, _), result in zip(pending, self.run_concurrently(plan_item, pending)):
+            if isinstance(result, Exception):
+                self.finish_record(hash, None, False, {"error": str(result)}, external_id)
+                continue
+            if result is None:
+                self.finish_record(hash, None, False, {}, external_id)
+                continue
+            result["hash"] = hash
+            result["external_id"] = external_id
+            planned.append(result)
+
+        creates = [plan for plan in planned if plan["method"] == "POST"]
+        updates = [plan for plan in planned if plan["method"] == "PATCH"]
+        for plan in planned:
+            if plan["method"] is None:
+                plan["result"] = self.send_plan(plan)
+        for group in (creates, updates):
+            if not group:
+                continue
+            if self.config.get("batch_mode"):
+                for plan, result in zip(group, self.send_batch(group)):
+                    plan["result"] = self.read_batch_result(plan, result)
             else:
-                # primary key is set by dynamics, if this is a new record don't send the primary key value
-                record.pop(primary_key, None)
-                    
-            res = self.request_api(
-                method, endpoint=endpoint, request_data=record, headers=headers, params=params
-            )
-            # skip patching record if record was not found in Dynamics
-            if self.skip_record_patching:
-                self.skip_record_patching = False
-                return res_id, True, res
-            # get response id if response is not empty
-            if res.status_code != 204:
-                res = res.json()
-                res_id = res.get(primary_key)
-            return str(res_id), True, state_updates
+                for plan, result in zip(group, self.run_concurrently(self.safe_send_plan, group)):
+                    plan["result"] = result
+
+        # state is updated in input order
+        for plan in planned:
+            self.finish_record(plan["hash"], *plan["result"], plan["external_id"])
+
+        for record, context in deferred:
+            self.write_record(record, context)
+
+    def split_lookups(self, pending: list):
+        """Keep the first record of every lookup key of a window, defer the others.
+
+        Records sharing a lookup key (e.g. a new vendor account sent twice) would
+        all be planned from the same prefetched lookup and all be created. Like
+        the repeated records of split_duplicates, the later ones are written
+        after the window, when the first one exists in Dynamics.
+        """
+        lookup_key = self.lookup_keys.get(self.name)
+        if not lookup_key:
+            return pending, []
+        kept, deferred, seen = [], [], set()
+        for item in pending:
+            _, external_id, record, context = item
+            value = record.get(lookup_key)
+            key = (str(record.get("dataAreaId") or "").lower(), str(value).lower())
+            if value in (None, "") or key not in seen:
+                seen.add(key)
+                kept.append(item)
+                continue
+            # write_record hashes the record with its externalId, as it came in
+            if external_id:
+                record["externalId"] = external_id
+            deferred.append((record, context))
+        return kept, deferred
+
+    def send_batch(self, plans: list) -> list:
+        changesets = [
+            [BatchOperation(plan["method"], self.url(plan["endpoint"]), plan["record"], plan["params"], plan["headers"])]
+            for plan in plans
+        ]
+        try:
+            return [group[0] for group in self.post_batch(changesets)]
+        except Exception as e:
+            self.logger.exception(f"Batch request error {str(e)}")
+            return [e] * len(plans)
+
+    def read_batch_result(self, plan: dict, result):
+        """Turn a $batch operation result into (id, success, state_updates)."""
+        res_id = plan["res_id"]
+        if isinstance(result, Exception):
+            return res_id, False, {"error": str(result)}
+        if result.status_code == 400 and "No resources were found when selecting for update." in result.text:
+            self.logger.info(f"Skipping record patching because {self.name} record was not found")
+            return res_id, True, {"note": f"Skipping record patching because {self.name} record was not found"}
+        if not result.ok:
+            self.forget_lookup(plan)
+            return res_id, False, {"error": result.text}
+        self.forget_lookup(plan)
+        if result.status_code != 204:
+            res_id = result.json().get(plan["primary_key"])
+        return str(res_id), True, plan["state_updates"]
@@ -0,0 +1,85 @@
+"""Command line entry point, with an import-time report of the target's startup."""
+
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+from target_dynamics_finance.shard import SHARD_ENV, config_values
+
+TARGET_MODULE = "target_dynamics_finance.target"
+
+
+def parse_importtime(text: str) -> List[Tuple[str, int, int]]:
+    """Parse `python -X importtime` output into (module, self_us, cumulative_us)."""
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def import_times(module: str = TARGET_MODULE) -> List[Tuple[str, int, int]]:
+    """Import a module in a fresh interpreter and return its import times."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def startup_report(modules: List[Tuple[str, int, int]], top: int = 20) -> str:
+    """Total import time and the top level packages costing the most."""
+    packages = {}
+    total = 0
+    for name, self_us, _ in modules:
+        total += self_us
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    lines = [f"Import time of {TARGET_MODULE}: {total / 1000:.1f} ms ({len(modules)} modules)"]
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"{self_us / 1000:>10.1f} ms  {package}")
+    return "\n".join(lines)
+
+
+def run_shards(argv: List[str], config: dict) -> int:
+    """Route the input to `shards` worker processes and emit their merged state."""
+    from target_dynamics_finance.shard import ShardedRun
+
+    # workers read their input from the parent, not from the --input file
+    args, input_path = list(argv), None
+    if "--input" in args:
+        index = args.index("--input")
+        input_path = args[index + 1]
+        del args[index:index + 2]
+    run = ShardedRun(args, int(config["shards"]), config.get("shard_key") or "record")
+    if input_path:
+        with open(input_path) as f:
+            return run.run(f)
+    return run.run(sys.stdin)
+
+
+def main() -> None:
+    """Run the target CLI, printing an import-time report first with --profile-startup."""
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        print(startup_report(import_times()), file=sys.stderr)
+        if len(sys.argv) == 1:
+            return
+
+    if os.environ.get(SHARD_ENV) is None and "--about" not in sys.argv:
+        config = config_values(sys.argv[1:])
+        if int(config.get("shards") or 1) > 1:
+            sys.exit(run_shards(sys.argv[1:], config))
+
+    from target_dynamics_finance.target import TargetDynamicsFinance
+
+    TargetDynamicsFinance.cli()
+
+
+if __name__ == "__main__":
+    main()
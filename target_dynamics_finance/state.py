@@ -0,0 +1,104 @@
+"""Compact storage and incremental serialization of per-record results."""
+
+import os
+from array import array
+from typing import Any, Iterable, Iterator, Optional
+
+from target_dynamics_finance.serialize import DEFAULT_SERIALIZER, Serializer
+
+
+class RecordResults:
+    """Append-only bookmarks of a stream, kept as encoded JSON instead of dicts.
+
+    Every result is serialized once, when it is appended, so emitting the
+    state only copies bytes. With a results path the results are appended to
+    that JSONL file instead, and the state only holds a cursor to it.
+    """
+
+    __slots__ = ("path", "serializer", "_data", "_offsets", "_count", "_file")
+
+    def __init__(
+        self,
+        states: Iterable[dict] = (),
+        path: Optional[str] = None,
+        serializer: Serializer = DEFAULT_SERIALIZER,
+    ) -> None:
+        self.path = path
+        self.serializer = serializer
+        self._data = bytearray()
+        self._offsets = array("Q")
+        self._count = 0
+        self._file = None
+        if path:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self._count = sum(1 for line in f if line.strip())
+            self._file = open(path, "ab")
+        for state in states:
+            self.append(state)
+
+    @classmethod
+    def from_bookmark(
+        cls, bookmark: Any, path: Optional[str] = None, serializer: Serializer = DEFAULT_SERIALIZER
+    ) -> "RecordResults":
+        """Build the results of a stream from the bookmarks of a previous state."""
+        if isinstance(bookmark, RecordResults):
+            return bookmark
+        if isinstance(bookmark, dict) and bookmark.get("results_path"):
+            # the previous results are already in the file
+            return cls(path=path or bookmark["results_path"], serializer=serializer)
+        return cls(bookmark or [], path, serializer)
+
+    def append(self, state: dict) -> None:
+        encoded = self.serializer.dumps(state)
+        self._count += 1
+        if self._file is not None:
+            self._file.write(encoded + b"\n")
+            return
+        if self._offsets:
+            self._data += b","
+        self._offsets.append(len(self._data))
+        self._data += encoded
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[dict]:
+        if self._file is not None:
+            self._file.flush()
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        yield self.serializer.loads(line)
+            return
+        ends = list(self._offsets[1:]) + [len(self._data) + 1]
+        for start, end in zip(self._offsets, ends):
+            yield self.serializer.loads(bytes(self._data[start : end - 1]))
+
+    def encode(self) -> bytes:
+        """JSON of the bookmarks, a cursor to the results file when there is one."""
+        if self._file is not None:
+            self._file.flush()
+            return self.serializer.dumps({"results_path": self.path, "count": self._count})
+        return b"[" + self._data + b"]"
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+    # the state is copied by the SDK before it's emitted, results are only appended
+    def __copy__(self) -> "RecordResults":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "RecordResults":
+        return self
+
+
+def encode_state(value: Any, serializer: Serializer = DEFAULT_SERIALIZER) -> bytes:
+    """Serialize a state, reusing the encoding of its RecordResults."""
+    if isinstance(value, RecordResults):
+        return value.encode()
+    if isinstance(value, dict):
+        items = (serializer.dumps(str(key)) + b":" + encode_state(item, serializer) for key, item in value.items())
+        return b"{" + b",".join(items) + b"}"
+    return serializer.dumps(value)
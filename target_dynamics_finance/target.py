@@ -1,11 +1,29 @@
 """DynamicsFinance target class."""
 
+import sys
+import threading
+import time
+
 from singer_sdk import typing as th
 from target_hotglue.target import TargetHotglue
 from typing import List, Optional, Union
 from pathlib import PurePath
 
-from target_dynamics_finance.sinks import FallbackSink, InvoicesSink
+from target_dynamics_finance.auth import DynamicsAuthenticator
+from target_dynamics_finance.metrics import Metrics, Profiler
+from target_dynamics_finance.pipeline import DEFAULT_MAX_BUFFER_BYTES, BufferedInput
+
+# Modules only needed once records arrive, or for some configs, are imported
+# where they are used so short runs (and --about/--help) start faster.
+
+
+class LazySinkTypes:
+    """Resolve SINK_TYPES on first access, importing the sinks then."""
+
+    def __get__(self, instance, owner):
+        from target_dynamics_finance.sinks import FallbackSink, InvoicesSink
+
+        return [FallbackSink, InvoicesSink]
 
 
 class TargetDynamicsFinance(TargetHotglue):
@@ -19,10 +37,33 @@ class TargetDynamicsFinance(TargetHotglue):
         state: str = None,
     ) -> None:
         self.config_file = config[0]
+        self.auth_state = {}
+        self._company_rate_limiters = {}
+        self._entity_models = {}
+        self._entity_models_lock = threading.Lock()
+        self._records_since_state = 0
+        self._state_emitted_at = time.monotonic()
+        self._rate_limiters_lock = threading.Lock()
         super().__init__(config, parse_env_config, validate_config)
+        url = self.config.get("auth_url") or f"https://login.microsoftonline.com/{self.config.get('tenant', 'common')}/oauth2/token"
+        self.metrics = Metrics(enabled=bool(self.config.get("metrics")))
+        self.profiler = None
+        if self.config.get("profile"):
+            self.profiler = Profiler(self.config["profile"], self.config.get("profile_path"))
+            self.profiler.start()
+        # one authenticator per run, shared by every sink
+        self.authenticator = DynamicsAuthenticator(self, self.auth_state, url)
 
     name = "target-dynamics-finance"
-    SINK_TYPES = [FallbackSink, InvoicesSink]
+    SINK_TYPES = LazySinkTypes()
+    _session = None
+    _lookup_cache = None
+    _dedup_index = None
+    _journal = None
+    _serializer = None
+    _compression = None
+    _rate_limiter = None
+    _request_logger = None
 
     config_jsonschema = th.PropertiesList(
         th.Property("subdomain", th.StringType, required=True),
@@ -30,9 +71,253 @@ class TargetDynamicsFinance(TargetHotglue):
         th.Property("client_secret", th.StringType, required=True),
         th.Property("tenant", th.StringType, required=False),
         th.Property("base_url", th.StringType, required=False),
+        th.Property("auth_url", th.StringType, required=False),
+        th.Property("pool_connections", th.IntegerType, required=False),
+        th.Property("pool_maxsize", th.IntegerType, required=False),
+        th.Property("pool_block", th.BooleanType, required=False),
+        th.Property("keep_alive", th.BooleanType, required=False),
+        th.Property("connect_timeout", th.NumberType, required=False),
+        th.Property("read_timeout", th.NumberType, required=False),
+        th.Property("json_serializer", th.StringType, required=False),
+        th.Property("request_compression", th.BooleanType, required=False),
+        th.Property("compression_min_bytes", th.IntegerType, required=False),
+        th.Property("compression_level", th.IntegerType, required=False),
+        th.Property("batch_mode", th.BooleanType, required=False),
+        th.Property("batch_size", th.IntegerType, required=False),
+        th.Property("batch_attachments", th.BooleanType, required=False),
+        th.Property("max_workers", th.IntegerType, required=False),
+        th.Property("partition_by_company", th.BooleanType, required=False),
+        th.Property("default_company", th.StringType, required=False),
+        th.Property("max_buffer_bytes", th.IntegerType, required=False),
+        th.Property("input_queue_size", th.IntegerType, required=False),
+        th.Property("shards", th.IntegerType, required=False),
+        th.Property("shard_key", th.StringType, required=False),
+        th.Property("max_requests_per_second", th.NumberType, required=False),
+        th.Property("min_requests_per_second", th.NumberType, required=False),
+        th.Property("lookup_cache_ttl", th.NumberType, required=False),
+        th.Property("lookup_cache_size", th.IntegerType, required=False),
+        th.Property("prefetch_lookups", th.BooleanType, required=False),
+        th.Property("plan_upserts", th.BooleanType, required=False),
+        th.Property("delta_patch", th.BooleanType, required=False),
+        th.Property("use_etags", th.BooleanType, required=False),
+        th.Property("dedup_index_path", th.StringType, required=False),
+        th.Property("compact_state", th.BooleanType, required=False),
+        th.Property("results_dir", th.StringType, required=False),
+        th.Property("state_every_records", th.IntegerType, required=False),
+        th.Property("state_interval", th.NumberType, required=False),
+        th.Property("journal_path", th.StringType, required=False),
+        th.Property("http_capture_path", th.StringType, required=False),
+        th.Property("http_replay_path", th.StringType, required=False),
+        th.Property("replay_latency_scale", th.NumberType, required=False),
+        th.Property("log_sample_rate", th.NumberType, required=False),
+        th.Property("log_body_max_chars", th.IntegerType, required=False),
+        th.Property("log_full_payloads", th.BooleanType, required=False),
+        th.Property("metrics", th.BooleanType, required=False),
+        th.Property("metrics_path", th.StringType, required=False),
+        th.Property("metrics_format", th.StringType, required=False),
+        th.Property("profile", th.StringType, required=False),
+        th.Property("profile_path", th.StringType, required=False),
+        th.Property("bulk_mode", th.BooleanType, required=False),
+        th.Property("dmf_entities", th.ObjectType(), required=False),
+        th.Property("dmf_definition_group", th.StringType, required=False),
+        th.Property("dmf_package_template", th.StringType, required=False),
+        th.Property("dmf_package_size", th.IntegerType, required=False),
+        th.Property("dmf_legal_entity", th.StringType, required=False),
+        th.Property("dmf_poll_interval", th.NumberType, required=False),
+        th.Property("dmf_timeout", th.NumberType, required=False),
+        th.Property("validate_metadata", th.BooleanType, required=False),
+        th.Property("metadata_cache_dir", th.StringType, required=False),
+        th.Property("metadata_ttl", th.NumberType, required=False),
+        th.Property("input_path", th.StringType, required=False),
+        th.Property("max_attachment_size", th.IntegerType, required=False),
+        th.Property("parallel_attachments", th.BooleanType, required=False),
+        th.Property("attachment_workers", th.IntegerType, required=False),
     ).to_dict()
 
+    @property
+    def session(self):
+        """Pooled HTTP session shared by all sinks and the authenticator."""
+        if self._session is None:
+            from target_dynamics_finance.session import build_session
+
+            self._session = build_session(self.config)
+        return self._session
+
+    @property
+    def serializer(self):
+        """JSON encoder of request bodies and decoder of responses."""
+        if self._serializer is None:
+            from target_dynamics_finance.serialize import Serializer
+
+            self._serializer = Serializer(self.config.get("json_serializer"))
+        return self._serializer
+
+    @property
+    def lookup_cache(self):
+        """Lookup cache shared by all sinks."""
+        if self._lookup_cache is None:
+            from target_dynamics_finance.cache import DEFAULT_MAX_SIZE, DEFAULT_TTL, LookupCache
+
+            self._lookup_cache = LookupCache(
+                ttl=float(self.config.get("lookup_cache_ttl") or DEFAULT_TTL),
+                max_size=int(self.config.get("lookup_cache_size") or DEFAULT_MAX_SIZE),
+            )
+        return self._lookup_cache
+
+    @property
+    def rate_limiter(self):
+        """Adaptive rate limiter shared by all sinks and workers."""
+        if self._rate_limiter is None:
+            self._rate_limiter = self.build_rate_limiter()
+        return self._rate_limiter
+
+    def build_rate_limiter(self):
+        from target_dynamics_finance.throttle import DEFAULT_MAX_RATE, DEFAULT_MIN_RATE, RateLimiter
+
+        return RateLimiter(
+            max_rate=float(self.config.get("max_requests_per_second") or DEFAULT_MAX_RATE),
+            min_rate=float(self.config.get("min_requests_per_second") or DEFAULT_MIN_RATE),
+        )
+
+    def entity_model(self, base_url, fetch):
+        """$metadata model of an environment, loaded once per run from the disk cache."""
+        # held while downloading, so concurrent sinks wait for one download
+        with self._entity_models_lock:
+            if base_url not in self._entity_models:
+                from target_dynamics_finance.metadata import DEFAULT_METADATA_TTL, MetadataCache
+
+                cache = MetadataCache(
+                    self.config.get("metadata_cache_dir"),
+                    float(self.config.get("metadata_ttl") or DEFAULT_METADATA_TTL),
+                )
+                self._entity_models[base_url] = cache.load(base_url, fetch)
+            return self._entity_models[base_url]
+
+    def rate_limiter_for(self, company=None):
+        """Rate limiter of a company lane, the shared one outside of lanes."""
+        if company is None:
+            return self.rate_limiter
+        key = str(company).lower()
+        with self._rate_limiters_lock:
+            if key not in self._company_rate_limiters:
+                self._company_rate_limiters[key] = self.build_rate_limiter()
+            return self._company_rate_limiters[key]
+
+    @property
+    def request_logger(self):
+        """Sampled, redacted request logging shared by all sinks."""
+        if self._request_logger is None:
+            from target_dynamics_finance.logs import RequestLogger
+
+            self._request_logger = RequestLogger(self.logger, self.config)
+        return self._request_logger
+
+    @property
+    def dedup_index(self):
+        """Index of record hashes already written, shared by all sinks."""
+        if self._dedup_index is None:
+            from target_dynamics_finance.dedup import DedupIndex
+
+            self._dedup_index = DedupIndex(self.config.get("dedup_index_path"), self.serializer)
+        return self._dedup_index
+
+    @property
+    def compression(self):
+        """Gzip compression of request bodies, shared so a rejection turns it off everywhere."""
+        if self._compression is None:
+            from target_dynamics_finance.compression import (
+                DEFAULT_COMPRESSION_LEVEL,
+                DEFAULT_COMPRESSION_MIN_BYTES,
+                RequestCompression,
+            )
+
+            self._compression = RequestCompression(
+                bool(self.config.get("request_compression")),
+                int(self.config.get("compression_min_bytes") or DEFAULT_COMPRESSION_MIN_BYTES),
+                int(self.config.get("compression_level") or DEFAULT_COMPRESSION_LEVEL),
+            )
+        return self._compression
+
+    @property
+    def journal(self):
+        """Write-ahead journal of invoice operations, None unless journal_path is set."""
+        if self._journal is None and self.config.get("journal_path"):
+            from target_dynamics_finance.journal import Journal
+
+            self._journal = Journal(self.config["journal_path"])
+        return self._journal
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Approximate memory held by the records buffered in every sink."""
+        return sum(getattr(sink, "pending_bytes", 0) for sink in self._sinks_active.values())
+
+    def _process_lines(self, file_input):
+        """Read the input ahead through a bounded queue if input_queue_size is set."""
+        if self.config.get("input_queue_size"):
+            file_input = BufferedInput(file_input, int(self.config["input_queue_size"]))
+        return super()._process_lines(file_input)
+
+    def _process_record_message(self, message_dict: dict) -> None:
+        # a record may depend on records of other streams before it (e.g. an
+        # invoice on a new vendor), so what they buffered is written first
+        self.drain_other_sinks(message_dict.get("stream"))
+        super()._process_record_message(message_dict)
+        # windows of all sinks together stay under the memory ceiling
+        max_buffer_bytes = int(self.config.get("max_buffer_bytes") or DEFAULT_MAX_BUFFER_BYTES)
+        if self.buffered_bytes > max_buffer_bytes:
+            self.logger.info("Buffered records exceed %s bytes, draining all sinks", max_buffer_bytes)
+            self.drain_all()
+            return
+        self._records_since_state += 1
+        if self.state_due():
+            self.drain_all()
+
+    def drain_other_sinks(self, stream_name: str) -> None:
+        """Write the records buffered by the sinks of other streams, keeping the input order."""
+        for name, sink in list(self._sinks_active.items()):
+            if name != stream_name and sink.current_size:
+                self.drain_one(sink)
+
+    def state_due(self) -> bool:
+        """Whether state_every_records or state_interval asks for a checkpoint."""
+        every_records = self.config.get("state_every_records")
+        if every_records and self._records_since_state >= int(every_records):
+            return True
+        interval = self.config.get("state_interval")
+        return bool(interval) and time.monotonic() - self._state_emitted_at >= float(interval)
+
+    def _write_state_message(self, state: dict):
+        """Add the request metrics to the summary of every emitted state."""
+        if self.metrics.enabled and isinstance(state.get("summary"), dict):
+            state["summary"]["metrics"] = self.metrics.summary()
+        self._records_since_state = 0
+        self._state_emitted_at = time.monotonic()
+        if not self.config.get("compact_state"):
+            return super()._write_state_message(state)
+
+        from target_dynamics_finance.state import encode_state
+
+        state.update(self.authenticator.state)
+        # bookmarks were encoded as records were written, only the rest is serialized here
+        state_json = encode_state(state, self.serializer).decode()
+        self.logger.info("Emitting completed target state (%s bytes)", len(state_json))
+        sys.stdout.write(f"{state_json}\n")
+        sys.stdout.flush()
+
+    def _process_endofpipe(self) -> None:
+        super()._process_endofpipe()
+        if self.metrics.enabled and self.config.get("metrics_path"):
+            self.metrics.write(
+                self.config["metrics_path"],
+                openmetrics=self.config.get("metrics_format") == "openmetrics",
+            )
+        if self.profiler:
+            self.profiler.stop()
+
     def get_sink_class(self, stream_name: str):
+        from target_dynamics_finance.sinks import FallbackSink
+
         for sink_class in self.SINK_TYPES:
             # Search for streams with multiple names
             if stream_name in sink_class.available_names:
@@ -41,6 +326,16 @@ class TargetDynamicsFinance(TargetHotglue):
         # Adds a fallback sink for streams that are not supported
         return FallbackSink
 
+    def drain_all(self, is_endofpipe: bool = False) -> None:
+        """Drain every sink, then emit a state that includes what was just written.
+
+        The SDK copies the state before draining, but buffered sinks only write
+        in process_batch, so they are drained before that copy.
+        """
+        self._drain_all(self._sinks_to_clear, 1)
+        self._drain_all(list(self._sinks_active.values()), self.max_parallelism)
+        super().drain_all(is_endofpipe)
+
 
 if __name__ == "__main__":
     TargetDynamicsFinance.cli()
@@ -0,0 +1,31 @@
+"""Tests for streamed attachment bodies."""
+
+import base64
+import json
+
+from target_dynamics_finance.attachments import AttachmentBody, attachment_path
+
+
+def test_attachment_path():
+    payload = {"Id": "42", "Name": "invoice.pdf"}
+
+    assert attachment_path("/tmp/input", payload) == "/tmp/input/42_invoice.pdf"
+    assert attachment_path("/tmp/input/", {"Name": "invoice.pdf"}) == "/tmp/input/invoice.pdf"
+
+
+def test_attachment_body_streams_base64(tmp_path):
+    contents = bytes(range(256)) * 41
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(contents)
+
+    body = AttachmentBody({"Name": "invoice.pdf", "HeaderReference": "000123"}, str(path), chunk_size=3 * 100)
+    data = b"".join(body)
+
+    assert len(body) == len(data)
+    assert json.loads(data) == {
+        "Name": "invoice.pdf",
+        "HeaderReference": "000123",
+        "FileContents": base64.b64encode(contents).decode(),
+    }
+    # bodies can be sent again on retries
+    assert b"".join(body) == data
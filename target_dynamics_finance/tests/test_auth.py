@@ -0,0 +1,116 @@
+"""Tests for the shared authenticator and its token refresh."""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from target_dynamics_finance import auth
+from target_dynamics_finance.auth import DynamicsAuthenticator
+from target_dynamics_finance.metrics import Metrics
+
+
+class TokenSession:
+    """Token endpoint handing out token-1, token-2... slowly enough for callers to overlap."""
+
+    def __init__(self, expires_in=3600, delay=0.05):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.posts = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        time.sleep(self.delay)
+        with self.lock:
+            self.posts += 1
+            token = f"token-{self.posts}"
+        return SimpleNamespace(
+            status_code=200,
+            text="",
+            json=lambda: {"access_token": token, "expires_in": self.expires_in},
+        )
+
+
+def build_authenticator(tmp_path, session, **config):
+    config = dict({"subdomain": "test", "client_id": "id", "client_secret": "secret"}, **config)
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps(config))
+    target = SimpleNamespace(
+        name="target-dynamics-finance",
+        _config=config,
+        logger=logging.getLogger("test_auth"),
+        config_file=str(config_file),
+        session=session,
+        metrics=Metrics(),
+    )
+    return DynamicsAuthenticator(target, {}, "https://login.example/token"), config_file
+
+
+def test_concurrent_callers_fetch_one_token(tmp_path):
+    session = TokenSession()
+    authenticator, _ = build_authenticator(tmp_path, session)
+    headers = []
+
+    def call():
+        headers.append(authenticator.auth_headers)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert session.posts == 1
+    assert headers == [{"Authorization": "Bearer token-1"}] * 8
+
+
+def test_expiring_token_is_refreshed(tmp_path):
+    now = round(datetime.utcnow().timestamp())
+    session = TokenSession()
+    authenticator, _ = build_authenticator(tmp_path, session, access_token="valid", expires_in=now + 3600)
+    assert authenticator.auth_headers == {"Authorization": "Bearer valid"}
+    assert session.posts == 0
+
+    # within the expiry margin, requests refresh the token first
+    authenticator, _ = build_authenticator(
+        tmp_path, session, access_token="expiring", expires_in=now + auth.EXPIRY_MARGIN - 10
+    )
+    assert authenticator.auth_headers == {"Authorization": "Bearer token-1"}
+    assert session.posts == 1
+
+
+def test_token_is_refreshed_in_the_background(tmp_path, monkeypatch):
+    # refresh 0.1s after every token is issued
+    monkeypatch.setattr(auth, "BACKGROUND_REFRESH_MARGIN", 3599.9)
+    session = TokenSession(delay=0)
+    authenticator, _ = build_authenticator(tmp_path, session)
+    try:
+        assert authenticator.auth_headers == {"Authorization": "Bearer token-1"}
+        time.sleep(0.35)
+        assert session.posts >= 2
+        assert authenticator.auth_headers != {"Authorization": "Bearer token-1"}
+    finally:
+        authenticator._refresh_timer.cancel()
+
+
+def test_config_is_rewritten_atomically(tmp_path):
+    session = TokenSession(delay=0)
+    authenticator, config_file = build_authenticator(tmp_path, session)
+    authenticator.auth_headers
+
+    config = json.loads(config_file.read_text())
+    assert config["access_token"] == "token-1"
+    assert config["expires_in"] > datetime.utcnow().timestamp()
+    assert os.listdir(tmp_path) == ["config.json"]
+
+    # a failed write leaves the previous config and no temp file behind
+    authenticator._config["unserializable"] = object()
+    with pytest.raises(TypeError):
+        authenticator.persist_config()
+    assert json.loads(config_file.read_text()) == config
+    assert os.listdir(tmp_path) == ["config.json"]
@@ -0,0 +1,73 @@
+"""Tests for OData $batch body building and response parsing."""
+
+from target_dynamics_finance.batch import (
+    BatchOperation,
+    build_batch_body,
+    expand_results,
+    parse_batch_response,
+)
+
+BATCH_RESPONSE = """--batchresponse_1
+Content-Type: multipart/mixed; boundary=changesetresponse_1
+
+--changesetresponse_1
+Content-Type: application/http
+Content-Transfer-Encoding: binary
+Content-ID: 1
+
+HTTP/1.1 201 Created
+Content-Type: application/json; odata.metadata=minimal
+
+{"HeaderReference": "000123"}
+--changesetresponse_1
+Content-Type: application/http
+Content-Transfer-Encoding: binary
+Content-ID: 2
+
+HTTP/1.1 204 No Content
+
+--changesetresponse_1--
+--batchresponse_1
+Content-Type: application/http
+Content-Transfer-Encoding: binary
+
+HTTP/1.1 400 Bad Request
+Content-Type: application/json
+
+{"error": {"message": "Write failed"}}
+--batchresponse_1--
+"""
+
+
+def test_build_batch_body():
+    operations = [
+        BatchOperation("POST", "https://x.operations.dynamics.com/data/VendorInvoiceLines", {"ItemName": "a"}),
+        BatchOperation("PATCH", "https://x.operations.dynamics.com/data/VendorsV3(dataAreaId='usmf')", {"Name": "b"}, {"cross-company": "true"}),
+    ]
+    body, content_type = build_batch_body([operations])
+    body = body.decode()
+    boundary = content_type.split("boundary=")[1]
+
+    assert body.startswith(f"--{boundary}\r\n")
+    assert body.endswith(f"--{boundary}--\r\n")
+    assert "POST https://x.operations.dynamics.com/data/VendorInvoiceLines HTTP/1.1" in body
+    assert "VendorsV3(dataAreaId='usmf')?cross-company=true HTTP/1.1" in body
+    assert "Content-ID: 2" in body
+
+
+def test_parse_batch_response():
+    groups = parse_batch_response("multipart/mixed; boundary=batchresponse_1", BATCH_RESPONSE)
+
+    assert [[r.status_code for r in group] for group in groups] == [[201, 204], [400]]
+    assert groups[0][0].json() == {"HeaderReference": "000123"}
+    assert groups[0][1].json() == {}
+    assert not groups[1][0].ok
+
+
+def test_failed_changeset_applies_to_every_operation():
+    groups = parse_batch_response("multipart/mixed; boundary=batchresponse_1", BATCH_RESPONSE)
+    operations = [BatchOperation("POST", "u"), BatchOperation("POST", "u")]
+
+    results = expand_results(operations, groups[1])
+
+    assert [r.status_code for r in results] == [400, 400]
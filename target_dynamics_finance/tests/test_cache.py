@@ -0,0 +1,56 @@
+"""Tests for the lookup cache."""
+
+import time
+
+from target_dynamics_finance.cache import NOT_FOUND, LookupCache, lookup_key
+
+
+def test_lookup_key_is_case_insensitive():
+    assert lookup_key("/VendorsV3", "USMF", "VendorAccountNumber", "V-001") == lookup_key(
+        "VendorsV3", "usmf", "VendorAccountNumber", "v-001"
+    )
+
+
+def test_negative_and_expired_entries():
+    cache = LookupCache(ttl=0.05)
+    key = lookup_key("VendorsV3", "usmf", "VendorAccountNumber", "V-001")
+
+    assert cache.get(key) is None
+    cache.set(key, None)
+    assert cache.get(key) is NOT_FOUND
+
+    time.sleep(0.06)
+    assert cache.get(key) is None
+
+
+def test_lru_eviction_and_invalidate():
+    cache = LookupCache(max_size=2)
+    first = lookup_key("VendorsV3", "usmf", "VendorAccountNumber", "1")
+    second = lookup_key("VendorsV3", "usmf", "VendorAccountNumber", "2")
+    third = lookup_key("VendorsV3", "usmf", "VendorAccountNumber", "3")
+    cache.set(first, {"id": 1})
+    cache.set(second, {"id": 2})
+    cache.get(first)
+    cache.set(third, {"id": 3})
+
+    assert cache.get(second) is None
+    assert cache.get(first) == {"id": 1}
+
+    cache.invalidate("/VendorsV3", "USMF", "VendorAccountNumber", "3")
+    assert cache.get(third) is None
+    assert cache.get(first) == {"id": 1}
+
+
+def test_invalidate_missing():
+    cache = LookupCache()
+    by_name = lookup_key("VendorsV3", "usmf", "VendorOrganizationName", "New vendor")
+    other_company = lookup_key("VendorsV3", "nor", "VendorOrganizationName", "New vendor")
+    found = lookup_key("VendorsV3", "usmf", "VendorAccountNumber", "1")
+    cache.set(by_name, None)
+    cache.set(other_company, None)
+    cache.set(found, {"id": 1})
+
+    cache.invalidate_missing("/VendorsV3", "USMF")
+    assert cache.get(by_name) is None
+    assert cache.get(other_company) is NOT_FOUND
+    assert cache.get(found) == {"id": 1}
@@ -0,0 +1,55 @@
+"""Tests for capturing HTTP traffic to cassettes and replaying it."""
+
+import json
+
+import pytest
+
+from target_dynamics_finance.cassette import Cassette, CassetteWriter, redact_text, response_content
+
+
+def entry(method, url, body, started=0.0, elapsed=0.1):
+    return {"method": method, "url": url, "status": 200, "body": body, "started": started, "elapsed": elapsed}
+
+
+def test_redact_text():
+    assert redact_text("grant_type=client_credentials&client_secret=s3cr3t&client_id=a") == (
+        "grant_type=client_credentials&client_secret=***&client_id=a"
+    )
+    assert redact_text("https://blob.core.windows.net/dmf/x.zip?sv=2020&sig=abc%2Bdef") == (
+        "https://blob.core.windows.net/dmf/x.zip?sv=2020&sig=***"
+    )
+    token = json.loads(redact_text('{"access_token": "eyJ", "expires_in": "3599"}'))
+    assert token == {"access_token": "***", "expires_in": "3599"}
+    write_url = json.loads(redact_text(json.dumps({"value": '{"BlobUrl": "https://b/x?sp=w&sig=abc"}'})))
+    assert write_url["value"] == '{"BlobUrl": "https://b/x?sp=w&sig=***"}'
+
+
+def test_cassette_serves_responses_in_order():
+    cassette = Cassette(
+        [
+            entry("GET", "https://d/data/VendorsV3?$filter=a", '{"value": [1]}'),
+            entry("GET", "https://d/data/VendorsV3?$filter=a", '{"value": [2]}'),
+            entry("POST", "https://d/data/VendorsV3", '{"id": 1}'),
+        ]
+    )
+
+    assert cassette.match("get", "https://d/data/VendorsV3?$filter=a")["body"] == '{"value": [1]}'
+    # another query of the same entity set gets its next response
+    assert cassette.match("GET", "https://d/data/VendorsV3?$filter=b")["body"] == '{"value": [2]}'
+    # retries get the last response of the URL again
+    assert cassette.match("GET", "https://d/data/VendorsV3?$filter=a")["body"] == '{"value": [1]}'
+    assert cassette.match("POST", "https://d/data/VendorsV3")["body"] == '{"id": 1}'
+    with pytest.raises(KeyError):
+        cassette.match("DELETE", "https://d/data/VendorsV3")
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    writer = CassetteWriter(path)
+    writer.record(entry("GET", "https://d/data/VendorsV3", "{}", started=0.0, elapsed=0.5))
+    writer.record(dict(entry("GET", "https://d/blob", None, started=0.2, elapsed=1.0), body_base64="AAE="))
+    writer.close()
+
+    cassette = Cassette.load(path)
+    assert cassette.stats() == {"requests": 2, "request_seconds": 1.5, "wall_seconds": 1.2}
+    assert response_content(cassette.entries[1]) == b"\x00\x01"
@@ -0,0 +1,31 @@
+"""Tests for the record hash index."""
+
+from target_dynamics_finance.dedup import DedupIndex
+
+
+def test_only_successful_states_are_indexed():
+    index = DedupIndex()
+    index.load("VendorsV3", [{"hash": "a", "success": True, "id": "1"}, {"hash": "b", "success": False}])
+
+    assert index.get("VendorsV3", "a") == {"hash": "a", "success": True, "id": "1"}
+    assert index.get("VendorsV3", "b") is None
+    assert index.get("VendorInvoiceHeaders", "a") is None
+
+
+def test_index_is_persisted(tmp_path):
+    path = str(tmp_path / "dedup.db")
+    index = DedupIndex(path)
+    index.add("VendorsV3", {"hash": "a", "success": True, "id": "1"})
+    index.close()
+
+    assert DedupIndex(path).get("VendorsV3", "a") == {"hash": "a", "success": True, "id": "1"}
+
+
+def test_states_are_kept_encoded():
+    index = DedupIndex()
+    state = {"hash": "a", "success": True, "id": "1"}
+    index.add("VendorsV3", state)
+    state["id"] = "2"
+
+    # the bookmark isn't held a second time as a dict
+    assert index.get("VendorsV3", "a") == {"hash": "a", "success": True, "id": "1"}
@@ -0,0 +1,31 @@
+"""Tests for the delta of records against existing entities."""
+
+from target_dynamics_finance.delta import changed_fields, same_value
+
+
+def test_same_value_normalizes_dynamics_formats():
+    assert same_value("2024-03-01", "2024-03-01T00:00:00Z")
+    assert same_value("10.50", 10.5)
+    assert same_value("", None)
+    assert not same_value("001", "1")
+    assert not same_value("2024-03-01", "2024-03-02T00:00:00Z")
+
+
+def test_changed_fields():
+    existing = {
+        "@odata.etag": 'W/"123"',
+        "dataAreaId": "usmf",
+        "VendorAccountNumber": "V-001",
+        "VendorOrganizationName": "Acme",
+        "CreditLimit": 100.0,
+    }
+    record = {
+        "dataAreaId": "usmf",
+        "VendorAccountNumber": "V-001",
+        "VendorOrganizationName": "Acme Inc",
+        "CreditLimit": "100",
+        "AddressCity": "Seattle",
+    }
+
+    assert changed_fields(record, existing) == {"VendorOrganizationName": "Acme Inc", "AddressCity": "Seattle"}
+    assert changed_fields(record, existing, ignore=["AddressCity", "VendorOrganizationName"]) == {}
@@ -0,0 +1,77 @@
+"""Tests for DMF data packages and imports, against the benchmark mock server."""
+
+import json
+import os
+import sys
+import urllib.request
+import zipfile
+
+from target_dynamics_finance.dmf import DMF_ACTIONS, DmfImporter, PackageWriter, parse_error_keys, row_key
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+
+from mock_server import start_server  # noqa: E402
+
+
+class Response:
+    def __init__(self, response):
+        self.status_code = response.status
+        self.content = response.read()
+
+    def raise_for_status(self):
+        assert self.status_code < 400
+
+
+class Session:
+    """Minimal stand-in for the requests session, over urllib."""
+
+    def put(self, url, data=None, headers=None, timeout=None):
+        request = urllib.request.Request(url, data=data.read(), headers=headers or {}, method="PUT")
+        return Response(urllib.request.urlopen(request))
+
+    def get(self, url, timeout=None):
+        return Response(urllib.request.urlopen(url))
+
+
+def test_package_contents(tmp_path):
+    writer = PackageWriter("Vendors V3", ["dataAreaId", "VendorAccountNumber", "OnHold"], str(tmp_path))
+    writer.write({"dataAreaId": "usmf", "VendorAccountNumber": "V-1", "OnHold": False, "Extra": "x"})
+    path = writer.build("vendors-import")
+
+    with zipfile.ZipFile(path) as package:
+        assert sorted(package.namelist()) == ["Manifest.xml", "PackageHeader.xml", "Vendors V3.csv"]
+        assert "<Entity>Vendors V3</Entity>" in package.read("Manifest.xml").decode()
+        assert package.read("Vendors V3.csv").decode().splitlines() == [
+            "dataAreaId,VendorAccountNumber,OnHold",
+            "usmf,V-1,No",
+        ]
+
+
+def test_import_maps_failed_rows(tmp_path):
+    server = start_server()
+    try:
+        def request(action, body):
+            request = urllib.request.Request(
+                f"{server.base_url}/data{DMF_ACTIONS}.{action}",
+                data=json.dumps(body).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            return json.loads(urllib.request.urlopen(request).read())["value"]
+
+        writer = PackageWriter("Vendors V3", ["dataAreaId", "VendorAccountNumber"], str(tmp_path))
+        writer.write({"dataAreaId": "usmf", "VendorAccountNumber": "V-1"})
+        writer.write({"dataAreaId": "usmf", "VendorAccountNumber": "FAIL-2"})
+        importer = DmfImporter(request, Session(), poll_interval=0.01)
+
+        _, status, failed = importer.run(writer.build("vendors-import"), "vendors-import", "Vendors V3", "usmf")
+    finally:
+        server.shutdown()
+
+    assert status == "PartiallySucceeded"
+    keys = {row_key(row, ["dataAreaId", "VendorAccountNumber"]) for row in failed}
+    assert keys == {("usmf", "fail-2")}
+
+
+def test_parse_error_keys_with_bom():
+    assert parse_error_keys("\ufeffVENDORACCOUNTNUMBER\r\nV-1\r\n") == [{"VENDORACCOUNTNUMBER": "V-1"}]
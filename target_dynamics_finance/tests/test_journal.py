@@ -0,0 +1,82 @@
+"""Tests for the invoice operations journal and invoices resuming from it."""
+
+import io
+import json
+
+from target_dynamics_finance.journal import Journal
+from target_dynamics_finance.tests.test_target import generate, run_target
+
+
+def test_journal_resumes_after_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = Journal(path)
+    journal.record("VendorInvoiceHeaders", "abc", "header", {"dataAreaId": "usmf", "HeaderReference": "001"})
+    journal.record("VendorInvoiceHeaders", "abc", "line:0")
+    journal.record("VendorInvoiceHeaders", "def", "header", {"HeaderReference": "002"})
+    journal.close()
+
+    journal = Journal(path)
+    assert journal.steps("VendorInvoiceHeaders", "abc") == {
+        "header": {"dataAreaId": "usmf", "HeaderReference": "001"},
+        "line:0": None,
+    }
+    assert journal.steps("VendorInvoiceHeaders", "missing") == {}
+
+    journal.complete("VendorInvoiceHeaders", "abc", "001")
+    journal.clear("VendorInvoiceHeaders", "def")
+    journal.close()
+
+    journal = Journal(path)
+    assert journal.steps("VendorInvoiceHeaders", "abc") == {"done": "001"}
+    assert journal.steps("VendorInvoiceHeaders", "def") == {}
+    assert len(journal) == 1
+
+
+def generated_messages(**stream):
+    data = io.StringIO()
+    generate(data, **stream)
+    return [json.loads(line) for line in data.getvalue().splitlines()]
+
+
+def test_invoices_resume_after_a_kill(tmp_path):
+    journal_path = str(tmp_path / "journal.db")
+    config = {"journal_path": journal_path}
+    messages = generated_messages(invoices=3, lines=3)
+    state, _ = run_target(tmp_path, config, messages=messages)
+    done, half_posted, not_started = [bookmark["hash"] for bookmark in state["bookmarks"]["VendorInvoiceHeaders"]]
+
+    # what a run killed while posting the lines of the second invoice leaves behind
+    journal = Journal(journal_path)
+    header = {"dataAreaId": "c00", "HeaderReference": "H000000042"}
+    journal.clear("VendorInvoiceHeaders", half_posted)
+    journal.record("VendorInvoiceHeaders", half_posted, "header", header)
+    journal.record("VendorInvoiceHeaders", half_posted, "line:0")
+    journal.clear("VendorInvoiceHeaders", not_started)
+    journal.close()
+
+    state, stats = run_target(tmp_path, config, messages=messages)
+
+    # only the header of the third invoice and the lines not posted yet are sent
+    assert stats["requests"]["POST /data/VendorInvoiceHeaders"] == 1
+    assert stats["requests"]["POST /data/VendorInvoiceLines"] == 2 + 3
+    bookmarks = state["bookmarks"]["VendorInvoiceHeaders"]
+    assert [bookmark["hash"] for bookmark in bookmarks] == [done, half_posted, not_started]
+    assert all(bookmark["success"] for bookmark in bookmarks)
+    assert bookmarks[1]["id"] == "H000000042"
+    journal = Journal(journal_path)
+    assert journal.steps("VendorInvoiceHeaders", half_posted) == {"done": "H000000042"}
+
+
+def test_header_is_deleted_when_a_line_fails(tmp_path):
+    journal_path = str(tmp_path / "journal.db")
+    messages = generated_messages(invoices=1, lines=3)
+    messages[-2]["record"]["VendorInvoiceLines"][1]["ItemName"] = "FAIL unknown item"
+    state, stats = run_target(tmp_path, {"journal_path": journal_path}, messages=messages)
+
+    assert stats["requests"]["POST /data/VendorInvoiceLines"] == 2
+    assert stats["requests"]["DELETE /data/VendorInvoiceHeaders"] == 1
+    [bookmark] = state["bookmarks"]["VendorInvoiceHeaders"]
+    assert not bookmark["success"]
+    assert "header was deleted" in bookmark["error"]
+    # the rolled back invoice is posted from scratch by the next run
+    assert Journal(journal_path).steps("VendorInvoiceHeaders", bookmark["hash"]) == {}
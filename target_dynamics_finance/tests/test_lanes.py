@@ -0,0 +1,63 @@
+"""Tests for the company lanes of partition_by_company."""
+
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+
+from generate_stream import example_messages  # noqa: E402
+
+from target_dynamics_finance.target import TargetDynamicsFinance  # noqa: E402
+
+
+def build_sink(tmp_path, **config):
+    config = dict({"subdomain": "test", "client_id": "test", "client_secret": "test"}, **config)
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(config))
+    target = TargetDynamicsFinance(config=[str(config_path)])
+    schema = example_messages()["VendorsV3"]["schema"]
+    sink = target.get_sink("VendorsV3", schema=schema["schema"], key_properties=schema["key_properties"])
+    sink.init_state()
+    return target, sink
+
+
+def test_workers_of_a_lane_use_its_rate_limiter(tmp_path):
+    target, sink = build_sink(tmp_path, max_workers=2, partition_by_company=True)
+    limiters = []
+    threads = set()
+
+    def upsert_record(record, context):
+        limiters.append((record["dataAreaId"], sink.rate_limiter))
+        threads.add(threading.current_thread().name)
+        return record["VendorAccountNumber"], True, {}
+
+    sink.upsert_record = upsert_record
+    records = [
+        ({"dataAreaId": company, "VendorAccountNumber": f"V{company}{i}"}, {})
+        for company in ("c00", "c01")
+        for i in range(3)
+    ]
+    sink.write_lanes(records)
+
+    # the upserts ran on the worker pools of the lanes, not on the lane threads
+    assert not any(name.startswith("company-lane") for name in threads)
+    assert len(limiters) == 6
+    for company, limiter in limiters:
+        assert limiter is target.rate_limiter_for(company)
+        assert limiter is not target.rate_limiter
+    assert sink._lane.__dict__.get("company") is None
+
+
+def test_in_lane_carries_the_company_to_another_thread(tmp_path):
+    target, sink = build_sink(tmp_path)
+    sink._lane.company = "c01"
+    run = sink.in_lane(lambda: sink.rate_limiter)
+    sink._lane.company = None
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(run).result() is target.rate_limiter_for("c01")
+        # the worker is back outside of any lane afterwards
+        assert executor.submit(lambda: sink.rate_limiter).result() is target.rate_limiter
@@ -0,0 +1,30 @@
+"""Tests for request logging."""
+
+import logging
+
+from target_dynamics_finance.logs import LazyBody, RequestLogger, redact
+
+
+def test_redact_secrets_and_file_contents():
+    body = {"client_id": "id", "client_secret": "secret", "lines": [{"FileContents": "AAAA"}]}
+
+    assert redact(body) == {"client_id": "id", "client_secret": "***", "lines": [{"FileContents": "<4 chars>"}]}
+    assert body["client_secret"] == "secret"
+
+
+def test_lazy_body_truncates():
+    text = str(LazyBody({"Description": "x" * 100}, max_chars=20))
+
+    assert text.startswith('{"Description": "xxx')
+    assert text.endswith("(119 chars)")
+
+
+def test_sampling_per_endpoint(caplog):
+    logger = RequestLogger(logging.getLogger("test-logs"), {"log_sample_rate": 0.5})
+
+    with caplog.at_level(logging.INFO, logger="test-logs"):
+        for _ in range(4):
+            logger.request("POST", "url", "/VendorInvoiceLines", {}, {"a": 1})
+        logger.request("GET", "url", "/VendorsV3", {}, None)
+
+    assert len(caplog.records) == 3
@@ -0,0 +1,69 @@
+"""Tests for the $metadata entity model."""
+
+import io
+
+from target_dynamics_finance.metadata import EntityModel, MetadataCache, parse_metadata
+
+METADATA = b"""<?xml version="1.0" encoding="utf-8"?>
+<edmx:Edmx Version="4.0" xmlns:edmx="http://docs.oasis-open.org/odata/ns/edmx">
+  <edmx:DataServices>
+    <Schema Namespace="Microsoft.Dynamics.DataEntities" xmlns="http://docs.oasis-open.org/odata/ns/edm">
+      <EntityType Name="VendorV3">
+        <Key>
+          <PropertyRef Name="dataAreaId" />
+          <PropertyRef Name="VendorAccountNumber" />
+        </Key>
+        <Property Name="dataAreaId" Type="Edm.String" Nullable="false" MaxLength="4" />
+        <Property Name="VendorAccountNumber" Type="Edm.String" Nullable="false" MaxLength="20" />
+        <Property Name="CreditLimit" Type="Edm.Decimal" Nullable="false" />
+        <Property Name="OnHoldStatus" Type="Microsoft.Dynamics.DataEntities.VendorBlocked" />
+      </EntityType>
+      <EnumType Name="VendorBlocked">
+        <Member Name="No" Value="0" />
+        <Member Name="All" Value="2" />
+      </EnumType>
+      <EntityContainer Name="Resources">
+        <EntitySet Name="VendorsV3" EntityType="Microsoft.Dynamics.DataEntities.VendorV3" />
+      </EntityContainer>
+    </Schema>
+  </edmx:DataServices>
+</edmx:Edmx>
+"""
+
+
+def test_validate_prunes_and_rejects():
+    model = EntityModel(parse_metadata(io.BytesIO(METADATA)))
+    assert model.keys("/VendorsV3") == ["dataAreaId", "VendorAccountNumber"]
+    assert model.keys("/Unknown") is None
+
+    record, pruned, errors = model.validate(
+        "/VendorsV3",
+        {"dataAreaId": "usmf", "VendorAccountNumber": "V-1", "CreditLimit": "10.5", "Extra": 1, "id": "x"},
+        ignore=["id"],
+    )
+    assert record == {"dataAreaId": "usmf", "VendorAccountNumber": "V-1", "CreditLimit": "10.5", "id": "x"}
+    assert pruned == ["Extra"]
+    assert errors == []
+
+    _, _, errors = model.validate(
+        "/VendorsV3", {"dataAreaId": "toolong", "CreditLimit": None, "OnHoldStatus": "Maybe"}
+    )
+    assert errors == [
+        "dataAreaId is 7 characters, longer than 4",
+        "CreditLimit can't be null",
+        "OnHoldStatus 'Maybe' is not one of No, All",
+    ]
+
+
+def test_cache_downloads_once(tmp_path):
+    cache = MetadataCache(str(tmp_path))
+    downloads = []
+
+    def fetch():
+        downloads.append(1)
+        return METADATA
+
+    cache.load("https://example.operations.dynamics.com/data", fetch)
+    model = cache.load("https://example.operations.dynamics.com/data", fetch)
+    assert len(downloads) == 1
+    assert model.keys("VendorsV3") == ["dataAreaId", "VendorAccountNumber"]
@@ -0,0 +1,40 @@
+"""Tests for request metrics."""
+
+import pytest
+
+from target_dynamics_finance.metrics import Metrics, operation_name
+
+
+def test_operation_name():
+    assert operation_name("PATCH", "/VendorsV3(dataAreaId='usmf',VendorAccountNumber='1')") == "PATCH VendorsV3"
+    assert operation_name("POST", "/$batch") == "POST $batch"
+
+
+def test_metrics_summary_and_prometheus():
+    metrics = Metrics(enabled=True)
+    metrics.observe("GET VendorsV3", 0.02, bytes_received=100)
+    metrics.observe("GET VendorsV3", 0.2, error=True)
+    metrics.count_retry("GET VendorsV3")
+    with pytest.raises(ValueError):
+        with metrics.timed("lookup"):
+            raise ValueError()
+
+    summary = metrics.summary()
+    assert summary["GET VendorsV3"]["count"] == 2
+    assert summary["GET VendorsV3"]["p50_ms"] == 25.0
+    assert summary["GET VendorsV3"]["errors"] == 1
+    assert summary["GET VendorsV3"]["retries"] == 1
+    assert summary["lookup"]["errors"] == 1
+
+    text = metrics.to_prometheus(openmetrics=True)
+    assert 'target_dynamics_finance_duration_seconds_bucket{operation="GET VendorsV3",le="+Inf"} 2' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    metrics.observe("GET VendorsV3", 0.02)
+    with metrics.timed("lookup"):
+        pass
+
+    assert metrics.summary() == {}
@@ -0,0 +1,28 @@
+"""Tests for bounded input reading and record size accounting."""
+
+import io
+import time
+
+from target_dynamics_finance.pipeline import BufferedInput, record_size
+
+
+def test_record_size_counts_nested_lines():
+    header = {"InvoiceNumber": "INV-1"}
+    invoice = dict(header, VendorInvoiceLines=[{"ItemNumber": "A" * 1000}])
+    assert record_size(invoice) > record_size(header) + 1000
+
+
+def test_buffered_input_applies_back_pressure():
+    read = []
+
+    def stream():
+        for line in io.StringIO("".join(f"{i}\n" for i in range(100))):
+            read.append(line)
+            yield line
+
+    lines = iter(BufferedInput(stream(), max_lines=5))
+    assert next(lines) == "0\n"
+    time.sleep(0.05)
+    # the reader is blocked once the queue is full
+    assert len(read) <= 7
+    assert len(list(lines)) == 99
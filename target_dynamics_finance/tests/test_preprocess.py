@@ -0,0 +1,53 @@
+"""Tests for the schema-driven record preprocessing."""
+
+import datetime
+
+from target_dynamics_finance.preprocess import build_converters, preprocess
+
+SCHEMA = {
+    "properties": {
+        "InvoiceNumber": {"type": ["string", "null"]},
+        "InvoiceDate": {"type": ["string", "null"], "format": "date"},
+        "UnitPrice": {"type": ["number", "null"]},
+        "VendorInvoiceLines": {"type": ["array", "null"]},
+        "Address": {"anyOf": [{"type": "object"}, {"type": "null"}]},
+    }
+}
+
+
+def test_preprocess_uses_schema_types():
+    record = {
+        "InvoiceNumber": "[INV-1]",
+        "InvoiceDate": "2024-01-17T10:00:00Z",
+        "UnitPrice": 25.0,
+        "VendorInvoiceLines": '[{"ItemName": "a"}]',
+        "Address": "{'City': 'Oslo'}",
+        "Unknown": '{"a": 1}',
+    }
+
+    assert preprocess(record, build_converters(SCHEMA)) == {
+        "InvoiceNumber": "[INV-1]",
+        "InvoiceDate": "2024-01-17",
+        "UnitPrice": 25.0,
+        "VendorInvoiceLines": [{"ItemName": "a"}],
+        "Address": {"City": "Oslo"},
+        "Unknown": {"a": 1},
+    }
+
+
+def test_empty_values_are_sent_as_null():
+    record = {"InvoiceNumber": "", "UnitPrice": 0, "VendorInvoiceLines": []}
+
+    assert preprocess(record, build_converters(SCHEMA)) == {
+        "InvoiceNumber": None,
+        "UnitPrice": None,
+        "VendorInvoiceLines": None,
+    }
+
+
+def test_dates_parsed_by_the_sdk_are_formatted():
+    converters = build_converters(SCHEMA)
+    parsed = datetime.datetime(2024, 1, 17, 10, 0, tzinfo=datetime.timezone.utc)
+
+    assert preprocess({"InvoiceDate": parsed}, converters) == {"InvoiceDate": "2024-01-17"}
+    assert preprocess({"InvoiceDate": parsed.date()}, converters) == {"InvoiceDate": "2024-01-17"}
@@ -0,0 +1,64 @@
+"""Tests for request body serialization."""
+
+import datetime
+import decimal
+
+import pytest
+
+from target_dynamics_finance.attachments import AttachmentBody
+from target_dynamics_finance.batch import BatchOperation, build_batch_body, parse_batch_response
+from target_dynamics_finance.dedup import DedupIndex
+from target_dynamics_finance.serialize import Serializer
+from target_dynamics_finance.state import RecordResults, encode_state
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_compact_bodies_and_unknown_types(name):
+    if name == "orjson":
+        pytest.importorskip("orjson")
+    serializer = Serializer(name)
+    body = serializer.dumps(
+        {"Amount": decimal.Decimal("10.5"), "InvoiceDate": datetime.date(2024, 3, 1), "Name": "Café"}
+    )
+    assert body == '{"Amount":10.5,"InvoiceDate":"2024-03-01","Name":"Café"}'.encode()
+    assert serializer.loads(body)["Name"] == "Café"
+
+
+def test_unknown_serializer():
+    with pytest.raises(Exception, match="Unknown json_serializer"):
+        Serializer("yaml")
+
+
+class CountingSerializer(Serializer):
+    """The json serializer, counting its calls."""
+
+    def __init__(self):
+        super().__init__("json")
+        self.calls = []
+        dumps, loads = self.dumps, self.loads
+        self.dumps = lambda value: self.calls.append("dumps") or dumps(value)
+        self.loads = lambda value: self.calls.append("loads") or loads(value)
+
+
+def test_configured_serializer_reaches_every_body(tmp_path):
+    serializer = CountingSerializer()
+
+    build_batch_body([[BatchOperation("POST", "https://x/data/VendorsV3", {"Name": "a"})]], serializer)
+    response = '--b\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 201 Created\r\n\r\n{"Id": 1}\r\n--b--\r\n'
+    assert parse_batch_response("multipart/mixed; boundary=b", response, serializer)[0][0].json() == {"Id": 1}
+    assert serializer.calls == ["dumps", "loads"]
+
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(b"pdf")
+    AttachmentBody({"Name": "invoice.pdf"}, str(path), serializer=serializer)
+    assert serializer.calls[2:] == ["dumps"]
+
+    results = RecordResults([{"hash": "a", "success": True}], serializer=serializer)
+    assert list(RecordResults.from_bookmark(results)) == [{"hash": "a", "success": True}]
+    encode_state({"bookmarks": {"VendorsV3": results}}, serializer)
+    assert serializer.calls[3:] == ["dumps", "loads", "dumps", "dumps"]
+
+    index = DedupIndex(serializer=serializer)
+    index.add("VendorsV3", {"hash": "a", "success": True})
+    assert index.get("VendorsV3", "a") == {"hash": "a", "success": True}
+    assert serializer.calls[7:] == ["dumps", "loads"]
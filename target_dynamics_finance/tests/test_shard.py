@@ -0,0 +1,83 @@
+"""Tests for the routing and state merging of sharded runs."""
+
+import io
+import json
+import sys
+import zlib
+
+from target_dynamics_finance.shard import ShardedRun, merge_states, shard_key
+
+# a worker counting the records it receives and emitting a state at the end
+WORKER = """
+import json, os, sys
+records = [json.loads(line) for line in sys.stdin if json.loads(line)["type"] == "RECORD"]
+shard = os.environ["TARGET_DYNAMICS_FINANCE_SHARD"]
+print(json.dumps({
+    "bookmarks": {"VendorsV3": [{"hash": r["record"]["VendorAccountNumber"], "shard": shard} for r in records]},
+    "summary": {"VendorsV3": {"success": len(records), "fail": 0}},
+}))
+"""
+
+
+def test_shard_key_is_stable():
+    record = {"VendorAccountNumber": "V1", "dataAreaId": "USMF", "Name": "Acme"}
+
+    assert shard_key("VendorsV3", record, ["VendorAccountNumber"]) == shard_key(
+        "VendorsV3", dict(record, Name="Other"), ["VendorAccountNumber"]
+    )
+    assert shard_key("VendorsV3", record, [], by="dataAreaId") == "usmf"
+    # without keys, identical records still meet in the same shard
+    assert shard_key("Invoices", record, []) == shard_key("Invoices", dict(reversed(record.items())), [])
+
+
+def test_merge_states():
+    states = [
+        {
+            "bookmarks": {"VendorsV3": [{"hash": "a"}]},
+            "summary": {"VendorsV3": {"success": 1, "fail": 0}, "metrics": {"requests": 3}},
+        },
+        {
+            "bookmarks": {"VendorsV3": [{"hash": "b"}], "Invoices": [{"hash": "c"}]},
+            "summary": {"VendorsV3": {"success": 2, "fail": 1}, "Invoices": {"success": 1, "fail": 0}},
+        },
+        {},
+    ]
+
+    assert merge_states(states) == {
+        "bookmarks": {"VendorsV3": [{"hash": "a"}, {"hash": "b"}], "Invoices": [{"hash": "c"}]},
+        "summary": {
+            "VendorsV3": {"success": 3, "fail": 1},
+            "Invoices": {"success": 1, "fail": 0},
+            "metrics": {"shard-0": {"requests": 3}},
+        },
+    }
+
+
+def test_merge_states_keeps_dict_bookmarks():
+    states = [
+        {"bookmarks": {"Invoices": {"results_path": "/r/Invoices.0.jsonl", "count": 2}, "tap": {"updated_at": "1"}}},
+        {"bookmarks": {"Invoices": {"results_path": "/r/Invoices.1.jsonl", "count": 3}, "tap": {"updated_at": "2"}}},
+    ]
+
+    # the same shape as the state of a single process
+    assert merge_states(states)["bookmarks"] == {
+        "Invoices": {"results_path": "/r/Invoices.1.jsonl", "count": 5},
+        "tap": {"updated_at": "2"},
+    }
+    assert merge_states(states[:1])["bookmarks"] == states[0]["bookmarks"]
+
+
+def test_sharded_run_routes_records_and_merges_states():
+    schema = {"type": "SCHEMA", "stream": "VendorsV3", "schema": {}, "key_properties": ["VendorAccountNumber"]}
+    records = [
+        {"type": "RECORD", "stream": "VendorsV3", "record": {"VendorAccountNumber": f"V{i}"}} for i in range(20)
+    ]
+    output = io.StringIO()
+    run = ShardedRun([], 3, output=output, command=[sys.executable, "-c", WORKER])
+
+    assert run.run([json.dumps(m) for m in [schema, *records]]) == 0
+    state = json.loads(output.getvalue().splitlines()[-1])
+    assert state["summary"]["VendorsV3"] == {"success": 20, "fail": 0}
+    for bookmark in state["bookmarks"]["VendorsV3"]:
+        key = shard_key("VendorsV3", {"VendorAccountNumber": bookmark["hash"]}, ["VendorAccountNumber"])
+        assert int(bookmark["shard"]) == zlib.crc32(key.encode()) % 3
@@ -0,0 +1,21 @@
+"""Tests for the import-time report."""
+
+from target_dynamics_finance.startup import parse_importtime, startup_report
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _json
+import time:       800 |        920 | json
+import time:      1500 |       2420 | target_dynamics_finance.serialize
+"""
+
+
+def test_parse_importtime():
+    modules = parse_importtime(OUTPUT)
+    assert modules == [
+        ("_json", 120, 120),
+        ("json", 800, 920),
+        ("target_dynamics_finance.serialize", 1500, 2420),
+    ]
+    report = startup_report(modules).splitlines()
+    assert report[0].endswith("2.4 ms (3 modules)")
+    assert report[1].split() == ["1.5", "ms", "target_dynamics_finance"]
@@ -0,0 +1,34 @@
+"""Tests for the compact record results of the state."""
+
+import copy
+import json
+
+from target_dynamics_finance.state import RecordResults, encode_state
+
+
+def test_results_encode_incrementally():
+    results = RecordResults([{"hash": "a", "success": True, "id": "1"}])
+    results.append({"hash": "b", "success": False, "error": "boom"})
+    state = {"bookmarks": {"VendorsV3": results}, "summary": {"VendorsV3": {"success": 1, "fail": 1}}}
+
+    assert copy.deepcopy(state)["bookmarks"]["VendorsV3"] is results
+    assert json.loads(encode_state(state)) == {
+        "bookmarks": {
+            "VendorsV3": [{"hash": "a", "success": True, "id": "1"}, {"hash": "b", "success": False, "error": "boom"}]
+        },
+        "summary": {"VendorsV3": {"success": 1, "fail": 1}},
+    }
+    assert [r["hash"] for r in results] == ["a", "b"]
+
+
+def test_results_sidecar_file(tmp_path):
+    path = str(tmp_path / "VendorsV3.jsonl")
+    results = RecordResults([{"hash": "a", "success": True}], path)
+    results.append({"hash": "b", "success": True})
+
+    assert json.loads(results.encode()) == {"results_path": path, "count": 2}
+    results.close()
+
+    resumed = RecordResults.from_bookmark({"results_path": path, "count": 2})
+    assert len(resumed) == 2
+    assert [r["hash"] for r in resumed] == ["a", "b"]
@@ -0,0 +1,222 @@
+"""End-to-end runs of the target against the benchmark mock server, checking the emitted STATE."""
+
+import io
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+
+from generate_stream import example_messages, generate, with_properties  # noqa: E402
+from mock_server import start_server  # noqa: E402
+
+
+def run_target(tmp_path, config_extra=None, server_options=None, messages=None, **stream):
+    """Run the target on messages or a generated stream, returning its last state and the server stats."""
+    server = start_server(**(server_options or {}))
+    try:
+        config = {
+            "subdomain": "test",
+            "base_url": server.base_url,
+            "auth_url": f"{server.base_url}/common/oauth2/token",
+            "client_id": "test",
+            "client_secret": "test",
+            "input_path": str(tmp_path),
+            "max_requests_per_second": 1000,
+        }
+        config.update(config_extra or {})
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps(config))
+        data = io.StringIO()
+        if messages is None:
+            generate(data, **stream)
+        else:
+            data.writelines(json.dumps(message) + "\n" for message in messages)
+
+        result = subprocess.run(
+            [sys.executable, "-m", "target_dynamics_finance.target", "--config", str(config_path)],
+            input=data.getvalue().encode(),
+            capture_output=True,
+            cwd=tmp_path,
+        )
+        assert result.returncode == 0, result.stderr.decode()
+        states = [json.loads(line) for line in result.stdout.decode().splitlines() if line.strip()]
+        return states[-1], dict(server.stats.to_dict(), invoice_companies=server.invoice_companies, log=server.request_log)
+    finally:
+        server.shutdown()
+
+
+def counters(summary):
+    """Record counters of a stream summary, without the request stats added to it."""
+    return {key: summary[key] for key in ("success", "fail", "existing", "updated")}
+
+
+def test_state_of_buffered_workers(tmp_path):
+    state, stats = run_target(tmp_path, {"max_workers": 4}, invoices=30, lines=2)
+
+    assert stats["requests"]["POST /data/VendorInvoiceHeaders"] == 30
+    assert state["summary"]["VendorInvoiceHeaders"]["success"] == 30
+    bookmarks = state["bookmarks"]["VendorInvoiceHeaders"]
+    assert len(bookmarks) == 30
+    assert all(bookmark["success"] and bookmark["id"] for bookmark in bookmarks)
+
+
+def test_state_of_prefetched_window(tmp_path):
+    state, stats = run_target(tmp_path, {"prefetch_lookups": True}, invoices=30, lines=2, vendors=5)
+
+    assert stats["requests"]["POST /data/VendorInvoiceHeaders"] == 30
+    # the vendors of the window are resolved by grouped queries, not one lookup per invoice
+    assert stats["requests"]["GET /data/VendorsV3"] < 30
+    assert state["summary"]["VendorInvoiceHeaders"]["success"] == 30
+    assert len(state["bookmarks"]["VendorInvoiceHeaders"]) == 30
+
+
+def test_state_of_company_lanes(tmp_path):
+    state, stats = run_target(tmp_path, {"partition_by_company": True}, invoices=30, lines=1, companies=3)
+
+    assert stats["requests"]["POST /data/VendorInvoiceHeaders"] == 30
+    assert state["summary"]["VendorInvoiceHeaders"]["success"] == 30
+    bookmarks = state["bookmarks"]["VendorInvoiceHeaders"]
+    assert len(bookmarks) == 30
+    # every company lane wrote its invoices into the state
+    companies = Counter(stats["invoice_companies"][bookmark["id"]] for bookmark in bookmarks)
+    assert companies == Counter(stats["invoice_companies"].values())
+    assert set(companies) == {"c00", "c01", "c02"}
+
+
+def vendor_messages(accounts):
+    schema = with_properties(
+        example_messages()["VendorsV3"]["schema"], VendorAccountNumber={"type": ["string", "null"]}
+    )
+    template = example_messages()["VendorsV3"]["record"]
+    records = [
+        {
+            "type": "RECORD",
+            "stream": "VendorsV3",
+            "record": dict(template, dataAreaId="usmf", VendorAccountNumber=account, VendorOrganizationName=f"Vendor {i}"),
+        }
+        for i, account in enumerate(accounts)
+    ]
+    return [schema, *records, {"type": "STATE", "value": {}}]
+
+
+def test_empty_record_on_the_worker_pool(tmp_path):
+    messages = vendor_messages(["V000001", "V000002"])
+    messages.insert(2, {"type": "RECORD", "stream": "VendorsV3", "record": {}})
+    state, stats = run_target(tmp_path, {"max_workers": 2}, messages=messages)
+
+    # the empty record fails on its own, the others are still written
+    assert counters(state["summary"]["VendorsV3"]) == {"success": 0, "fail": 1, "existing": 0, "updated": 2}
+    bookmarks = state["bookmarks"]["VendorsV3"]
+    assert [bookmark["success"] for bookmark in bookmarks] == [True, False, True]
+
+
+def test_invoice_written_after_its_new_vendor(tmp_path):
+    streams = example_messages()
+    invoice_schema = with_properties(
+        streams["VendorInvoiceHeaders"]["schema"],
+        VendorName={"type": ["string", "null"]},
+        attachments={"type": ["array", "null"]},
+    )
+
+    def invoice(number):
+        record = dict(
+            streams["VendorInvoiceHeaders"]["record"],
+            dataAreaId="usmf",
+            InvoiceNumber=number,
+            InvoiceAccount=None,
+            VendorAccount=None,
+            VendorName="NEW Vendor",
+            attachments=[],
+        )
+        return {"type": "RECORD", "stream": "VendorInvoiceHeaders", "record": record}
+
+    vendor_schema, vendor, state_message = vendor_messages([None])
+    vendor["record"]["VendorOrganizationName"] = "NEW Vendor"
+    messages = [invoice_schema, vendor_schema, invoice("INV1"), vendor, invoice("INV2"), state_message]
+    state, stats = run_target(tmp_path, {"max_workers": 2, "prefetch_lookups": True}, messages=messages)
+
+    # the first invoice comes before its vendor exists, the second one after,
+    # even though the name was cached as not found by the first one
+    assert state["summary"]["VendorsV3"]["success"] == 1
+    bookmarks = state["bookmarks"]["VendorInvoiceHeaders"]
+    assert [bookmark["success"] for bookmark in bookmarks] == [False, True]
+
+
+def test_duplicates_are_counted_as_existing(tmp_path):
+    messages = vendor_messages(["V000001", "V000002", "V000001"])
+    messages[3]["record"] = dict(messages[1]["record"])
+    state, stats = run_target(tmp_path, messages=messages)
+
+    assert stats["requests"]["PATCH /data/VendorsV3"] == 2
+    summary = state["summary"]["VendorsV3"]
+    # like the bookmark scan of the base class, a duplicate is counted when it's
+    # found and again when its state is updated
+    assert (summary["updated"], summary["existing"]) == (2, 2)
+    assert [bookmark["id"] for bookmark in state["bookmarks"]["VendorsV3"]] == ["V000001", "V000002", "V000001"]
+
+
+def test_throttled_requests_only_wait_for_retry_after(tmp_path):
+    server_options = {"throttle_rate": 0.3, "seed": 1, "retry_after": "0"}
+    messages = vendor_messages([f"V{i:06d}" for i in range(10)])
+    state, stats = run_target(tmp_path, {"min_requests_per_second": 100}, server_options, messages=messages)
+
+    summary = state["summary"]["VendorsV3"]
+    assert counters(summary)["updated"] == 10
+    assert stats["throttled"] and summary["retries"] == stats["throttled"]
+    # the limiter waited for Retry-After, backoff didn't sleep on top of it
+    assert "retry_wait_seconds" not in summary
+
+
+def test_planned_window_defers_a_repeated_lookup_key(tmp_path):
+    accounts = ["V000001", "V000002", "V000001", "V000003"]
+    state, stats = run_target(tmp_path, {"plan_upserts": True}, messages=vendor_messages(accounts))
+
+    log = [line for line in stats["log"] if "VendorsV3" in line]
+    patches = [index for index, line in enumerate(log) if line.startswith("PATCH")]
+    assert len(patches) == 4
+    # the second V000001 is looked up again once the first one was written,
+    # instead of being planned from the same prefetched lookup
+    last_lookup = max(index for index, line in enumerate(log) if line.startswith("GET") and "V000001" in line)
+    assert last_lookup > patches[0]
+    assert counters(state["summary"]["VendorsV3"]) == {"success": 0, "fail": 0, "existing": 0, "updated": 4}
+    assert [bookmark["id"] for bookmark in state["bookmarks"]["VendorsV3"]] == [
+        "V000001",
+        "V000002",
+        "V000003",
+        "V000001",
+    ]
+
+
+def test_state_of_batch_mode(tmp_path):
+    accounts = ["V000001", None, "V000002", None, "V000003"]
+    messages = vendor_messages(accounts)
+    state, stats = run_target(tmp_path, {"batch_mode": True}, messages=messages)
+
+    # creates and updates of the window went out as $batch requests
+    assert stats["requests"]["POST /data/$batch"] == 2
+    assert "POST /data/VendorsV3" not in stats["requests"]
+    assert counters(state["summary"]["VendorsV3"]) == {"success": 2, "fail": 0, "existing": 0, "updated": 3}
+    bookmarks = state["bookmarks"]["VendorsV3"]
+    assert len(bookmarks) == 5
+    assert all(bookmark["success"] and bookmark["id"] for bookmark in bookmarks)
+
+
+def test_state_of_bulk_mode(tmp_path):
+    messages = vendor_messages(["V000001", "V000002", "V000003"])
+    # the mock server fails the rows with a value starting with FAIL
+    messages[2]["record"]["VendorOrganizationName"] = "FAIL duplicate name"
+    state, stats = run_target(tmp_path, {"bulk_mode": True, "dmf_poll_interval": 0.01}, messages=messages)
+
+    assert "PATCH /data/VendorsV3" not in stats["requests"]
+    assert any("ImportFromPackage" in line for line in stats["log"])
+    assert counters(state["summary"]["VendorsV3"]) == {"success": 2, "fail": 1, "existing": 0, "updated": 0}
+    bookmarks = state["bookmarks"]["VendorsV3"]
+    assert [(bookmark["id"], bookmark["success"]) for bookmark in bookmarks] == [
+        ("V000001", True),
+        ("V000002", False),
+        ("V000003", True),
+    ]
+    assert all(bookmark["dmf_execution_id"] for bookmark in bookmarks)
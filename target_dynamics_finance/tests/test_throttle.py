@@ -0,0 +1,32 @@
+"""Tests for the adaptive rate limiter."""
+
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from target_dynamics_finance.throttle import RateLimiter, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < parse_retry_after(retry_at) <= 30
+
+
+def test_throttling_halves_rate_and_pauses():
+    limiter = RateLimiter(max_rate=100, min_rate=10)
+    limiter.on_throttled(retry_after=0.1)
+
+    assert limiter.rate == 50
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+    limiter.on_success()
+    assert limiter.rate == 50.5
+
+    for _ in range(10):
+        limiter.on_throttled(retry_after=0)
+    assert limiter.rate == 10
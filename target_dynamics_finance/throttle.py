@@ -0,0 +1,77 @@
+"""Request rate control shared by every sink and worker."""
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+DEFAULT_MAX_RATE = 50.0
+DEFAULT_MIN_RATE = 1.0
+# pause used when a throttled response has no Retry-After header
+DEFAULT_THROTTLE_PAUSE = 5.0
+# requests per second given back after every successful request
+ADDITIVE_INCREASE = 0.5
+MULTIPLICATIVE_DECREASE = 0.5
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the seconds to wait from a Retry-After header (seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiter:
+    """Token bucket whose rate adapts with AIMD to Dynamics throttling.
+
+    The rate grows additively on every successful request up to `max_rate`
+    and is halved, down to `min_rate`, when Dynamics throttles a request. A
+    Retry-After holds every request until it has elapsed.
+    """
+
+    def __init__(self, max_rate: float = DEFAULT_MAX_RATE, min_rate: float = DEFAULT_MIN_RATE) -> None:
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until a request may be sent, returning the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._paused_until - now
+                if delay <= 0:
+                    self._tokens = min(self._tokens + (now - self._updated) * self.rate, max(self.rate, 1.0))
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + ADDITIVE_INCREASE, self.max_rate)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = max(self.rate * MULTIPLICATIVE_DECREASE, self.min_rate)
+            pause = DEFAULT_THROTTLE_PAUSE if retry_after is None else retry_after
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)